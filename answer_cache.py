@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# cosine similarity two query embeddings need to share the same answer
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_ENTRIES = 2000
+
+
+class AnswerCache:
+    """
+    Semantic cache of answers, keyed by (mode, namespace, index version) and the query embedding. A query is a
+    hit when an earlier query of the same key is at least `threshold` similar, so near duplicates
+    ("what is backprop?" / "What is backprop") skip retrieval, rerank and generation. Entries expire
+    after `ttl` seconds, the least recently used go first past `max_entries`, and the answers of a
+    namespace are dropped when new documents are ingested into it.
+    """
+
+    def __init__(self, embeddings, threshold=DEFAULT_THRESHOLD, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # entry id -> (key, normalized vector, answer, created)
+        self._entries = OrderedDict()
+        self._ids = 0
+        # key -> (entry ids, stacked vectors), rebuilt lazily after the entries of the key change
+        self._matrices = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._latency = {True: deque(maxlen=1000), False: deque(maxlen=1000)}
+        # best similarity of recent lookups, to see where the threshold should sit
+        self._similarities = deque(maxlen=1000)
+
+    def _matrix(self, key):
+        cached = self._matrices.get(key)
+        if cached is None:
+            ids = [entry_id for entry_id, entry in self._entries.items() if entry[0] == key]
+            vectors = np.stack([self._entries[entry_id][1] for entry_id in ids]) if ids else None
+            cached = (ids, vectors)
+            self._matrices[key] = cached
+        return cached
+
+    def _expire(self, now):
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry[3] > self.ttl]
+        for entry_id in expired:
+            key = self._entries.pop(entry_id)[0]
+            self._matrices.pop(key, None)
+        self.expirations += len(expired)
+
+    def lookup(self, query, key):
+        """returns (answer or None, query vector), the vector is what store() expects back"""
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1
+        with self._lock:
+            self._expire(time.time())
+            ids, vectors = self._matrix(key)
+            if vectors is None:
+                self.misses += 1
+                return None, vector
+            similarities = vectors @ vector
+            best = int(np.argmax(similarities))
+            self._similarities.append(float(similarities[best]))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None, vector
+            self.hits += 1
+            self._entries.move_to_end(ids[best])
+            return self._entries[ids[best]][2], vector
+
+    def store(self, vector, key, answer):
+        with self._lock:
+            self._ids += 1
+            self._entries[self._ids] = (key, vector, answer, time.time())
+            self._matrices.pop(key, None)
+            while len(self._entries) > self.max_entries:
+                _, (old_key, _, _, _) = self._entries.popitem(last=False)
+                self._matrices.pop(old_key, None)
+                self.evictions += 1
+
+    def invalidate(self, match=None):
+        """
+        drops the answers whose key satisfies match(key), or every answer without it,
+        called when the indexed documents change
+        """
+        with self._lock:
+            if match is None:
+                self._entries.clear()
+                self._matrices.clear()
+            else:
+                for entry_id in [entry_id for entry_id, entry in self._entries.items() if match(entry[0])]:
+                    self._matrices.pop(self._entries.pop(entry_id)[0], None)
+            self.invalidations += 1
+
+    def record_latency(self, hit, seconds):
+        with self._lock:
+            self._latency[hit].append(seconds)
+
+    def stats(self):
+        """hit rate, latency of hits and misses and the similarity distribution, for tuning the threshold"""
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            def percentiles(values):
+                if not values:
+                    return None
+                p50, p90, p99 = np.percentile(list(values), [50, 90, 99])
+                return {"p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+            return {
+                "threshold": self.threshold,
+                "lookups": lookups,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_latency": percentiles(self._latency[True]),
+                "miss_latency": percentiles(self._latency[False]),
+                "best_similarity": percentiles(self._similarities),
+            }
@@ -0,0 +1,72 @@
+"""
+Hit rate and latency of the semantic answer cache on a classroom like workload: a few questions
+asked over and over with small variations, answered by a fake retriever and chat model.
+Sweeps the similarity threshold so it can be tuned.
+
+    python benchmarks/bench_answer_cache.py --queries 300
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.prompts import PromptTemplate
+from langchain_core.documents import Document
+
+from answer_cache import AnswerCache
+from benchmarks.fakes import HashingEmbeddings, fake_chat_model, fake_retriever
+from rag_chain import AnswerStream
+from utils import get_template
+
+QUESTIONS = [
+    "what is backpropagation",
+    "explain the attention mechanism in transformers",
+    "what is the difference between supervised and unsupervised learning",
+    "how does gradient descent work",
+    "what is overfitting and how do we prevent it",
+    "summarize the main contribution of the paper",
+]
+FILLERS = ["please", "can you", "briefly", "in simple terms", "again"]
+
+
+def variant(question, rng):
+    words = question.split()
+    if rng.random() < 0.5:
+        words.insert(0, rng.choice(FILLERS))
+    text = " ".join(words)
+    if rng.random() < 0.5:
+        text = text.capitalize() + "?"
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.99, 0.95, 0.9, 0.85])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    workload = [variant(rng.choice(QUESTIONS), rng) for _ in range(args.queries)]
+    retriever = fake_retriever([Document(page_content="context")], latency=0.05)
+    answer_chain = create_stuff_documents_chain(
+        llm=fake_chat_model(answer="an answer " * 10, token_latency=0.0005),
+        prompt=PromptTemplate.from_template(get_template("default")),
+    )
+
+    for threshold in args.thresholds:
+        cache = AnswerCache(HashingEmbeddings(dim=256, latency=0), threshold=threshold)
+        for query in workload:
+            for _ in AnswerStream(retriever, answer_chain, query, answer_cache=cache, cache_key=("default", 0)):
+                pass
+        stats = cache.stats()
+        hit = stats["hit_latency"]["p50"] * 1000 if stats["hit_latency"] else float("nan")
+        print(f"threshold {threshold:.2f}  hit rate {stats['hit_rate']:.2f}  entries {stats['entries']:3d}  "
+              f"p50 hit {hit:6.2f}ms  p50 miss {stats['miss_latency']['p50'] * 1000:6.1f}ms  "
+              f"best similarity p50 {stats['best_similarity']['p50']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Chunking a batch of synthetic documents: langchain's RecursiveCharacterTextSplitter making a
+string and a Document per chunk (what index_chunks used to get) against the offset splitter of
+chunker.py making one record array, sequentially and in the process pool. Reports chunks/s, the
+python heap peak of holding the chunks, and checks that the chunk boundaries are the same.
+
+    python benchmarks/bench_chunker.py --documents 200 --pages 10
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.corpus import document_pages
+from chunker import OffsetSplitter, chunk_documents, join_pages
+from paper_pipeline import get_parse_pool
+
+
+def langchain_chunks(documents, text_splitter):
+    return [
+        Document(page_content=chunk, metadata={"doc": doc})
+        for doc, pages in enumerate(documents)
+        for chunk in text_splitter.split_text(join_pages(pages)[0])
+    ]
+
+
+def measure(name, fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    # the heap peak is measured on its own run, tracemalloc slows everything down
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:34} {len(result):8d} {len(result) / best:12.0f} {peak / (1024 * 1024):10.1f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--words-per-page", type=int, default=450)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    documents = [document_pages(doc, pages=args.pages, words_per_page=args.words_per_page)[0] for doc in range(args.documents)]
+    size = sum(len(page) for pages in documents for page in pages)
+    print(f"{args.documents} documents, {size / (1024 * 1024):.1f}M characters, {os.cpu_count()} cpus")
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    splitter = OffsetSplitter.like(text_splitter)
+    pool = get_parse_pool()
+    # start the workers before timing
+    chunk_documents(documents[:1], splitter, pool=pool)
+
+    print(f"{'':34} {'chunks':>8} {'chunks/s':>12} {'peak MB':>10}")
+    reference = measure("langchain split_text + Documents", lambda: langchain_chunks(documents, text_splitter), args.repeat)
+    batch = measure("offset splitter", lambda: chunk_documents(documents, splitter), args.repeat)
+    pooled = measure("offset splitter, process pool", lambda: chunk_documents(documents, splitter, pool=pool), args.repeat)
+
+    expected = [document.page_content for document in reference]
+    for name, result in (("offset splitter", batch), ("process pool", pooled)):
+        chunks = [result.chunk(i) for i in range(len(result))]
+        print(f"{name}: {'same chunks as langchain' if chunks == expected else 'CHUNKS DIFFER'}, records {result.nbytes / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
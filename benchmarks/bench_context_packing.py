@@ -0,0 +1,74 @@
+"""
+Prompt tokens before and after context packing, for reranked results where several chunks are
+neighbours in the same document (the usual case when a question is about one section of a paper).
+Also checks that every merged passage is a contiguous piece of the original text, i.e. the
+overlap between neighbouring chunks was removed and nothing else.
+
+    python benchmarks/bench_context_packing.py --queries 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from context_packing import ContextPacker
+from utils import get_template
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--results", type=int, default=8)
+    parser.add_argument("--budget", type=int, default=3000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    words = [f"word{i}" for i in range(500)]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    sources = {}
+    for source in ("a.pdf", "b.pdf", "c.pdf"):
+        sentences = (" ".join(words[i] for i in rng.integers(0, len(words), 12)) + "." for _ in range(400))
+        sources[source] = "\n".join(sentences)
+    chunks = {
+        source: [Document(page_content=chunk, metadata={"source_type": "pdf", "source": source, "chunk_index": i})
+                 for i, chunk in enumerate(splitter.split_text(text))]
+        for source, text in sources.items()
+    }
+
+    stats = {}
+    packer = ContextPacker(args.budget, get_template("PDF RAG"), stats)
+    before, after, seconds, passages, broken = [], [], [], [], 0
+    for _ in range(args.queries):
+        # a couple of sections with neighbouring chunks, the rest scattered
+        results = []
+        for source in rng.choice(list(chunks), 2, replace=False):
+            start = int(rng.integers(0, len(chunks[source]) - 3))
+            results += chunks[source][start:start + 3]
+        while len(results) < args.results:
+            source = rng.choice(list(chunks))
+            results.append(chunks[source][int(rng.integers(0, len(chunks[source])))])
+        order = rng.permutation(len(results))
+        results = [results[i] for i in order]
+
+        start = time.perf_counter()
+        packed = packer(results)
+        seconds.append(time.perf_counter() - start)
+        before.append(stats["prompt_tokens_before"])
+        after.append(stats["prompt_tokens_after"])
+        passages.append(len(packed))
+        broken += sum(document.page_content not in sources[document.metadata["source"]] for document in packed)
+
+    print(f"prompt tokens  before p50 {np.percentile(before, 50):6.0f}  max {max(before):6.0f}")
+    print(f"prompt tokens  after  p50 {np.percentile(after, 50):6.0f}  max {max(after):6.0f}  (budget {args.budget} + template)")
+    print(f"passages per prompt {np.mean(passages):.1f} from {args.results} chunks, pack p50 {np.percentile(seconds, 50) * 1000:.3f}ms")
+    print(f"passages that are not a piece of their source: {broken}")
+
+
+if __name__ == "__main__":
+    main()
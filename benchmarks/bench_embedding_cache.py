@@ -0,0 +1,59 @@
+"""
+Embedding cache against a local fake embedder: a cold pass, a warm pass over the same
+texts and a pass in a second instance opened while the first one still owns the files, which
+has to read the cache from disk (read only, like service.py next to the app).
+
+    python benchmarks/bench_embedding_cache.py --texts 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import CachedEmbeddings
+from benchmarks.fakes import FakeEmbeddings
+
+
+def run(cache, texts, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        cache.embed_documents(texts[i:i + batch_size])
+    for text in texts[:100]:
+        cache.embed_query(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=96)
+    parser.add_argument("--dim", type=int, default=1024)
+    args = parser.parse_args()
+
+    texts = [f"chunk {i} " + "lorem ipsum dolor sit amet " * 30 for i in range(args.texts)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fake = FakeEmbeddings(dim=args.dim)
+        uncached = run(fake, texts, args.batch_size)
+
+        cache = CachedEmbeddings(FakeEmbeddings(dim=args.dim), "fake", cache_dir=cache_dir)
+        cold = run(cache, texts, args.batch_size)
+        warm = run(cache, texts, args.batch_size)
+        print(f"stats after warm pass: {cache.stats()}")
+        cache.flush()
+
+        reopened = CachedEmbeddings(FakeEmbeddings(dim=args.dim), "fake", cache_dir=cache_dir)
+        from_disk = run(reopened, texts, args.batch_size)
+        print(f"stats after reopen: {reopened.stats()}")
+        assert reopened.stats()["hits"] > 0, "the reopened cache served nothing from disk"
+
+    print(f"no cache      {uncached:.3f}s")
+    print(f"cold cache    {cold:.3f}s")
+    print(f"warm cache    {warm:.3f}s  ({uncached / warm:.1f}x)")
+    print(f"from disk     {from_disk:.3f}s  ({uncached / from_disk:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Folder sync over a synthetic folder of small text files: the first sync, a re-sync with nothing
+changed (the case that has to stay fast), and re-syncs after touching, editing and deleting some
+files. Indexing is a counter here, the point is how much of the folder each sync has to read.
+
+    python benchmarks/bench_folder_sync.py --files 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from folder_sync import FolderState, sync_folder
+from paper_pipeline import get_parse_pool
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--changes", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        folder = os.path.join(root, "notes")
+        for i in range(args.files):
+            directory = os.path.join(folder, f"course{i % 50}")
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"note{i}.txt"), "w") as f:
+                f.write(f"lecture note {i} " * 200)
+
+        state = FolderState(os.path.join(root, "state.json"))
+        indexed, removed = [], []
+        pool = get_parse_pool()
+
+        def run(name):
+            indexed.clear()
+            removed.clear()
+            start = time.perf_counter()
+            stats = sync_folder(folder, state, lambda path, doc_hash, pages: indexed.append(path), removed.append, pool)
+            print(f"{name:18s} {time.perf_counter() - start:7.2f}s  indexed {len(indexed):6d}  removed {len(removed):4d}  {stats}")
+
+        run("first sync")
+        run("nothing changed")
+        paths = sorted(state.files)[:args.changes]
+        for path in paths:
+            os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        run("touched")
+        for path in paths:
+            with open(path, "a") as f:
+                f.write("edited")
+        run("edited")
+        for path in paths:
+            os.remove(path)
+        run("deleted")
+        # a new state file, like a fresh checkout with the index already there
+        state = FolderState(os.path.join(root, "missing.json"))
+        run("lost state")
+
+
+if __name__ == "__main__":
+    main()
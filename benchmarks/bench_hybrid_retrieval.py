@@ -0,0 +1,129 @@
+"""
+Latency and recall@k of dense, BM25 and hybrid (reciprocal rank fusion) retrieval on a synthetic
+corpus. Every chunk is a mix of topic words plus one rare term (think acronyms, equation names,
+paper titles), a query asks for that rare term with a few topic words and the chunk holding it is
+the one to find. The dense side is an embedder that only captures the topic of a text (plus some
+noise) over the local NumPy index, a stand-in for an embedding that gets the meaning but blurs
+rare exact terms.
+
+    python benchmarks/bench_hybrid_retrieval.py --chunks 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings, fake_vector
+from hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+from lexical_index import LexicalIndex
+from local_index import LocalVectorStore, NumpyIndex
+
+
+class TopicEmbeddings(FakeEmbeddings):
+    """average of the topic vectors of the known words plus noise seeded by the text, rare words are not seen"""
+
+    def __init__(self, vocabulary, dim):
+        super().__init__(dim=dim, latency=0.0, per_text=0.0)
+        self.topics = {word: np.asarray(fake_vector(f"topic{i // 20}", dim)) for i, word in enumerate(vocabulary)}
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            known = [self.topics[word] for word in text.split() if word in self.topics]
+            vector = np.mean(known, axis=0) if known else np.zeros(self.dim, dtype=np.float32)
+            vector = vector + 0.3 * np.asarray(fake_vector(text, self.dim))
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+
+def make_corpus(chunks, words_per_chunk, topics, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"word{i}" for i in range(topics * 20)]
+    texts, rare_terms = [], []
+    for i in range(chunks):
+        topic = rng.integers(0, topics)
+        words = [vocabulary[topic * 20 + j] for j in rng.integers(0, 20, words_per_chunk)]
+        rare = f"acr{i:x}z"
+        words.insert(int(rng.integers(0, len(words))), rare)
+        texts.append(" ".join(words))
+        rare_terms.append((rare, topic))
+    return texts, rare_terms, vocabulary
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--words", type=int, default=150)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    texts, rare_terms, vocabulary = make_corpus(args.chunks, args.words, args.topics)
+    ids = [str(i) for i in range(len(texts))]
+    documents = [Document(page_content=text, metadata={"source_type": "pdf"}) for text in texts]
+    embeddings = TopicEmbeddings(vocabulary, args.dim)
+
+    with tempfile.TemporaryDirectory() as path:
+        index = NumpyIndex(os.path.join(path, "vectors"), dim=args.dim, ann=False)
+        vectors = embeddings.embed_documents(texts)
+        index.upsert(vectors=[(i, v, {"text": t, "source_type": "pdf"}) for i, v, t in zip(ids, vectors, texts)])
+        store = LocalVectorStore(index, embeddings)
+
+        lexical = LexicalIndex(os.path.join(path, "lexical.sqlite"))
+        start = time.perf_counter()
+        for i in range(0, len(documents), 500):
+            lexical.add(ids[i:i + 500], documents[i:i + 500])
+        build = time.perf_counter() - start
+        size = os.path.getsize(lexical.path) + sum(
+            os.path.getsize(lexical.path + suffix) for suffix in ("-wal", "-shm") if os.path.exists(lexical.path + suffix)
+        )
+        print(f"bm25 index  {len(documents) / build:8.0f} chunks/s incremental, {size / 1e6:.1f}MB on disk")
+        start = time.perf_counter()
+        lexical.add(["extra"], [Document(page_content="one more chunk about acrextra", metadata={})])
+        print(f"bm25 add one chunk {1000 * (time.perf_counter() - start):.2f}ms")
+
+        retriever = HybridRetriever(vectorstore=store, lexical=lexical, k=args.k, fetch_k=2 * args.k, filter={"source_type": "pdf"})
+        rng = np.random.default_rng(1)
+        targets = rng.integers(0, len(texts), args.queries)
+        queries = []
+        for target in targets:
+            rare, topic = rare_terms[target]
+            words = [vocabulary[topic * 20 + j] for j in rng.integers(0, 20, 3)]
+            queries.append(" ".join([*words, rare]))
+
+        methods = {
+            "dense": lambda query: retriever._vector_search(query, retriever.namespace)[0][:args.k],
+            "bm25": lambda query: retriever._lexical_search(query, retriever.namespace)[:args.k],
+            "hybrid": lambda query: retriever.invoke(query),
+        }
+        for name, search in methods.items():
+            times, hits = [], 0
+            for target, query in zip(targets, queries):
+                start = time.perf_counter()
+                results = search(query)
+                times.append(time.perf_counter() - start)
+                hits += texts[target] in {document.page_content for document in results}
+            print(f"{name:7s} recall@{args.k} {hits / len(queries):.3f}  "
+                  f"p50 {percentile_ms(times, 50):7.2f}ms  p99 {percentile_ms(times, 99):7.2f}ms")
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            reciprocal_rank_fusion([documents[:20], documents[10:30]], limit=args.k)
+        print(f"rrf of 2x20  {(time.perf_counter() - start):.3f}ms per fusion")
+        lexical.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Cold start profile: runs each snippet in a fresh interpreter with `-X importtime` and reports
+the wall time and the slowest imports. With --ref the same snippets also run against an older
+revision checked out in a temporary git worktree, e.g. the commit before the lazy imports.
+
+    python benchmarks/bench_import_time.py --ref HEAD~1
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPETS = {
+    "import rag_chain": "import rag_chain",
+    "import utils": "import utils",
+    "first category lookup": "import utils; utils.find_closest_category('machine learning papers')",
+}
+
+
+def profile(cwd, code):
+    """wall time in seconds and the (cumulative us, module) of the slowest direct imports"""
+    wrapped = f"import time; _start = time.perf_counter(); {code}; print('WALL', time.perf_counter() - _start)"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", wrapped], cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1:]
+    wall = float(result.stdout.split("WALL")[-1])
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # the imports one level below the snippet, their cumulative time includes what they pull in
+        if name.startswith("  ") and not name.startswith("    "):
+            imports.append((int(cumulative), name.strip()))
+    return wall, sorted(imports, reverse=True)[:5]
+
+
+def report(label, cwd):
+    print(label)
+    for name, code in SNIPPETS.items():
+        wall, top = profile(cwd, code)
+        if wall is None:
+            print(f"  {name:<24} failed: {' '.join(top)}")
+            continue
+        slowest = ", ".join(f"{module} {us / 1000:.0f}ms" for us, module in top)
+        print(f"  {name:<24} {wall * 1000:7.0f}ms   {slowest}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ref", help="git revision to compare against")
+    args = parser.parse_args()
+
+    report("working tree", ROOT)
+    if args.ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            worktree = os.path.join(tmp, "ref")
+            subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], cwd=ROOT, check=True, capture_output=True)
+            try:
+                report(args.ref, worktree)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=ROOT, capture_output=True)
+
+
+if __name__ == "__main__":
+    main()
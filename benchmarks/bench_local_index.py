@@ -0,0 +1,98 @@
+"""
+Query latency of the local NumPy index, exact (with and without the source_type filter every UI
+query has) and approximate (IVF), with the recall@k of the approximate search against the exact
+one, how long an upsert holds the index while saving its metadata, and the time to reopen the
+index from disk.
+The vectors are drawn around random cluster centres so the data has some structure, like
+real embeddings do.
+
+    python benchmarks/bench_local_index.py --vectors 100000 --dim 1024
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from local_index import NumpyIndex
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--text-chars", type=int, default=1000, help="chunk text stored in the metadata")
+    args = parser.parse_args()
+    source_types = ("pdf", "paper", "youtube", "folder")
+    text = "x" * args.text_chars
+
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((256, args.dim)).astype(np.float32)
+    labels = rng.integers(0, len(centres), args.vectors)
+    vectors = centres[labels] + 0.5 * rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    queries = centres[rng.integers(0, len(centres), args.queries)] + 0.5 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as path:
+        index = NumpyIndex(path, dim=args.dim, ann=False)
+        start = time.perf_counter()
+        for i in range(0, args.vectors, 1000):
+            index.upsert(vectors=[
+                (str(j), vectors[j], {"text": text, "source_type": source_types[j % len(source_types)], "source": f"doc {j // 50}"})
+                for j in range(i, min(i + 1000, args.vectors))
+            ])
+        index.flush()
+        print(f"upsert   {args.vectors / (time.perf_counter() - start):8.0f} vectors/s")
+
+        # one more batch once the save interval has passed, the time it takes includes saving
+        index._last_save = 0
+        start = time.perf_counter()
+        index.upsert(vectors=[(f"late {j}", vectors[j], {"text": text, "source_type": "pdf"}) for j in range(100)])
+        print(f"upsert of 100 vectors when the index saves {(time.perf_counter() - start) * 1000:7.1f}ms")
+
+        exact_ids, exact_times = [], []
+        for query in queries:
+            start = time.perf_counter()
+            matches = index.query(vector=query, top_k=args.k)["matches"]
+            exact_times.append(time.perf_counter() - start)
+            exact_ids.append({match["id"] for match in matches})
+        print(f"exact    p50 {percentile_ms(exact_times, 50):7.2f}ms  p99 {percentile_ms(exact_times, 99):7.2f}ms")
+        filtered_times = []
+        for query in queries:
+            start = time.perf_counter()
+            matches = index.query(vector=query, top_k=args.k, filter={"source_type": {"$in": ["pdf", "folder"]}})["matches"]
+            filtered_times.append(time.perf_counter() - start)
+            assert all(match["metadata"]["source_type"] in ("pdf", "folder") for match in matches)
+        print(f"filtered p50 {percentile_ms(filtered_times, 50):7.2f}ms  p99 {percentile_ms(filtered_times, 99):7.2f}ms")
+
+        index.ann, index.ann_threshold, index.nprobe = True, 0, args.nprobe
+        start = time.perf_counter()
+        index.query(vector=queries[0], top_k=args.k)
+        print(f"ivf build {time.perf_counter() - start:.2f}s")
+        ann_times, recalls = [], []
+        for query, expected in zip(queries, exact_ids):
+            start = time.perf_counter()
+            matches = index.query(vector=query, top_k=args.k)["matches"]
+            ann_times.append(time.perf_counter() - start)
+            recalls.append(len(expected & {match["id"] for match in matches}) / args.k)
+        print(f"ivf      p50 {percentile_ms(ann_times, 50):7.2f}ms  p99 {percentile_ms(ann_times, 99):7.2f}ms  "
+              f"recall@{args.k} {np.mean(recalls):.3f} (nprobe {args.nprobe})")
+
+        start = time.perf_counter()
+        reopened = NumpyIndex(path, dim=args.dim)
+        reopened.query(vector=queries[0], top_k=args.k)
+        print(f"reopen + first query {time.perf_counter() - start:.2f}s ({reopened.count} vectors)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Sequential get_pdf_to_text loop against the concurrent fetch/parse pipeline, served by a local
+HTTP stand-in that answers every PDF after a random delay.
+
+    python benchmarks/bench_paper_fetch.py --papers 10
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# downloads land in the PDF cache, a fresh one so nothing is cached from an earlier run
+os.environ["VERI_CACHE_DIR"] = tempfile.mkdtemp(prefix="veri-papers-")
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import make_pdf
+from paper_pipeline import fetch_papers
+from utils import get_pdf_to_text
+
+
+def serve(pdfs, delays):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            number = int(self.path.strip("/").split(".")[0])
+            time.sleep(delays[number])
+            body = pdfs[number]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--papers", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    pdfs = [make_pdf(pages=args.pages, seed=i) for i in range(args.papers)]
+    delays = [random.uniform(0.2, 0.8) for _ in range(args.papers)]
+    server = serve(pdfs, delays)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    papers = [{"title": f"paper {i}", "link": f"{base}/{i}.pdf"} for i in range(args.papers)]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+    start = time.perf_counter()
+    sequential_chunks = 0
+    for paper in papers:
+        sequential_chunks += len(splitter.split_text(get_pdf_to_text(paper["link"], source="arxiv")))
+    sequential = time.perf_counter() - start
+
+    # other URLs for the same PDFs, the sequential run has cached the first ones
+    papers = [dict(paper, link=paper["link"] + "?concurrent") for paper in papers]
+    start = time.perf_counter()
+    chunks = []
+    fetch_papers(papers, "arxiv", lambda paper, text: chunks.append(len(splitter.split_text(text))) or chunks[-1])
+    concurrent = time.perf_counter() - start
+    server.shutdown()
+
+    print(f"slowest download {max(delays):.3f}s, sum of downloads {sum(delays):.3f}s")
+    print(f"sequential  {sequential:.3f}s  {sequential_chunks} chunks")
+    print(f"concurrent  {concurrent:.3f}s  {sum(chunks)} chunks  ({sequential / concurrent:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Paper search latency, cold and repeated, against a local stand-in for the arXiv API that answers
+after a fixed delay, plus the Atom feed parser (ElementTree) against the BeautifulSoup one it
+replaced and the category resolution with and without its cache.
+
+    python benchmarks/bench_paper_search.py --entries 10 --delay 0.3
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+
+def make_feed(entries):
+    items = "".join(
+        f"""<entry><id>http://arxiv.org/abs/24{i:02d}.0{i:04d}v1</id><title>A  study
+  of thing {i}</title><summary>{"word " * 150}</summary>
+<author><name>Someone</name></author>
+<link href="http://arxiv.org/abs/24{i:02d}.0{i:04d}v1" rel="alternate" type="text/html"/>
+<link title="pdf" href="http://arxiv.org/pdf/24{i:02d}.0{i:04d}v1" rel="related" type="application/pdf"/>
+</entry>"""
+        for i in range(entries)
+    )
+    return f'<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom"><title>query</title>{items}</feed>'.encode()
+
+
+def parse_xml_bs4(xml_data):
+    """the parser before this change, for comparison"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(xml_data, 'xml')
+    return [
+        {'title': entry.title.text.strip() if entry.title else None,
+         'link': entry.find('link', {'type': 'text/html'})['href'] if entry.find('link', {'type': 'text/html'}) else None}
+        for entry in soup.find_all('entry')
+    ]
+
+
+def serve(feed, delay):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/atom+xml")
+            self.send_header("Content-Length", str(len(feed)))
+            self.end_headers()
+            self.wfile.write(feed)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.3)
+    args = parser.parse_args()
+
+    feed = make_feed(args.entries)
+    old_ms, old = timed(lambda: parse_xml_bs4(feed), 50)
+    new_ms, new = timed(lambda: utils.parse_xml(feed), 50)
+    assert old == new
+    print(f"parse {args.entries} entries  beautifulsoup {old_ms:.2f}ms  elementtree {new_ms:.3f}ms")
+
+    query = "latest papers on machine learning please"
+    cold_ms, category = timed(lambda: utils.find_closest_category(query))
+    warm_ms, _ = timed(lambda: utils.find_closest_category(query), 1000)
+    print(f"category {category}  first {cold_ms:.3f}ms  cached {warm_ms:.4f}ms")
+
+    server = serve(feed, args.delay)
+    utils.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/api/query?"
+    cold_ms, (source, papers) = timed(lambda: utils.get_papers_from_query(query))
+    warm_ms, _ = timed(lambda: utils.get_papers_from_query(query), 1000)
+    print(f"search ({source}, {len(papers)} papers)  first {cold_ms:.1f}ms  repeated {warm_ms:.4f}ms")
+
+    # many sessions searching the same subject at once only make one request
+    utils._search_cache.clear()
+    threads = [threading.Thread(target=utils.get_papers_from_query, args=(query,)) for _ in range(20)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"20 concurrent identical searches {1000 * (time.perf_counter() - start):.1f}ms  {utils.search_cache_stats()['searches']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
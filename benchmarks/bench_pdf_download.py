@@ -0,0 +1,142 @@
+"""
+PDF downloads from a local HTTP stand-in that sends ETags and answers conditional requests:
+python heap peak of one large download (the old response.content against streaming to the PDF
+cache), cold / cached / revalidated downloads of a batch of papers, and how much of an HTML page
+or an oversized PDF the server got to send before the download was rejected.
+
+    python benchmarks/bench_pdf_download.py --papers 20 --large-mb 40
+"""
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import make_pdf
+from pdf_download import PDFCache
+from utils import REQUEST_TIMEOUT, download_pdf, get_session
+
+
+def serve(bodies):
+    """path -> (content type, body), bodies under /stream/ are sent chunked without a Content-Length"""
+    sent = {"bytes": 0, "not_modified": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            content_type, body = bodies[self.path]
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                sent["not_modified"] += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("ETag", etag)
+            chunked = self.path.startswith("/stream/")
+            self.send_header("Transfer-Encoding" if chunked else "Content-Length", "chunked" if chunked else str(len(body)))
+            self.end_headers()
+            try:
+                for start in range(0, len(body), 256 * 1024):
+                    block = body[start:start + 256 * 1024]
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(block), block) if chunked else block)
+                    sent["bytes"] += len(block)
+                if chunked:
+                    self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # the client stopped reading a rejected download
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            # connections dropped by the client after a rejection
+            pass
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, sent
+
+
+def old_download(url):
+    # what download_pdf did: the whole body in memory, then a BytesIO over it for the parser
+    response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+    return io.BytesIO(response.content)
+
+
+def heap_peak(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--papers", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--large-mb", type=int, default=40)
+    args = parser.parse_args()
+
+    large = b"%PDF-1.7\n" + os.urandom(args.large_mb * 1024 * 1024)
+    bodies = {f"/paper/{i}.pdf": ("application/pdf", make_pdf(pages=args.pages, seed=i)) for i in range(args.papers)}
+    bodies["/large.pdf"] = ("application/pdf", large)
+    bodies["/stream/large.pdf"] = ("application/octet-stream", large)
+    bodies["/login.pdf"] = ("text/html", b"<html>" + b"please log in " * 20000 + b"</html>")
+    bodies["/stream/login.pdf"] = ("application/octet-stream", b"<html>" + b"please log in " * 20000 + b"</html>")
+    server, sent = serve(bodies)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    session = get_session()
+
+    with tempfile.TemporaryDirectory() as root:
+        cache = PDFCache(path=os.path.join(root, "large"), max_bytes=2 * len(large))
+        old_peak, old_seconds = heap_peak(lambda: old_download(f"{base}/large.pdf"))
+        new_peak, new_seconds = heap_peak(lambda: download_pdf(f"{base}/large.pdf", source="arxiv", cache=cache))
+        print(f"{args.large_mb}MB download    python heap peak   seconds")
+        print(f"response.content       {old_peak:12.1f}MB {old_seconds:9.2f}")
+        print(f"streamed to the cache  {new_peak:12.1f}MB {new_seconds:9.2f}")
+
+        cache = PDFCache(path=os.path.join(root, "papers"))
+        urls = [f"{base}/paper/{i}.pdf" for i in range(args.papers)]
+        print(f"\n{args.papers} papers              seconds   bytes sent   304s")
+        for name in ("cold", "cached", "revalidated"):
+            if name == "revalidated":
+                # past the freshness window, every paper is checked with its ETag
+                cache.fresh_seconds = 0
+            before_bytes, before_304 = sent["bytes"], sent["not_modified"]
+            start = time.perf_counter()
+            paths = [download_pdf(url, source="arxiv", session=session, cache=cache) for url in urls]
+            seconds = time.perf_counter() - start
+            assert all(paths)
+            print(f"{name:22} {seconds:8.3f} {sent['bytes'] - before_bytes:12d} {sent['not_modified'] - before_304:6d}")
+
+        cache = PDFCache(path=os.path.join(root, "rejected"), max_bytes=len(large) // 4)
+        print(f"\nrejected                     bytes the server wrote before the client hung up")
+        for name, path in (("html by Content-Type", "/login.pdf"), ("html by first bytes", "/stream/login.pdf"),
+                           ("too large by Content-Length", "/large.pdf"), ("too large while streaming", "/stream/large.pdf")):
+            before = sent["bytes"]
+            assert download_pdf(base + path, source="arxiv", session=session, cache=cache) is None
+            # the server notices the closed connection a little later
+            time.sleep(0.2)
+            print(f"{name:28} {sent['bytes'] - before:12d} of {len(bodies[path][1])}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Text extraction on large synthetic PDFs: the old page by page `text +=` loops (PyPDF2 for
+uploads, fitz for downloads) against pdf_extract. Reports wall time and the python peak
+memory from tracemalloc. PyPDF2 is no longer a dependency, its row is skipped if it's missing.
+
+    python benchmarks/bench_pdf_extract.py --pages 300 500
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import make_pdf
+from chunker import OffsetSplitter, split_document
+from pdf_extract import extract_pdf_text, iter_pdf_pages
+
+
+def old_pypdf2(data):
+    from PyPDF2 import PdfReader
+
+    text = ""
+    for page in PdfReader(BytesIO(data)).pages:
+        text += page.extract_text()
+    return text
+
+
+def old_fitz(data):
+    doc = fitz.open(stream=BytesIO(data), filetype="pdf")
+    text = ""
+    for page in doc:
+        text += page.get_text("text")
+    return text
+
+
+def measure(fn, data):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[200, 500])
+    args = parser.parse_args()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    candidates = [
+        ("old PyPDF2 +=", old_pypdf2),
+        ("old fitz +=", old_fitz),
+        ("extract_pdf_text", extract_pdf_text),
+        ("old fitz + split", lambda data: splitter.split_text(old_fitz(data))),
+        ("pages + chunker", lambda data: list(split_document(iter_pdf_pages(data), OffsetSplitter.like(splitter)))),
+    ]
+    for pages in args.pages:
+        data = make_pdf(pages=pages, words_per_page=600)
+        print(f"{pages} pages, {len(data) / 1e6:.1f} MB")
+        for name, fn in candidates:
+            try:
+                elapsed, peak, result = measure(fn, data)
+            except ImportError:
+                print(f"  {name:<18} skipped")
+                continue
+            print(f"  {name:<18} {elapsed:7.3f}s  peak {peak / 1e6:7.2f} MB  ({len(result)} {'chars' if isinstance(result, str) else 'chunks'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Rerank payload and latency with and without the local pre-ranking stage. The candidates are what
+hybrid retrieval hands over for a query on an ingested paper: overlapping chunks of it, the same
+paper again from a second source (arXiv and an upload) and unrelated chunks. The remote reranker
+is a fake whose latency grows with the tokens it gets. The candidates go through the embedding
+cache first like they do at ingestion, so the pre-ranking reads their vectors from it. The top-1
+column is how often the best document is the same as when reranking every candidate, and the
+recall@3 column how many of the distinct top 3 documents of the full rerank are still found.
+
+    python benchmarks/bench_prerank.py --queries 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import HashingEmbeddings, fake_reranker
+from embedding_cache import CachedEmbeddings
+from prerank import PreRankingReranker
+
+
+def make_text(words, length, rng):
+    return " ".join(words[i] for i in rng.integers(0, len(words), length))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--token-budget", type=int, default=3000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vocabulary = [f"term{i}" for i in range(2000)]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    cache_dir = tempfile.mkdtemp()
+    embeddings = CachedEmbeddings(HashingEmbeddings(dim=512, latency=0.0, per_text=0.0), "hashing", cache_dir=cache_dir)
+
+    results = {"all candidates": [], "pre-ranked": []}
+    for _ in range(args.queries):
+        topic = [vocabulary[i] for i in rng.integers(0, len(vocabulary), 60)]
+        paper = splitter.split_text(make_text(topic, 1500, rng))
+        # the same paper indexed from two sources gives exact duplicates, the rest is unrelated
+        candidates = paper[:args.candidates // 3] + paper[:args.candidates // 3]
+        while len(candidates) < args.candidates:
+            candidates.append(make_text(vocabulary, 170, rng))
+        documents = [Document(page_content=text) for text in candidates]
+        rng.shuffle(documents)
+        query = " ".join(topic[:8])
+        # ingestion and hybrid retrieval already embedded these
+        embeddings.embed_documents(candidates)
+        embeddings.embed_query(query)
+
+        reference = fake_reranker()
+        start = time.perf_counter()
+        expected = reference.compress_documents(documents, query)
+        results["all candidates"].append((time.perf_counter() - start, reference.documents, reference.tokens, 0.0, 1.0, 1.0))
+        expected_texts = {document.page_content for document in expected}
+
+        reranker = fake_reranker()
+        stats = {}
+        compressor = PreRankingReranker(embeddings=embeddings, reranker=reranker, top_k=args.top_k,
+                                        token_budget=args.token_budget, stats=stats)
+        start = time.perf_counter()
+        kept = compressor.compress_documents(documents, query)
+        seconds = time.perf_counter() - start
+        top_1 = kept[0].page_content == expected[0].page_content
+        recall = len(expected_texts & {document.page_content for document in kept}) / len(expected_texts)
+        results["pre-ranked"].append((seconds, reranker.documents, reranker.tokens, stats["prerank"], top_1, recall))
+
+    for name, runs in results.items():
+        seconds, documents, tokens, prerank, top_1, recall = (np.array(column, dtype=float) for column in zip(*runs))
+        print(f"{name:15s} rerank docs {documents.mean():5.1f}  tokens {tokens.mean():6.0f}  "
+              f"latency p50 {np.percentile(seconds, 50) * 1000:6.1f}ms  prerank p50 {np.percentile(prerank, 50) * 1000:5.2f}ms  "
+              f"top-1 {top_1.mean():.2f}  recall@3 {recall.mean():.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Time to first token with AnswerStream against waiting for the whole answer, using a fake
+retriever and a fake chat model that streams one character every few milliseconds.
+
+    python benchmarks/bench_streaming.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.chains.retrieval import create_retrieval_chain
+from langchain.prompts import PromptTemplate
+from langchain_core.documents import Document
+
+from benchmarks.fakes import fake_chat_model, fake_retriever
+from rag_chain import AnswerStream
+from utils import get_template
+
+
+def main():
+    documents = [Document(page_content=f"context chunk {i}") for i in range(5)]
+    retriever = fake_retriever(documents)
+    answer_chain = create_stuff_documents_chain(llm=fake_chat_model(), prompt=PromptTemplate.from_template(get_template("default")))
+
+    start = time.perf_counter()
+    create_retrieval_chain(retriever=retriever, combine_docs_chain=answer_chain).invoke({"input": "what is this about?"})
+    blocking = time.perf_counter() - start
+
+    stream = AnswerStream(retriever, answer_chain, "what is this about?")
+    for _ in stream:
+        pass
+
+    print(f"invoke             answer after {blocking:.3f}s")
+    print(f"stream_answer      first token after {stream.timings['first_token']:.3f}s, "
+          f"retrieve {stream.timings['retrieve']:.3f}s, total {stream.timings['total']:.3f}s")
+    print(f"answer matches: {stream.answer == fake_chat_model().responses[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Offline end-to-end benchmark: a RAG_Chain wired to the fakes (no Cohere or Pinecone keys needed)
+ingests a synthetic corpus and answers questions about it. Scenarios:
+
+    ingest_pdf      PDFs through update_vectorstore_with_files, chunks/s and MB/s
+    ingest_youtube  videos through the ingestion queue with the concurrent transcript prefetch
+    folder          a synced folder note is found by a session's query (the folder is in the shared namespace)
+    query           streamed answers, p50/p95/p99 of retrieve / first token / total, and whether
+                    the planted fact was in the context; `query_repeat` asks the same questions again
+    memory          python heap peak (tracemalloc) of ingesting one large PDF, and the process RSS high water
+
+The results (plus the per-stage spans from telemetry) are written as JSON, compare two runs with
+--compare. The fakes have no latency unless asked for, so the numbers are the cost of this code.
+
+    python benchmarks/bench_suite.py --output bench-$(git rev-parse --short HEAD).json
+    python benchmarks/bench_suite.py --compare bench-old.json bench-new.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "mean": sum(values) / len(values), "count": len(values)}
+
+
+def rss_high_water_mb():
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def upload(name, data):
+    """what streamlit hands over for an uploaded file"""
+    file = io.BytesIO(data)
+    file.name = name
+    return file
+
+
+def bench_ingest_pdf(engine, pdfs, session_id):
+    start = time.perf_counter()
+    chunks_before = len(engine.index.vectors)
+    for name, data in pdfs:
+        engine.update_vectorstore_with_files(upload(name, data), session_id=session_id)
+    seconds = time.perf_counter() - start
+    chunks = len(engine.index.vectors) - chunks_before
+    size = sum(len(data) for _, data in pdfs)
+    return {
+        "documents": len(pdfs),
+        "chunks": chunks,
+        "seconds": seconds,
+        "chunks_per_second": chunks / seconds,
+        "mb_per_second": size / (1024 * 1024) / seconds,
+    }
+
+
+def bench_ingest_youtube(engine, links, session_id):
+    start = time.perf_counter()
+    chunks_before = len(engine.index.vectors)
+    jobs = [job for _, job in engine.submit_youtube_links(links, session_id)]
+    while not all(job.done for job in jobs):
+        time.sleep(0.01)
+    seconds = time.perf_counter() - start
+    return {
+        "videos": len(links),
+        "failed": sum(1 for job in jobs if job.error),
+        "chunks": len(engine.index.vectors) - chunks_before,
+        "seconds": seconds,
+        "videos_per_second": len(links) / seconds,
+    }
+
+
+def bench_query(engine, queries, option, session_id):
+    # answers from the answer cache take microseconds, mixing them in would hide the real latency
+    retrieve, first_token, total = [], [], []
+    cached_first_token, cached_total = [], []
+    found = 0
+    for question, answer in queries:
+        stream = engine.stream_answer(question, option, session_id)
+        for _ in stream:
+            pass
+        if stream.cached:
+            cached_first_token.append(stream.timings["first_token"])
+            cached_total.append(stream.timings["total"])
+            continue
+        retrieve.append(stream.timings["retrieve"])
+        found += any(answer in document.page_content for document in stream.context)
+        first_token.append(stream.timings["first_token"])
+        total.append(stream.timings["total"])
+    answered = len(total)
+    return {
+        "queries": len(queries),
+        "cached": len(cached_total),
+        "context_hit_rate": found / answered if answered else None,
+        "retrieve": percentiles(retrieve),
+        "first_token": percentiles(first_token),
+        "total": percentiles(total),
+        "cached_first_token": percentiles(cached_first_token),
+        "cached_total": percentiles(cached_total),
+    }
+
+
+def bench_folder(engine, session_id):
+    from benchmarks.corpus import document_pages
+
+    folder = tempfile.mkdtemp(prefix="veri-folder-")
+    doc = 20_000
+    texts, _, answer = document_pages(doc, pages=2)
+    question = f"What is the release codename of report-{doc:04d}"
+    with open(os.path.join(folder, "notes.txt"), "w", encoding="utf-8") as f:
+        f.write("".join(texts))
+    start = time.perf_counter()
+    stats = engine.sync_folder(folder_path=folder)
+    seconds = time.perf_counter() - start
+    stream = engine.stream_answer(question, "PDF RAG", session_id)
+    for _ in stream:
+        pass
+    return {
+        "files": stats["files"],
+        "sync_seconds": seconds,
+        "found_from_session": any(answer in document.page_content for document in stream.context),
+    }
+
+
+def bench_memory(engine, pages, session_id):
+    from benchmarks.corpus import document_pages, pdf_from_pages
+
+    texts, _, _ = document_pages(10_000, pages=pages)
+    data = pdf_from_pages(texts)
+    tracemalloc.start()
+    start = time.perf_counter()
+    engine.update_vectorstore_with_files(upload("large.pdf", data), session_id=session_id)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "pages": pages,
+        "pdf_mb": len(data) / (1024 * 1024),
+        "seconds_traced": seconds,
+        "python_peak_mb": peak / (1024 * 1024),
+        "rss_high_water_mb": rss_high_water_mb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    # the engine keeps its manifest, caches and lexical index under VERI_CACHE_DIR, a fresh one per run
+    cache_dir = tempfile.mkdtemp(prefix="veri-bench-")
+    os.environ["VERI_CACHE_DIR"] = cache_dir
+    os.environ["VERI_FOLDER_PATH"] = ""
+    from benchmarks.corpus import make_corpus
+    from benchmarks.fakes import offline_engine
+    from telemetry import telemetry
+
+    corpus = make_corpus(args.documents, args.pages, videos=args.videos, queries=args.queries, seed=args.seed)
+    start = time.perf_counter()
+    engine = offline_engine(
+        dim=args.dim,
+        embed_latency=args.embed_latency,
+        rerank_latency=args.rerank_latency,
+        token_latency=args.token_latency,
+        index_latency=args.index_latency,
+        transcript_latency=args.transcript_latency,
+        transcript_minutes=args.minutes,
+    )
+    scenarios = {"startup": {"seconds": time.perf_counter() - start}}
+    scenarios["ingest_pdf"] = bench_ingest_pdf(engine, corpus["pdfs"], "bench")
+    scenarios["ingest_youtube"] = bench_ingest_youtube(engine, corpus["videos"], "bench")
+    scenarios["query"] = bench_query(engine, corpus["queries"], "PDF RAG", "bench")
+    scenarios["query_repeat"] = bench_query(engine, corpus["queries"], "PDF RAG", "bench")
+    scenarios["folder"] = bench_folder(engine, "bench")
+    scenarios["memory"] = bench_memory(engine, args.memory_pages, "memory")
+    engine.ingestion.shutdown()
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "scenarios": scenarios,
+        # per stage view of the same run, see telemetry.py
+        "spans": telemetry.summary()["spans"],
+        "counters": telemetry.summary()["counters"],
+    }
+
+
+def flatten(data, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, numbers only"""
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'metric':48} {old.get('commit') or 'old':>12} {new.get('commit') or 'new':>12}   change")
+    old_flat, new_flat = flatten(old["scenarios"]), flatten(new["scenarios"])
+    for name in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[name], new_flat[name]
+        change = f"{(after - before) / before * 100:+7.1f}%" if before else ""
+        print(f"{name:48} {before:12.4g} {after:12.4g}   {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--videos", type=int, default=4)
+    parser.add_argument("--minutes", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--memory-pages", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    # seconds per call of each fake, 0 measures only the local work
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--rerank-latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--index-latency", type=float, default=0.0)
+    parser.add_argument("--transcript-latency", type=float, default=0.0)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="print the change between two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    results = run(argparse.Namespace(**params))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
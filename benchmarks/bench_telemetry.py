@@ -0,0 +1,99 @@
+"""
+Cost of the telemetry: a span without and with the JSON-lines log, a span sampled by the profiler,
+then one fake ingestion (PDF parse, split, embed, upsert) and a few fake queries through the real
+code paths, printing where the time went and what a prometheus scrape would see.
+
+    python benchmarks/bench_telemetry.py --spans 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.prompts import PromptTemplate
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import telemetry as telemetry_module
+from benchmarks.fakes import FakeEmbeddings, InMemoryIndex, fake_chat_model, fake_retriever, make_pdf
+from chunker import OffsetSplitter, split_document
+from pdf_extract import iter_pdf_pages
+from rag_chain import AnswerStream
+from telemetry import Telemetry
+from utils import get_template
+from vector_writer import BatchedVectorWriter
+
+
+def time_spans(telemetry, spans):
+    start = time.perf_counter()
+    for _ in range(spans):
+        with telemetry.span("bench"):
+            pass
+    return (time.perf_counter() - start) / spans
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spans", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        for _ in range(args.spans):
+            pass
+        empty = (time.perf_counter() - start) / args.spans
+        print(f"empty loop               {empty * 1e6:7.2f}us per iteration")
+        print(f"span, metrics only       {time_spans(Telemetry(), args.spans) * 1e6:7.2f}us per span")
+        logged = Telemetry(log_path=os.path.join(path, "spans.jsonl"))
+        print(f"span, JSON-lines log     {time_spans(logged, args.spans) * 1e6:7.2f}us per span")
+        logged.close()
+        # the profiler starts a sampling thread per span, it is meant for the few query / ingest spans
+        profiled = Telemetry(profile_threshold=10.0, profile_spans=("bench",), profile_dir=path)
+        print(f"span, profiled           {time_spans(profiled, 1000) * 1e6:7.2f}us per span")
+
+        # the real code paths record into the module instance, pointed at a log for this run
+        log_path = os.path.join(path, "run.jsonl")
+        telemetry = telemetry_module.telemetry
+        telemetry.log_path = log_path
+        telemetry.profile_threshold = 0.05
+        telemetry.profile_dir = os.path.join(path, "profiles")
+
+        splitter = OffsetSplitter.like(RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100))
+        writer = BatchedVectorWriter(FakeEmbeddings(dim=256, latency=0.02, per_text=0.0), InMemoryIndex(latency=0.01))
+        with telemetry.span("ingest", kind="pdf"):
+            pdf = make_pdf(pages=40)
+            pages = telemetry.timed_iter(iter_pdf_pages(pdf), "pdf_parse", bytes=len(pdf))
+            with telemetry.span("split"):
+                chunks = list(split_document(pages, splitter))
+            documents = [Document(page_content=chunk, metadata={"page": page}) for chunk, page in chunks]
+            writer.write(documents, [str(i) for i in range(len(documents))])
+
+        retriever = fake_retriever([Document(page_content=f"context chunk {i}") for i in range(5)], latency=0.05)
+        answer_chain = create_stuff_documents_chain(llm=fake_chat_model(), prompt=PromptTemplate.from_template(get_template("default")))
+        for _ in range(args.queries):
+            for _ in AnswerStream(retriever, answer_chain, "what is this about?"):
+                pass
+        telemetry.close()
+
+        with open(log_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        print(f"\n{len(records)} spans logged, {len({r['trace'] for r in records})} traces, "
+              f"{sum(1 for r in records if 'profile' in r)} slow spans profiled")
+        print(f"{'span':16} {'count':>6} {'mean':>9} {'p50':>9} {'p99':>9}")
+        for name, stats in sorted(telemetry.summary()["spans"].items()):
+            print(f"{name:16} {stats['count']:6d} {stats['mean'] * 1000:7.1f}ms {stats['p50'] * 1000:7.1f}ms {stats['p99'] * 1000:7.1f}ms")
+        for name, value in sorted(telemetry.summary()["counters"].items()):
+            print(f"{name:32} {value}")
+        metrics = telemetry.render_prometheus()
+        print(f"\nprometheus text: {len(metrics.splitlines())} lines, e.g.")
+        print("\n".join(line for line in metrics.splitlines() if 'span="generate"' in line and "bucket" not in line))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Ingestion throughput in chunks/sec: one embed call and one upsert for the whole list (what a
+single add_documents call amounted to) against BatchedVectorWriter with more and more batches
+in flight, on the fake embedder and the in-memory index stand-in.
+
+    python benchmarks/bench_vector_writer.py --chunks 5000 --failure-rate 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings, InMemoryIndex
+from vector_writer import BatchedVectorWriter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=3000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    documents = [Document(page_content=f"chunk {i} " + "some text " * 50) for i in range(args.chunks)]
+    ids = [str(i) for i in range(args.chunks)]
+
+    embeddings = FakeEmbeddings(dim=args.dim)
+    index = InMemoryIndex()
+    start = time.perf_counter()
+    vectors = embeddings.embed_documents([document.page_content for document in documents])
+    index.upsert(vectors=[(i, v, {"text": d.page_content}) for i, v, d in zip(ids, vectors, documents)])
+    elapsed = time.perf_counter() - start
+    print(f"single call               {args.chunks / elapsed:8.0f} chunks/s")
+
+    for batch_size, in_flight in ((96, 1), (96, 4), (96, 8), (48, 8)):
+        embeddings = FakeEmbeddings(dim=args.dim)
+        index = InMemoryIndex(failure_rate=args.failure_rate)
+        writer = BatchedVectorWriter(embeddings, index, batch_size=batch_size, max_in_flight=in_flight, retry_delay=0.01)
+        stats = writer.write(iter(documents), ids)
+        assert len(index.vectors) == args.chunks
+        print(f"batch {batch_size:3d} x {in_flight} in flight   {stats['chunks_per_second']:8.0f} chunks/s"
+              f"  ({stats['batches']} batches, {stats['retries']} retries, {embeddings.texts - args.chunks} texts re-embedded)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+YouTube transcript ingestion: how a one hour lecture is chunked now (it used to be one document),
+the transcript cache cold and warm, and fetching several videos one after the other against the
+concurrent prefetch. The transcripts come from a local fake loader with a fixed latency.
+
+    python benchmarks/bench_youtube.py --videos 8 --latency 1.0
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import fake_transcript_loader
+from chunker import OffsetSplitter
+from youtube import TranscriptCache, split_transcript, video_id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, default=8)
+    parser.add_argument("--minutes", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    links = [f"https://youtu.be/video{i:06d}?t=42" for i in range(args.videos)]
+    videos = [video_id(link) for link in links]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    loader = fake_transcript_loader(args.minutes, args.latency)
+
+    with tempfile.TemporaryDirectory() as path:
+        cache = TranscriptCache(os.path.join(path, "sequential"), loader=loader)
+        start = time.perf_counter()
+        for video in videos:
+            cache.get(video)
+        print(f"{args.videos} videos one by one      {time.perf_counter() - start:6.2f}s")
+
+        start = time.perf_counter()
+        for video in videos:
+            cache.get(video)
+        print(f"{args.videos} videos from the cache  {time.perf_counter() - start:8.4f}s")
+
+        cache = TranscriptCache(os.path.join(path, "concurrent"), loader=loader)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(cache.get, videos))
+        print(f"{args.videos} videos, 4 at a time    {time.perf_counter() - start:6.2f}s")
+
+        segments = cache.get(videos[0])
+        transcript = " ".join(segment["text"] for segment in segments)
+        start = time.perf_counter()
+        chunks = list(split_transcript(segments, OffsetSplitter.like(splitter)))
+        seconds = time.perf_counter() - start
+        print(f"{args.minutes} min transcript, {len(transcript)} characters: 1 document before, "
+              f"{len(chunks)} chunks of at most {max(len(chunk) for chunk, _, _ in chunks)} characters now ({seconds * 1000:.1f}ms)")
+        print("first chunks " + ", ".join(f"{start:.0f}s-{end:.0f}s" for _, start, end in chunks[:4]))
+
+
+if __name__ == "__main__":
+    main()
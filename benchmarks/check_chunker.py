@@ -0,0 +1,98 @@
+"""
+Regression check of chunker.OffsetSplitter against langchain's RecursiveCharacterTextSplitter:
+random texts made of words, spaces, newlines and blank lines (plus some long unbroken runs and
+non-ASCII characters) are split by both with random chunk sizes and overlaps, the chunks have to
+be the same. The text is also cut into random pages and split page by page with split_document,
+which has to give the same chunks, each with the page its start is on, unless a blank line first
+shows up after the first page with a separator (split_document can't go back on the chunks it has
+made, those cases are counted and not compared). Exits with 1 and prints the
+first cases that differ.
+
+    python benchmarks/check_chunker.py --cases 5000
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from chunker import OffsetSplitter, chunk_records, join_pages, split_document
+
+PIECES = ["word", "a", "longerword", "é", "漢字", "😀", " ", " ", "  ", "\n", "\n\n", "\n\n\n", "\t", ".", "x" * 40]
+
+
+def random_text(rng):
+    pieces = []
+    for _ in range(rng.randint(0, 400)):
+        if rng.random() < 0.01:
+            # a run longer than any chunk, split down to single characters
+            pieces.append("y" * rng.randint(50, 300))
+        else:
+            pieces.append(rng.choice(PIECES))
+    text = "".join(pieces)
+    if rng.random() < 0.2:
+        # no blank line, split_document has to hold the pages until the end
+        while "\n\n" in text:
+            text = text.replace("\n\n", "\n")
+    return text
+
+
+def random_pages(rng, text):
+    cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 8)))
+    return [text[start:end] for start, end in zip([0, *cuts], [*cuts, len(text)])]
+
+
+def top_level(separators, text):
+    return next((i for i, separator in enumerate(separators) if separator and separator in text), None)
+
+
+def streams_exactly(splitter, pages):
+    """whether the first pages with a separator already have the top separator of the whole text"""
+    joined = ""
+    for page in pages:
+        joined += page
+        level = top_level(splitter.separators, joined)
+        if level is not None:
+            return level == top_level(splitter.separators, "".join(pages))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = switched = 0
+    for case in range(args.cases):
+        chunk_size = rng.randint(5, 200)
+        chunk_overlap = rng.randint(0, chunk_size)
+        text = random_text(rng)
+        expected = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+        splitter = OffsetSplitter(chunk_size, chunk_overlap)
+        chunks = splitter.split_text(text)
+        pages = random_pages(rng, text)
+        joined, page_starts = join_pages(pages)
+        records = chunk_records(joined, splitter, page_starts)
+        streamed = list(split_document(iter(pages), splitter))
+        if not streams_exactly(splitter, pages):
+            switched += 1
+            streamed = list(zip(chunks, records["page"].tolist()))
+        if chunks != expected or streamed != list(zip(chunks, records["page"].tolist())):
+            failures += 1
+            if failures <= 3:
+                print(f"case {case}: chunk_size={chunk_size} chunk_overlap={chunk_overlap} pages={pages!r}")
+                print(f"  langchain {expected!r}")
+                print(f"  chunker   {chunks!r}")
+                print(f"  by page   {streamed!r}")
+    print(f"{args.cases - failures}/{args.cases} cases give the same chunks "
+          f"({switched} split by page with a later blank line, not compared page by page)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Synthetic corpus for the offline benchmarks: PDFs and video ids about a handful of topics, with a
+planted fact in every document and the questions that ask for it, so a run measures whether the
+right chunk came back as well as how long it took. The same seed always gives the same corpus.
+"""
+import numpy as np
+
+TOPICS = {
+    "transformers": "attention head encoder decoder token embedding layer softmax query key value positional",
+    "optimization": "gradient descent learning rate momentum adam convergence loss step schedule warmup",
+    "databases": "index transaction query planner btree page buffer log isolation lock commit",
+    "networking": "packet latency bandwidth router congestion window handshake socket protocol retransmit",
+    "compilers": "parser lexer grammar register allocation inlining ssa pass optimization bytecode",
+    "graphics": "shader texture raster vertex fragment pipeline framebuffer lighting mesh sampling",
+}
+CODENAMES = ["amber", "basalt", "cobalt", "dune", "ember", "fjord", "garnet", "harbor", "indigo", "jasper",
+             "kestrel", "lumen", "marble", "nectar", "onyx", "pylon", "quartz", "raven", "sable", "tundra"]
+
+
+def document_pages(doc, pages=10, words_per_page=300, seed=0):
+    """
+    Page texts of document `doc`: words of its topic, with the sentence stating its fact on one of
+    the pages. Returns (pages, topic, codename).
+    """
+    rng = np.random.default_rng(seed * 100_003 + doc)
+    topic = list(TOPICS)[doc % len(TOPICS)]
+    words = TOPICS[topic].split()
+    codename = CODENAMES[doc % len(CODENAMES)]
+    fact_page = int(rng.integers(0, pages))
+    texts = []
+    for page in range(pages):
+        text = " ".join(words[i] for i in rng.integers(0, len(words), words_per_page))
+        if page == fact_page:
+            middle = len(text) // 2
+            text = f"{text[:middle]}. The release codename of report-{doc:04d} is {codename}. {text[middle:]}"
+        texts.append(text)
+    return texts, topic, codename
+
+
+def pdf_from_pages(texts):
+    """PDF bytes with one page per text"""
+    import fitz
+
+    pdf = fitz.open()
+    for text in texts:
+        page = pdf.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=8)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+def make_corpus(documents=20, pages=10, words_per_page=300, videos=4, queries=100, seed=0):
+    """
+    Returns {"pdfs": [(name, bytes)], "videos": [link], "queries": [(question, expected answer)]}.
+    The questions cycle over the documents, so with more queries than documents they repeat (as
+    real users do) and the answer cache is exercised too.
+    """
+    pdfs, facts = [], []
+    for doc in range(documents):
+        texts, topic, codename = document_pages(doc, pages, words_per_page, seed)
+        pdfs.append((f"report-{doc:04d}-{topic}.pdf", pdf_from_pages(texts)))
+        # no question mark, the fake reranker matches whole words and would miss "report-0001?"
+        facts.append((f"What is the release codename of report-{doc:04d}", codename))
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(facts)).tolist()
+    questions = [facts[order[i % len(order)]] for i in range(queries)]
+    # 11 character ids, the fake transcript loader derives the transcript from the id
+    links = [f"https://youtu.be/bench{seed:02d}{i:04d}" for i in range(videos)]
+    return {"pdfs": pdfs, "videos": links, "queries": questions}
+
@@ -0,0 +1,263 @@
+"""
+Local stand-ins for the remote models so the benchmarks run offline and deterministically.
+"""
+import functools
+import hashlib
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def fake_vector(text, dim):
+    """unit vector derived from the hash of the text, the same text always gives the same vector"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@functools.lru_cache(maxsize=100_000)
+def _word_vector(word, dim):
+    # the corpora reuse a small vocabulary, without the cache the fake costs more than the code it stands in for
+    return np.asarray(fake_vector(word, dim), dtype=np.float32)
+
+
+class FakeEmbeddings(Embeddings):
+    """deterministic embedder that sleeps like a remote call, `latency` per request plus `per_text` per input"""
+
+    def __init__(self, dim=1024, latency=0.05, per_text=0.001):
+        self.dim = dim
+        self.latency = latency
+        self.per_text = per_text
+        self.calls = 0
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency + self.per_text * len(texts))
+        return [fake_vector(text, self.dim) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class HashingEmbeddings(FakeEmbeddings):
+    """
+    bag of words embedder (hashing trick), texts sharing words get similar vectors so near duplicate
+    queries and lexical overlap behave roughly like they do with a real model
+    """
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency + self.per_text * len(texts))
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for word in text.lower().split():
+                word = word.strip(".,;:!?()\"'")
+                if word:
+                    vector += _word_vector(word, self.dim)
+            norm = np.linalg.norm(vector)
+            vectors.append((vector / norm if norm else vector).tolist())
+        return vectors
+
+
+def make_pdf(pages=5, words_per_page=400, seed=0):
+    """synthetic multi page PDF as bytes"""
+    import fitz
+
+    words = ["attention", "gradient", "tensor", "layer", "model", "kernel", "vector", "loss", "batch", "token"]
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        text = " ".join(words[i] for i in rng.integers(0, len(words), words_per_page))
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), f"page {page_number} {text}", fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def fake_chat_model(answer="This is a fake answer about the retrieved context. " * 8, token_latency=0.002, word_tokens=False):
+    """
+    chat model that streams the canned answer one character at a time, sleeping between them,
+    and takes just as long when invoked without streaming. With word_tokens it streams a word per
+    chunk instead, about as many chunks as a real model sends (the load test needs that, at one
+    chunk per character langchain's per chunk work is most of the cost)
+    """
+    import asyncio
+    import re
+
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+
+    class SlowFakeChatModel(FakeListChatModel):
+        def _call(self, *args, **kwargs):
+            response = super()._call(*args, **kwargs)
+            time.sleep(len(response) * self.sleep)
+            return response
+
+    class WordFakeChatModel(FakeListChatModel):
+        def _call(self, *args, **kwargs):
+            response = super()._call(*args, **kwargs)
+            time.sleep(len(re.findall(r"\S+\s*", response)) * self.sleep)
+            return response
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            for word in re.findall(r"\S+\s*", self.responses[0]):
+                time.sleep(self.sleep)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            for word in re.findall(r"\S+\s*", self.responses[0]):
+                await asyncio.sleep(self.sleep)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    model = WordFakeChatModel if word_tokens else SlowFakeChatModel
+    return model(responses=[answer], sleep=token_latency)
+
+
+def fake_retriever(documents, latency=0.2):
+    """runnable standing in for vector search + rerank, returns the given documents after `latency`"""
+    from langchain_core.runnables import RunnableLambda
+
+    def retrieve(query):
+        time.sleep(latency)
+        return documents
+
+    return RunnableLambda(retrieve)
+
+
+def fake_reranker(top_n=3, latency=0.08, per_token=0.00002):
+    """
+    document compressor standing in for CohereRerank, it takes `latency` plus `per_token` per
+    document token (like a remote reranker whose cost grows with the payload) and keeps the top_n
+    documents sharing the most words with the query
+    """
+    from langchain_core.documents.compressor import BaseDocumentCompressor
+
+    class FakeReranker(BaseDocumentCompressor):
+        calls: int = 0
+        documents: int = 0
+        tokens: int = 0
+
+        def compress_documents(self, documents, query, callbacks=None):
+            documents = list(documents)
+            tokens = sum(len(document.page_content) // 4 + 1 for document in documents)
+            self.calls += 1
+            self.documents += len(documents)
+            self.tokens += tokens
+            time.sleep(latency + per_token * tokens)
+            words = set(query.lower().split())
+            # ties are broken by the text so the order does not depend on the order of the input
+            scored = sorted(documents, key=lambda document: (-len(words & set(document.page_content.lower().split())), document.page_content))
+            return scored[:top_n]
+
+    return FakeReranker()
+
+
+def fake_transcript_loader(minutes=60, latency=0.5, seed=0):
+    """
+    transcript loader standing in for the youtube download, returns `minutes` of segments of a few
+    seconds each after `latency`, the same video id always gives the same transcript
+    """
+    words = ["gradient", "descent", "lecture", "neural", "network", "loss", "function", "layer", "matrix", "optimizer"]
+
+    def load(video):
+        time.sleep(latency)
+        rng = np.random.default_rng(seed + int.from_bytes(hashlib.sha256(video.encode()).digest()[:4], "little"))
+        segments, start = [], 0.0
+        while start < minutes * 60:
+            duration = float(rng.uniform(2, 6))
+            text = " ".join(words[i] for i in rng.integers(0, len(words), int(duration * 2.5)))
+            segments.append({"text": text, "start": round(start, 2), "duration": round(duration, 2)})
+            start += duration
+        return segments
+
+    return load
+
+
+class InMemoryIndex:
+    """
+    Pinecone Index stand-in that keeps the vectors in a dict, with a fixed latency per call and an
+    optional share of upserts that fail, to exercise retries. Queries are an exact scan with the
+    same metadata filters as the local index, so RAG_Chain(index=InMemoryIndex()) runs offline.
+    """
+
+    def __init__(self, latency=0.02, per_vector=0.0001, failure_rate=0.0, seed=0, query_latency=0.0):
+        self.latency = latency
+        self.per_vector = per_vector
+        self.failure_rate = failure_rate
+        self.query_latency = query_latency
+        self.vectors = {}
+        self.upserts = 0
+        self.queries = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors, namespace=None, **kwargs):
+        time.sleep(self.latency + self.per_vector * len(vectors))
+        with self._lock:
+            self.upserts += 1
+            if self.failure_rate and self._rng.random() < self.failure_rate:
+                raise ConnectionError("fake upsert failure")
+            for vector_id, values, metadata in vectors:
+                self.vectors[(namespace or "", vector_id)] = (np.asarray(values, dtype=np.float32), metadata)
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids=None, namespace=None, filter=None, delete_all=False, **kwargs):
+        from local_index import matches_filter
+
+        with self._lock:
+            for key in list(self.vectors):
+                if key[0] != (namespace or ""):
+                    continue
+                if delete_all or (ids is not None and key[1] in ids) or (filter and matches_filter(self.vectors[key][1], filter)):
+                    del self.vectors[key]
+        return {}
+
+    def query(self, vector, top_k=4, namespace=None, filter=None, include_metadata=True, **kwargs):
+        from local_index import matches_filter
+
+        time.sleep(self.query_latency)
+        with self._lock:
+            self.queries += 1
+            candidates = [
+                (key[1], values, metadata) for key, (values, metadata) in self.vectors.items()
+                if key[0] == (namespace or "") and matches_filter(metadata, filter)
+            ]
+        if not candidates:
+            return {"matches": []}
+        query = np.asarray(vector, dtype=np.float32)
+        scores = np.stack([values for _, values, _ in candidates]) @ query
+        best = np.argsort(-scores, kind="stable")[:top_k]
+        return {"matches": [
+            {"id": candidates[i][0], "score": float(scores[i]), "metadata": dict(candidates[i][2]) if include_metadata else {}}
+            for i in best
+        ]}
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {"total_vector_count": len(self.vectors)}
+
+
+def offline_engine(dim=256, embed_latency=0.0, rerank_latency=0.0, token_latency=0.0, index_latency=0.0,
+                   transcript_latency=0.0, transcript_minutes=60, word_tokens=False):
+    """
+    RAG_Chain wired to the fakes (hashing embeddings, word overlap reranker, canned chat model,
+    in-memory index, synthetic transcripts), nothing leaves the machine. Point VERI_CACHE_DIR at a
+    temporary directory before importing rag_chain, the manifest and the caches live there.
+    """
+    from rag_chain import RAG_Chain
+
+    return RAG_Chain(
+        llm=fake_chat_model(token_latency=token_latency, word_tokens=word_tokens),
+        transcript_loader=fake_transcript_loader(minutes=transcript_minutes, latency=transcript_latency),
+        embeddings=HashingEmbeddings(dim=dim, latency=embed_latency, per_text=0.0),
+        reranker=fake_reranker(latency=rerank_latency, per_token=0.0),
+        index=InMemoryIndex(latency=index_latency, per_vector=0.0, query_latency=index_latency),
+    )
@@ -0,0 +1,143 @@
+"""
+Load test of service.py: the service runs in this process on an offline engine whose fakes sleep
+like the real upstreams (embedding, index query, rerank, streamed llm), a synthetic corpus is
+ingested, then clients stream answers at increasing concurrency. Every question is different so
+the answer cache never answers. Reports throughput and p50/p99 of first token and full answer.
+
+    python benchmarks/load_test.py --concurrency 1 4 16 64 --output load.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def ask(session, url, question):
+    start = time.perf_counter()
+    first_token = None
+    async with session.post(f"{url}/query", json={"query": question, "mode": "PDF RAG", "session_id": "load"}) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            if first_token is None and b'"token"' in line:
+                first_token = time.perf_counter() - start
+            if b'"done"' in line:
+                done = json.loads(line)
+    return first_token, time.perf_counter() - start, done
+
+
+async def run_level(url, concurrency, requests, questions):
+    import aiohttp
+
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(f"{questions[i % len(questions)]} (request {concurrency}-{i})")
+    first_tokens, totals, errors = [], [], 0
+
+    async def client(session):
+        nonlocal errors
+        while not queue.empty():
+            question = queue.get_nowait()
+            try:
+                first_token, total, _ = await ask(session, url, question)
+                first_tokens.append(first_token)
+                totals.append(total)
+            except Exception as e:
+                errors += 1
+                print(f"request failed: {e}")
+
+    start = time.perf_counter()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": len(totals),
+        "errors": errors,
+        "seconds": seconds,
+        "requests_per_second": len(totals) / seconds,
+        "first_token_p50": percentile(first_tokens, 0.50),
+        "first_token_p99": percentile(first_tokens, 0.99),
+        "total_p50": percentile(totals, 0.50),
+        "total_p99": percentile(totals, 0.99),
+    }
+
+
+async def main_async(args):
+    from aiohttp import web
+
+    from benchmarks.corpus import make_corpus
+    from benchmarks.fakes import offline_engine
+    from service import create_app
+
+    engine = offline_engine(
+        embed_latency=args.embed_latency,
+        rerank_latency=args.rerank_latency,
+        token_latency=args.token_latency,
+        index_latency=args.index_latency,
+        word_tokens=True,
+    )
+    # every question is new, a near duplicate match would skip retrieval and generation
+    engine.answer_cache.threshold = 2.0
+    corpus = make_corpus(documents=args.documents, pages=5, videos=0, queries=args.documents)
+    for name, data in corpus["pdfs"]:
+        file = io.BytesIO(data)
+        file.name = name
+        await asyncio.to_thread(engine.update_vectorstore_with_files, file, session_id="load")
+    questions = [question for question, _ in corpus["queries"]]
+
+    runner = web.AppRunner(create_app(engine))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        print(f"{'clients':>7} {'req/s':>7} {'first token p50':>16} {'p99':>8} {'answer p50':>11} {'p99':>8} {'errors':>7}")
+        for concurrency in args.concurrency:
+            result = await run_level(url, concurrency, max(args.requests, 2 * concurrency), questions)
+            results.append(result)
+            print(f"{concurrency:7d} {result['requests_per_second']:7.2f} {result['first_token_p50']:15.3f}s "
+                  f"{result['first_token_p99']:7.3f}s {result['total_p50']:10.3f}s {result['total_p99']:7.3f}s {result['errors']:7d}")
+    finally:
+        await runner.cleanup()
+        engine.ingestion.shutdown(wait=False)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=32, help="requests per level, at least twice the concurrency")
+    parser.add_argument("--documents", type=int, default=10)
+    # seconds per call of each fake upstream
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--index-latency", type=float, default=0.02)
+    parser.add_argument("--rerank-latency", type=float, default=0.08)
+    # per streamed word, 64 words is about 1s like a short command-r answer
+    parser.add_argument("--token-latency", type=float, default=0.015)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    os.environ["VERI_CACHE_DIR"] = tempfile.mkdtemp(prefix="veri-load-")
+    os.environ["VERI_FOLDER_PATH"] = ""
+    results = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "levels": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
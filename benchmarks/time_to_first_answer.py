@@ -0,0 +1,30 @@
+"""
+Compare the time to the first answer when a new RAG_Chain is built for the query
+(what every streamlit rerun used to do) against the shared, warmed up engine.
+Needs the same .env as the app.
+
+    python benchmarks/time_to_first_answer.py "what is attention?"
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_chain import measure_time_to_first_answer
+
+
+def main():
+    query = sys.argv[1] if len(sys.argv) > 1 else "What is a transformer?"
+    option = sys.argv[2] if len(sys.argv) > 2 else "default"
+
+    rebuilt = measure_time_to_first_answer(query, option, shared=False)
+    # first call pays for building and warming up the engine, the second is what a rerun costs
+    cold = measure_time_to_first_answer(query, option, shared=True)
+    warm = measure_time_to_first_answer(query, option, shared=True)
+
+    for name, timings in (("rebuilt per rerun", rebuilt), ("shared engine (cold)", cold), ("shared engine (warm)", warm)):
+        print(f"{name:<22} setup {timings['setup']:.3f}s  answer {timings['answer']:.3f}s  total {timings['total']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
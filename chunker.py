@@ -0,0 +1,305 @@
+import bisect
+import re
+
+import numpy as np
+
+# the separators RecursiveCharacterTextSplitter uses by default
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+# one row per chunk: the document of the batch it comes from, its [start, end) in the text and its page
+CHUNK_DTYPE = np.dtype([("doc", np.int32), ("start", np.int64), ("end", np.int64), ("page", np.int32)])
+# documents sent to a worker process at once, small documents are not worth a round trip each
+DOCUMENTS_PER_TASK = 8
+
+
+class OffsetSplitter:
+    """
+    RecursiveCharacterTextSplitter (keep_separator, strip_whitespace, len as the length function)
+    working on offsets: it makes the same chunks, but as (start, end) positions in the text, so no
+    piece is copied while splitting and the chunk knows where it is. split_text gives the strings
+    for callers that want them, split_prefix splits a text that is still growing.
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=100, separators=DEFAULT_SEPARATORS):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk overlap {chunk_overlap} is larger than the chunk size {chunk_size}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+        self._patterns = {separator: re.compile(re.escape(separator)) for separator in self.separators if separator}
+
+    @classmethod
+    def like(cls, text_splitter):
+        """the offset splitter making the same chunks as a langchain RecursiveCharacterTextSplitter"""
+        return cls(text_splitter._chunk_size, text_splitter._chunk_overlap, getattr(text_splitter, "_separators", DEFAULT_SEPARATORS))
+
+    def split_offsets(self, text):
+        """[(start, end)] of the chunks of the text"""
+        chunks = []
+        self._split(text, 0, len(text), self.separators, chunks)
+        return chunks
+
+    def split_prefix(self, text, level=0, final=False):
+        """
+        Splits text that more text will be appended to (the pages of a document parsed so far) with
+        separators[level] at the top, the one the whole text would pick if it is the first it has.
+        Returns the [(start, end)] of the chunks nothing appended can change and the offset the rest
+        begins at: the next call takes text[rest:] plus what came since. The last piece may not be
+        complete yet and the chunk in progress may still take more pieces, everything before the
+        start of that chunk is final because the merge only carries that start along.
+        With final=True the text is complete and all of it is split.
+        """
+        chunks = []
+        rest = self._split_on(text, 0, len(text), self.separators[level], self.separators[level + 1:], chunks, final)
+        return chunks, rest
+
+    def split_text(self, text):
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def _bounds(self, text, start, end, separator):
+        """
+        offsets where the pieces of text[start:end] begin, followed by end. The pieces are contiguous
+        and the separator stays at the start of the piece that follows it, like keep_separator=True
+        """
+        if not separator:
+            return list(range(start, end + 1))
+        positions = [match.start() for match in self._patterns[separator].finditer(text, start, end)]
+        if positions and positions[0] == start:
+            positions = positions[1:]
+        return [start, *positions, end]
+
+    def _split(self, text, start, end, separators, chunks):
+        separator, remaining = separators[-1], ()
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator, remaining = candidate, separators[i + 1:]
+                break
+        self._split_on(text, start, end, separator, remaining, chunks)
+
+    def _split_on(self, text, start, end, separator, remaining, chunks, final=True):
+        """
+        splits text[start:end] on the separator, pieces too long for a chunk with the remaining
+        separators. When not final the last piece is left out and the offset the chunk in progress
+        starts at is returned, see split_prefix
+        """
+        if len(separator) == 1:
+            return self._split_on_char(text, start, end, separator, remaining, chunks, final)
+        bounds = self._bounds(text, start, end, separator)
+        last = len(bounds) - 1 if final else len(bounds) - 2
+        good = 0
+        for i in range(last):
+            if bounds[i + 1] - bounds[i] < self.chunk_size:
+                continue
+            if good < i:
+                self._merge(text, bounds, good, i, chunks)
+            if remaining:
+                self._split(text, bounds[i], bounds[i + 1], remaining, chunks)
+            else:
+                chunks.append((bounds[i], bounds[i + 1]))
+            good = i + 1
+        if not final:
+            return self._merge(text, bounds, good, last, chunks, final=False)
+        if good < last:
+            self._merge(text, bounds, good, last, chunks)
+        return end
+
+    def _split_on_char(self, text, start, end, separator, remaining, chunks, final=True):
+        """
+        _split_on and _merge for a one character separator without listing the pieces: the merge
+        only needs the last separator that fits in the chunk, the one after it and where the overlap
+        starts, each found with one find/rfind. A chunk costs a few searches however many words it
+        has and nothing the size of the text is built. (A longer separator can overlap itself,
+        "\n\n\n", and has to be found left to right like langchain does, so it gets the list.)
+        """
+        size, overlap = self.chunk_size, self.chunk_overlap
+        # a prefix stops where its last piece, the one that may still grow, starts
+        stop = end if final else max(start, text.rfind(separator, start + 1, end))
+        low = start
+        while low < stop:
+            following = text.find(separator, low + 1, stop)
+            following = stop if following == -1 else following
+            if following - low >= size:
+                if remaining:
+                    self._split(text, low, following, remaining, chunks)
+                else:
+                    chunks.append((low, following))
+                low = following
+                continue
+            # a run of short pieces from low, merged until the stop or a piece too long for a chunk
+            while True:
+                high = stop if low + size >= stop else text.rfind(separator, low + 1, low + size + 1)
+                if high == stop and not final:
+                    return low
+                self._emit(text, low, high, chunks)
+                if high == stop:
+                    return end
+                following = text.find(separator, high + 1, stop)
+                following = stop if following == -1 else following
+                if following - high >= size:
+                    low = high
+                    break
+                keep = min(overlap, size - (following - high))
+                found = text.find(separator, high - keep, high)
+                low = high if found == -1 else found
+        return stop
+
+    def _merge(self, text, bounds, first, last, chunks, final=True):
+        """
+        The greedy merge of the splitter over the pieces first..last-1, every one shorter than the
+        chunk size. As the pieces are contiguous, the length of a run of pieces is the difference
+        of its bounds, so each chunk is found with two binary searches instead of piece by piece.
+        When not final, piece `last` is still growing: the chunk that could take it is not made and
+        the offset it starts at is returned.
+        """
+        size, overlap = self.chunk_size, self.chunk_overlap
+        low = first
+        while True:
+            # the longest run from low that fits, the next piece would go over the chunk size
+            high = bisect.bisect_right(bounds, bounds[low] + size, low, last + 1) - 1
+            if high >= last and not final:
+                return bounds[low]
+            self._emit(text, bounds[low], bounds[high], chunks)
+            if high >= last:
+                return
+            # the splitter drops pieces from the front until what is left is within the overlap
+            # and leaves room for the next piece
+            keep = min(overlap, size - (bounds[high + 1] - bounds[high]))
+            low = min(bisect.bisect_left(bounds, bounds[high] - keep, low, high + 1), high)
+
+    @staticmethod
+    def _emit(text, start, end, chunks):
+        # strip_whitespace, without building the chunk until it is known not to be blank
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            chunks.append((start, end))
+
+
+def chunk_records(text, splitter, page_starts=None, doc=0):
+    """
+    CHUNK_DTYPE rows of the chunks of the text, the page of a chunk is the one its start is on
+    (page_starts are the offsets where the pages begin in the text)
+    """
+    offsets = splitter.split_offsets(text)
+    records = np.zeros(len(offsets), dtype=CHUNK_DTYPE)
+    if offsets:
+        spans = np.asarray(offsets, dtype=np.int64)
+        records["start"], records["end"] = spans[:, 0], spans[:, 1]
+    records["doc"] = doc
+    if page_starts is not None and len(page_starts):
+        records["page"] = np.searchsorted(np.asarray(page_starts), records["start"], side="right") - 1
+    return records
+
+
+def join_pages(pages):
+    """the text of the pages and the offset every page starts at"""
+    pages = [pages] if isinstance(pages, str) else list(pages)
+    starts, position = [], 0
+    for page in pages:
+        starts.append(position)
+        position += len(page)
+    return "".join(pages), starts
+
+
+class ChunkBatch:
+    """
+    The chunks of many documents as their texts plus one record array, instead of a string and a
+    Document per chunk. A chunk's text is only sliced out when it is asked for.
+    """
+
+    def __init__(self, texts, records):
+        self.texts = texts
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def chunk(self, i):
+        row = self.records[i]
+        return self.texts[row["doc"]][row["start"]:row["end"]]
+
+    def document(self, doc):
+        """(chunk, page) pairs of one document, what index_chunks takes through with_pages"""
+        text = self.texts[doc]
+        rows = self.records[self.records["doc"] == doc]
+        return ((text[start:end], int(page)) for start, end, page in zip(rows["start"].tolist(), rows["end"].tolist(), rows["page"].tolist()))
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+
+def split_document(pages, splitter):
+    """
+    Yields (chunk, page) for a document given as page texts (any iterable, e.g. pages still being
+    parsed) as the pages come in: every page is split together with the unfinished tail of the
+    pages before it, so only that tail and the page are held. The top separator is the first of
+    the splitter's found in the pages so far. That is the one of the whole text, and the chunks
+    are the same as split_offsets makes of it, unless a better one (a blank line in a text split
+    on lines) only shows up after the first page that had a separator, the rest is split with it.
+    """
+    # longest a separator can run over from the text before into the next page
+    overlap = max(map(len, splitter.separators), default=1) - 1
+    page_starts, length = [], 0
+    text, offset, level = "", 0, None
+    for page in pages:
+        page_starts.append(length)
+        length += len(page)
+        new = (text[-overlap:] if overlap else "") + page
+        text += page
+        better = [i for i, separator in enumerate(splitter.separators[:level]) if separator and separator in new]
+        if better:
+            level = better[0]
+        if level is None:
+            continue
+        chunks, rest = splitter.split_prefix(text, level)
+        for start, end in chunks:
+            yield text[start:end], bisect.bisect_right(page_starts, offset + start) - 1
+        text, offset = text[rest:], offset + rest
+    chunks = splitter.split_offsets(text) if level is None else splitter.split_prefix(text, level, final=True)[0]
+    for start, end in chunks:
+        yield text[start:end], bisect.bisect_right(page_starts, offset + start) - 1
+
+
+def _chunk_documents(documents, chunk_size, chunk_overlap, separators):
+    # module level so it runs in a process pool, only the records travel back
+    splitter = OffsetSplitter(chunk_size, chunk_overlap, separators)
+    results = []
+    for text, page_starts in documents:
+        results.append(chunk_records(text, splitter, page_starts))
+    return results
+
+
+def chunk_documents(documents, splitter, pool=None, documents_per_task=DOCUMENTS_PER_TASK):
+    """
+    Chunks many documents (each a text or a list of page texts) in one batch, in the process pool
+    when one is given. Returns a ChunkBatch, the chunks are the ones the splitter makes of every
+    document on its own.
+    """
+    joined = [join_pages(document) for document in documents]
+    texts = [text for text, _ in joined]
+    if pool is None:
+        parts = _chunk_documents(joined, splitter.chunk_size, splitter.chunk_overlap, splitter.separators)
+    else:
+        tasks = [joined[i:i + documents_per_task] for i in range(0, len(joined), documents_per_task)]
+        futures = [pool.submit(_chunk_documents, task, splitter.chunk_size, splitter.chunk_overlap, splitter.separators) for task in tasks]
+        parts = [records for future in futures for records in future.result()]
+    for doc, records in enumerate(parts):
+        records["doc"] = doc
+    records = np.concatenate(parts) if parts else np.zeros(0, dtype=CHUNK_DTYPE)
+    return ChunkBatch(texts, records)
+
+
+def parse_pdf_chunks(data, chunk_size, chunk_overlap):
+    """
+    Parses the PDF (bytes or a path) and chunks the text in the same process, module level so a paper is
+    parsed and chunked in a worker of the process pool. Returns a ChunkBatch of the one document.
+    """
+    from pdf_extract import extract_pdf_pages
+
+    text, page_starts = join_pages(extract_pdf_pages(data))
+    return ChunkBatch([text], chunk_records(text, OffsetSplitter(chunk_size, chunk_overlap), page_starts))
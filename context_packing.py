@@ -0,0 +1,118 @@
+import time
+
+from langchain_core.documents import Document
+
+from prerank import estimate_tokens
+from telemetry import span
+
+# tokens of retrieved context that go into the prompt, per mode
+DEFAULT_CONTEXT_BUDGET = 2500
+MODE_CONTEXT_BUDGETS = {"PDF RAG": 3000, "Research Papers": 3500, "YouTube Videos": 2500}
+# the text splitter overlaps chunks by 100 characters, a bit more is searched in case the split moved
+MAX_OVERLAP = 200
+
+
+def context_budgets(value=None):
+    """
+    Budget per mode, the defaults updated with a "mode=tokens,mode=tokens" string (VERI_CONTEXT_BUDGETS),
+    a bare number sets the budget of the modes without one of their own.
+    """
+    budgets = dict(MODE_CONTEXT_BUDGETS, default=DEFAULT_CONTEXT_BUDGET)
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        mode, _, tokens = part.rpartition("=")
+        budgets[mode.strip() or "default"] = int(tokens)
+    return budgets
+
+
+def _overlap(previous, text):
+    """length of the longest end of previous that text starts with"""
+    for size in range(min(MAX_OVERLAP, len(previous), len(text)), 0, -1):
+        if previous.endswith(text[:size]):
+            return size
+    return 0
+
+
+def _chunk_index(document):
+    # pinecone gives numbers back as floats
+    index = document.metadata.get("chunk_index")
+    return int(index) if index is not None else None
+
+
+def merge_adjacent(documents):
+    """
+    Merges chunks that follow each other in the same source into one passage, without the text
+    the splitter repeated between them. Returns (passage, rank of its best chunk) pairs.
+    """
+    groups = {}
+    for rank, document in enumerate(documents):
+        key = (document.metadata.get("source_type"), document.metadata.get("source"))
+        groups.setdefault(key, []).append((rank, document))
+    passages = []
+    for (_, source), members in groups.items():
+        if source is None:
+            passages.extend((document, rank) for rank, document in members)
+            continue
+        members.sort(key=lambda member: (_chunk_index(member[1]) is None, _chunk_index(member[1]) or 0))
+        run, text, best, last = None, "", 0, None
+        for rank, document in members:
+            index = _chunk_index(document)
+            if run is not None and index is not None and last is not None and index == last + 1:
+                text += document.page_content[_overlap(text, document.page_content):]
+                best = min(best, rank)
+            else:
+                if run is not None:
+                    passages.append((Document(page_content=text, metadata=run.metadata), best))
+                run, text, best = document, document.page_content, rank
+            last = index
+        passages.append((Document(page_content=text, metadata=run.metadata), best))
+    return passages
+
+
+def pack_context(documents, token_budget):
+    """
+    Packs the documents (best first, as the reranker returns them) into the token budget: adjacent
+    chunks are merged, passages keep the order of their best chunk and the ones that don't fit are
+    skipped for smaller ones further down. The best passage is cut to the budget when it alone is
+    over it. Returns the packed documents and (tokens before, tokens after).
+    """
+    before = sum(estimate_tokens(document.page_content) for document in documents)
+    packed, used = [], 0
+    for passage, _ in sorted(merge_adjacent(documents), key=lambda item: item[1]):
+        size = estimate_tokens(passage.page_content)
+        if used + size <= token_budget:
+            packed.append(passage)
+            used += size
+        elif not packed:
+            text = passage.page_content[:token_budget * 4]
+            packed.append(Document(page_content=text, metadata=passage.metadata))
+            used += estimate_tokens(text)
+    return packed, (before, used)
+
+
+class ContextPacker:
+    """
+    Last retrieval step, packs the reranked documents into the budget of the mode so the prompt
+    size no longer depends on what came back. The prompt tokens (template + context, the question
+    left out) before and after go into `stats` when it is given.
+    """
+
+    def __init__(self, token_budget, template, stats=None):
+        self.token_budget = token_budget
+        self.template_tokens = estimate_tokens(template)
+        self.stats = stats
+
+    def __call__(self, documents):
+        start = time.perf_counter()
+        with span("pack", budget=self.token_budget) as pack:
+            packed, (before, after) = pack_context(documents, self.token_budget)
+            pack.set(documents=len(documents), packed=len(packed), tokens_before=before, tokens_after=after)
+        if self.stats is not None:
+            self.stats.update(
+                pack=time.perf_counter() - start,
+                prompt_tokens_before=self.template_tokens + before,
+                prompt_tokens_after=self.template_tokens + after,
+                packed=len(packed),
+            )
+        return packed
@@ -0,0 +1,288 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from manifest import CACHE_DIR, content_hash, owner_lock, write_json
+
+# how many vectors are kept on disk before the least recently used ones are evicted
+DEFAULT_MAX_ENTRIES = 100_000
+# the index is written at most this often, the vectors themselves go straight to the memmap
+SAVE_INTERVAL = 5.0
+
+
+def _dimension(embeddings):
+    return getattr(embeddings, "dim", None) or getattr(embeddings, "dimensions", None)
+
+
+def embeddings_name(embeddings):
+    """
+    name the vectors of an embedding model are cached under: its class, model and vector size when
+    it has them, so two models, or one model at two sizes, never share a cache
+    """
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+    return "-".join(str(part) for part in (type(embeddings).__name__, model, _dimension(embeddings)) if part)
+
+
+def _tag(key):
+    """64 bits of the (hex) key, stored next to its row"""
+    return np.uint64(int(key[:16], 16))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk backed cache in front of an embedding model. Vectors are stored as float32 rows of a
+    memory mapped file and a small json index maps (model, kind, text hash) to the row.
+    Query and document embeddings are cached separately because cohere embeds them differently.
+    Rows are written in place, so only one instance owns the files. Another one on the same cache
+    folder (service.py next to the app, a second engine) maps them read only and serves the hits
+    from there, the vectors it embeds itself are kept in memory. Next to every row the owner keeps
+    a tag of its key, a reader checks it so a row the owner has reused since is a miss and not
+    somebody else's vector. Files holding vectors of another size than the model's are left alone
+    and the instance caches in memory only.
+    """
+
+    def __init__(self, embeddings, model_name=None, cache_dir=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model_name = model_name or embeddings_name(embeddings)
+        self.max_entries = max_entries
+        folder = os.path.join(cache_dir or CACHE_DIR, "embeddings")
+        os.makedirs(folder, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", self.model_name)
+        self.vectors_path = os.path.join(folder, f"{slug}.f32")
+        self.index_path = os.path.join(folder, f"{slug}.json")
+        self.keys_path = os.path.join(folder, f"{slug}.keys")
+
+        self._lock = threading.RLock()
+        # size of the model's vectors, from the model when it says it, otherwise from the first vector
+        self.dim = _dimension(embeddings)
+        self.capacity = 0
+        self._vectors = None
+        # key tag of every row, 0 while the row is free or being written
+        self._keys = None
+        # key -> row, kept in least recently used order
+        self._slots = OrderedDict()
+        self._free = []
+        # files of the owner mapped read only when this instance is not the owner
+        self._shared_vectors = None
+        self._shared_keys = None
+        self._shared_slots = {}
+        self._shared_mtime = None
+        self._shared_checked = 0.0
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self._owner = owner_lock(os.path.join(folder, f"{slug}.lock"))
+        if self._owner is None:
+            self._open_shared()
+        else:
+            self._load()
+        atexit.register(self.flush)
+
+    def _read_index(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.vectors_path)):
+            return None
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self):
+        data = self._read_index()
+        if data is None:
+            return
+        if self.dim is not None and data["dim"] != self.dim:
+            self._detach(self.dim)
+            return
+        self.dim = data["dim"]
+        self.capacity = data["capacity"]
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self._slots = OrderedDict((key, slot) for key, slot in data["slots"])
+        used = set(self._slots.values())
+        self._free = [slot for slot in range(self.capacity) if slot not in used]
+        tagged = os.path.exists(self.keys_path)
+        self._map_keys()
+        if not tagged:
+            # written before rows had key tags
+            for key, slot in self._slots.items():
+                self._keys[slot] = _tag(key)
+
+    def _detach(self, dim):
+        """
+        The files hold vectors of another size than the model makes, another model was cached under
+        the same name. Nothing more is read from them or written to them (they may be mapped by other
+        processes, so they are not truncated either), this instance caches in memory only.
+        """
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+        self.dim = dim
+        self.capacity = 0
+        self._vectors = self._keys = None
+        self._slots = OrderedDict()
+        self._free = []
+        self._shared_vectors = self._shared_keys = None
+        self._shared_slots = {}
+
+    def _map_keys(self):
+        with open(self.keys_path, "ab") as f:
+            f.truncate(self.capacity * 8)
+        self._keys = np.memmap(self.keys_path, dtype=np.uint64, mode="r+", shape=(self.capacity,))
+
+    def _open_shared(self):
+        """maps the files of the owner read only, as they were when it last saved its index"""
+        self._shared_checked = time.monotonic()
+        try:
+            mtime = os.stat(self.index_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._shared_mtime:
+            return
+        data = self._read_index()
+        if data is None or not os.path.exists(self.keys_path) or (self.dim is not None and data["dim"] != self.dim):
+            return
+        try:
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(data["capacity"], data["dim"]))
+            keys = np.memmap(self.keys_path, dtype=np.uint64, mode="r", shape=(data["capacity"],))
+        except (OSError, ValueError):
+            # the owner is growing the files right now, the next check picks them up
+            return
+        self.dim = data["dim"]
+        self._shared_vectors, self._shared_keys = vectors, keys
+        self._shared_slots = dict(data["slots"])
+        self._shared_mtime = mtime
+
+    def _grow(self, needed):
+        """makes room for `needed` more rows, doubling the memmap up to max_entries"""
+        if len(self._free) >= needed or self.capacity >= self.max_entries:
+            return
+        new_capacity = min(self.max_entries, max(1024, self.capacity * 2, self.capacity + needed))
+        if self._owner is None:
+            vectors = np.zeros((new_capacity, self.dim), dtype=np.float32)
+            if self._vectors is not None:
+                vectors[:self.capacity] = self._vectors
+            self._vectors = vectors
+        else:
+            if self._vectors is not None:
+                self._vectors.flush()
+                del self._vectors
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(new_capacity * self.dim * 4)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim))
+        self._free.extend(range(self.capacity, new_capacity))
+        self.capacity = new_capacity
+        if self._owner is not None:
+            if self._keys is not None:
+                self._keys.flush()
+                del self._keys
+            self._map_keys()
+
+    def _key(self, kind, text):
+        return content_hash(f"{self.model_name}\0{kind}\0{text}")[:32]
+
+    def _get(self, key):
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._slots.move_to_end(key)
+            return self._vectors[slot].tolist()
+        slot = self._shared_slots.get(key)
+        if slot is None:
+            return None
+        vector = self._shared_vectors[slot].tolist()
+        # the tag is read after the vector: the owner clears it before it writes another vector in the row
+        if self._shared_keys[slot] != _tag(key):
+            del self._shared_slots[key]
+            return None
+        return vector
+
+    def _put(self, key, vector):
+        if self.dim is None:
+            self.dim = len(vector)
+        elif len(vector) != self.dim:
+            # the cached vectors are not this model's, none of them is served or written to again
+            self._detach(len(vector))
+        if key in self._slots:
+            return
+        self._grow(1)
+        if self._free:
+            slot = self._free.pop()
+        else:
+            # full, reuse the row of the least recently used entry
+            _, slot = self._slots.popitem(last=False)
+        if self._keys is not None:
+            self._keys[slot] = 0
+        self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+        if self._keys is not None:
+            self._keys[slot] = _tag(key)
+        self._slots[key] = slot
+        self._dirty = True
+
+    def _lookup(self, kind, texts, embed):
+        keys = [self._key(kind, text) for text in texts]
+        results = [None] * len(texts)
+        missing = OrderedDict()
+        with self._lock:
+            if self._owner is None and time.monotonic() - self._shared_checked > SAVE_INTERVAL:
+                self._open_shared()
+            for i, key in enumerate(keys):
+                vector = self._get(key)
+                if vector is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    results[i] = vector
+            self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+            self.misses += sum(len(positions) for positions in missing.values())
+        if not missing:
+            return results
+
+        # the remote call is made outside the lock so other sessions can still read the cache
+        vectors = embed([texts[positions[0]] for positions in missing.values()])
+        with self._lock:
+            for (key, positions), vector in zip(missing.items(), vectors):
+                self._put(key, vector)
+                for i in positions:
+                    results[i] = list(vector)
+            self._maybe_save()
+        return results
+
+    def embed_documents(self, texts):
+        return self._lookup("document", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._lookup("query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def _maybe_save(self):
+        if self._dirty and time.monotonic() - self._last_save > SAVE_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """writes the vectors and the index to disk"""
+        with self._lock:
+            if not self._dirty or self._vectors is None or self._owner is None:
+                return
+            self._vectors.flush()
+            self._keys.flush()
+            write_json(self.index_path, {"dim": self.dim, "capacity": self.capacity, "slots": list(self._slots.items())})
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+    def stats(self):
+        """hit/miss counters of this process"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._slots),
+                "capacity": self.capacity,
+                "shared_entries": len(self._shared_slots),
+            }
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from chunker import chunk_documents
+from manifest import write_json
+from pdf_extract import extract_pdf_pages
+from telemetry import record, record_error, run_timed
+
+# files picked up by the folder sync, VERI_FOLDER_EXTENSIONS overrides it
+DEFAULT_EXTENSIONS = (".pdf", ".txt", ".md")
+# the sync state is written after this many files, and once at the end
+SAVE_EVERY = 200
+# files parsed at the same time, the process pool queue is kept short so a huge folder is not all in memory
+MAX_PENDING_PARSES = 16
+
+
+def scan_folder(root, extensions=DEFAULT_EXTENSIONS):
+    """path -> (mtime_ns, size) of every file under root with one of the extensions, only stat calls"""
+    files = {}
+    stack = [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file() and entry.name.lower().endswith(extensions):
+                stat = entry.stat()
+                files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def parse_file(path, known_hash=None, splitter=None):
+    """
+    Reads the file once and returns (content hash, page texts), the pages are None when the hash is
+    known_hash (the file was touched but not changed). With an offset splitter the file is chunked
+    here too and a ChunkBatch comes back instead of the pages. Module level so it runs in a process pool.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    doc_hash = hashlib.sha256(data).hexdigest()
+    if doc_hash == known_hash:
+        return doc_hash, None
+    if path.lower().endswith(".pdf"):
+        pages = extract_pdf_pages(data)
+    else:
+        pages = [data.decode("utf-8", errors="replace")]
+    return doc_hash, chunk_documents([pages], splitter) if splitter is not None else pages
+
+
+class FolderState:
+    """
+    Last synced (mtime_ns, size, content hash) of every file of the folder. A file whose mtime and
+    size did not change is not opened at all, so re-syncing an unchanged folder is only a directory walk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.files = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.files = {file: tuple(entry) for file, entry in json.load(f).items()}
+            except (OSError, ValueError):
+                # without the state every file is hashed again, the ones already indexed are still skipped
+                self.files = {}
+
+    def diff(self, files):
+        """returns (new or changed paths, removed paths) of the scanned files against the last sync"""
+        with self._lock:
+            changed = [path for path, stat in files.items() if tuple(self.files.get(path, ())[:2]) != stat]
+            removed = [path for path in self.files if path not in files]
+        return changed, removed
+
+    def update(self, path, stat, doc_hash):
+        with self._lock:
+            self.files[path] = (*stat, doc_hash)
+
+    def remove(self, path):
+        with self._lock:
+            return self.files.pop(path, None)
+
+    def is_used(self, doc_hash):
+        """true if a file of the folder still has this content"""
+        with self._lock:
+            return any(entry[2] == doc_hash for entry in self.files.values())
+
+    def hash_of(self, path):
+        with self._lock:
+            entry = self.files.get(path)
+        return entry[2] if entry else None
+
+    def save(self):
+        with self._lock:
+            files = dict(self.files)
+        write_json(self.path, files)
+
+
+def sync_folder(root, state, index_file, remove_document, parse_pool, extensions=DEFAULT_EXTENSIONS, progress=None, splitter=None):
+    """
+    Brings the index in line with the folder: removed files are deleted with remove_document(doc_hash),
+    new and changed files are parsed in the process pool and handed to index_file(path, doc_hash, pages)
+    as soon as each one is ready, then the old document of a changed file is removed. With a splitter
+    the files are chunked in the pool as well and index_file gets their ChunkBatch instead of the pages.
+    Unchanged files cost one stat. Returns the counts of what was done.
+    """
+    files = scan_folder(root, extensions)
+    changed, removed = state.diff(files)
+    stats = {"files": len(files), "changed": 0, "touched": 0, "removed": 0, "failed": 0}
+
+    def release(doc_hash):
+        # two files with the same content share their document, it goes with the last of them
+        if not state.is_used(doc_hash):
+            remove_document(doc_hash)
+
+    for path in removed:
+        entry = state.remove(path)
+        if entry:
+            release(entry[2])
+        stats["removed"] += 1
+    pending = {}
+    queue = iter(changed)
+    done = 0
+
+    def submit_next():
+        path = next(queue, None)
+        if path is not None:
+            pending[parse_pool.submit(run_timed, parse_file, path, state.hash_of(path), splitter)] = path
+
+    for _ in range(MAX_PENDING_PARSES):
+        submit_next()
+    while pending:
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            path = pending.pop(future)
+            submit_next()
+            done += 1
+            try:
+                (doc_hash, pages), seconds = future.result()
+                record("file_parse", seconds, source=path, bytes=files[path][1])
+                if pages is None:
+                    stats["touched"] += 1
+                else:
+                    index_file(path, doc_hash, pages)
+                    stats["changed"] += 1
+                old_hash = state.hash_of(path)
+                state.update(path, files[path], doc_hash)
+                if old_hash and old_hash != doc_hash:
+                    release(old_hash)
+            except Exception as e:
+                # one unreadable file should not stop the sync, it is tried again next time
+                record_error("file_sync", e, source=path)
+                stats["failed"] += 1
+            if progress:
+                progress(done / len(changed), f"synced {done}/{len(changed)} changed files")
+            if done % SAVE_EVERY == 0:
+                state.save()
+    state.save()
+    return stats
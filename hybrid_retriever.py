@@ -0,0 +1,95 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from manifest import content_hash
+from telemetry import span
+
+# k of reciprocal rank fusion, 60 is the value from the original paper
+RRF_K = 60
+
+# vector searches run here while the lexical index is searched on the calling thread
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-search")
+
+
+def document_key(document):
+    """the vector id when the store returns it, the hash of the text otherwise (which is what the ids are)"""
+    return getattr(document, "id", None) or content_hash(document.page_content)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, limit=None):
+    """
+    Fuses several ranked lists of documents into one, a document scores sum(1 / (k + rank)) over
+    the lists it is in. Only the ranks are used so BM25 and cosine scores never have to be compared.
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            documents.setdefault(key, document)
+    fused = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [documents[key] for key in fused]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense + lexical retrieval: the vector store and the BM25 index are searched for fetch_k
+    candidates each (in parallel) and fused with reciprocal rank fusion, so exact terms (acronyms,
+    equation names, paper titles) the embedding misses still reach the reranker. With `shared` the
+    shared namespace (the synced folder) is searched next to the session's own and fused the same
+    way. The timings and candidate counts of the searches go into `stats` when it is given.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    k: int = 10
+    fetch_k: int = 20
+    namespace: str = ""
+    shared: bool = False
+    filter: Optional[dict] = None
+    # filled in place, Any so pydantic keeps the caller's dict instead of a copy
+    stats: Any = None
+
+    def _namespaces(self):
+        return [self.namespace, ""] if self.shared and self.namespace else [self.namespace]
+
+    def _vector_search(self, query, namespace):
+        start = time.perf_counter()
+        with span("vector_search", namespace=namespace) as search:
+            documents = self.vectorstore.similarity_search(query, k=self.fetch_k, namespace=namespace, filter=self.filter)
+            search.set(candidates=len(documents))
+        return documents, time.perf_counter() - start
+
+    def _lexical_search(self, query, namespace):
+        with span("lexical_search", namespace=namespace) as search:
+            documents = [
+                Document(id=vector_id, page_content=text, metadata=metadata)
+                for vector_id, text, metadata, _ in self.lexical.search(query, k=self.fetch_k, namespace=namespace, filter=self.filter)
+            ]
+            search.set(candidates=len(documents))
+        return documents
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        start = time.perf_counter()
+        namespaces = self._namespaces()
+        dense = [_search_pool.submit(contextvars.copy_context().run, self._vector_search, query, namespace) for namespace in namespaces]
+        lexical = [self._lexical_search(query, namespace) for namespace in namespaces]
+        lexical_seconds = time.perf_counter() - start
+        dense = [future.result() for future in dense]
+        fused = reciprocal_rank_fusion([documents for documents, _ in dense] + lexical, limit=self.k)
+        if self.stats is not None:
+            self.stats.update(
+                vector_search=max(seconds for _, seconds in dense),
+                lexical_search=lexical_seconds,
+                search=time.perf_counter() - start,
+                vector_candidates=sum(len(documents) for documents, _ in dense),
+                lexical_candidates=sum(len(documents) for documents in lexical),
+                fused=len(fused),
+            )
+        return fused
@@ -0,0 +1,190 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import span
+
+QUEUED = "queued"
+PARSING = "parsing"
+EMBEDDING = "embedding"
+INDEXED = "indexed"
+FAILED = "failed"
+
+# finished jobs kept around so the UI can still show them
+MAX_FINISHED_JOBS = 200
+
+
+class QueueFull(Exception):
+    """raised when too many ingestion jobs are already waiting"""
+
+
+class IngestionJob:
+    """
+    One ingestion (a PDF, a paper search or a video) and where it is at. The worker updates it
+    through `update`, which is also the progress callback handed to the ingestion methods.
+    """
+
+    def __init__(self, job_id, kind, key, description):
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.description = description
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.error = None
+        self.attempts = 0
+        self.result = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+
+    def update(self, status=None, progress=None, message=None):
+        with self._lock:
+            if status is not None:
+                self.status = status
+            if progress is not None:
+                self.progress = max(0.0, min(1.0, progress))
+            if message is not None:
+                self.message = message
+            self.updated_at = time.time()
+
+    @property
+    def done(self):
+        return self.status in (INDEXED, FAILED)
+
+    def snapshot(self):
+        """plain dict of the job, safe to hand to the UI or serialize"""
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "description": self.description,
+                "status": self.status,
+                "progress": self.progress,
+                "message": self.message,
+                "error": self.error,
+                "attempts": self.attempts,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+
+
+class IngestionQueue:
+    """
+    Runs ingestion jobs on a small thread pool so uploads and searches don't block the chat.
+    At most `max_pending` jobs can be queued or running, failed jobs are retried `max_retries`
+    times with a growing delay. Jobs are deduplicated by key while they are known, so the same
+    upload submitted on every streamlit rerun only runs once. That includes a job that failed, its
+    input would most likely fail again (a corrupt PDF, a rate limited search), it is only run again
+    through retry, from an explicit action of the user.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, max_retries=2, retry_delay=1.0):
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        # job id -> (fn, args, kwargs) until the job is indexed, what retry runs again
+        self._calls = {}
+
+    def submit(self, kind, fn, *args, key=None, description=None, **kwargs):
+        """
+        Queues fn(*args, progress=job.update, **kwargs) and returns its job, or the existing job for the key,
+        failed or not. Raises QueueFull when max_pending jobs are already waiting or running.
+        """
+        with self._lock:
+            existing = self._find(key)
+            if existing is not None:
+                return existing
+            job = self._add(kind, key, description or kind, fn, args, kwargs)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def retry(self, job_id):
+        """
+        Runs a failed job again as a new job for the same key and returns the new one. A job that did
+        not fail is returned as it is, one that was retried already gives the job of its key now.
+        None for an unknown job, raises QueueFull like submit.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            current = self._find(job.key)
+            if current is not None and current is not job:
+                return current
+            if job.status != FAILED:
+                return job
+            fn, args, kwargs = self._calls.pop(job.id)
+            retried = self._add(job.kind, job.key, job.description, fn, args, kwargs)
+        self._executor.submit(self._run, retried, fn, args, kwargs)
+        return retried
+
+    def _add(self, kind, key, description, fn, args, kwargs):
+        pending = sum(1 for job in self._jobs.values() if not job.done)
+        if pending >= self.max_pending:
+            raise QueueFull(f"{pending} ingestion jobs are already pending, try again in a moment")
+        job = IngestionJob(next(self._ids), kind, key, description)
+        self._jobs[job.id] = job
+        self._calls[job.id] = (fn, args, kwargs)
+        if key is not None:
+            self._by_key[key] = job.id
+        self._trim()
+        return job
+
+    def find(self, key):
+        """the job submit would return for the key, None when submitting it would make a new one"""
+        with self._lock:
+            return self._find(key)
+
+    def _find(self, key):
+        if key is None or key not in self._by_key:
+            return None
+        return self._jobs[self._by_key[key]]
+
+    def _trim(self):
+        finished = [job for job in self._jobs.values() if job.done]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+            self._calls.pop(job.id, None)
+            if self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
+
+    def _run(self, job, fn, args, kwargs):
+        while True:
+            job.attempts += 1
+            try:
+                # every attempt is one ingestion span, the parse / split / embed / upsert spans are its children
+                with span("ingest", kind=job.kind, job=job.id, attempt=job.attempts):
+                    job.result = fn(*args, progress=job.update, **kwargs)
+                with self._lock:
+                    # an indexed job is never run again, its upload or query needn't be kept
+                    self._calls.pop(job.id, None)
+                job.update(status=INDEXED, progress=1.0, message="")
+                return
+            except Exception as e:
+                if job.attempts > self.max_retries:
+                    job.error = str(e)
+                    job.update(status=FAILED, message=str(e))
+                    return
+                job.update(status=QUEUED, message=f"attempt {job.attempts} failed: {e}, retrying")
+                time.sleep(self.retry_delay * 2 ** (job.attempts - 1))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """all known jobs, oldest first"""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
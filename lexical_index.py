@@ -0,0 +1,182 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from local_index import matches_filter
+from manifest import CACHE_DIR
+from utils import STOP_WORDS, TOKEN_RE
+
+# BM25 parameters, the usual defaults
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """lower case terms without stop words, acronyms and names like "relu" or "gpt-4" stay whole"""
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def _pack(text, metadata):
+    return zlib.compress(json.dumps([text, metadata]).encode("utf-8"))
+
+
+def _unpack(payload):
+    return json.loads(zlib.decompress(payload))
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index in a SQLite file next to the vector store, updated with every upsert
+    instead of being rebuilt. Postings are (namespace, term, doc) -> term frequency in a table
+    without rowids, so a term lookup is a single range scan of the primary key and the file stays
+    small. Documents keep their text and metadata (zlib compressed) so results can be returned
+    without the vector store, and are keyed by the same ids as the vectors so the two result lists
+    can be fused.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "lexical.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS namespaces (
+                id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, docs INTEGER NOT NULL DEFAULT 0, length INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY, ns INTEGER NOT NULL, vector_id TEXT NOT NULL, length INTEGER NOT NULL,
+                payload BLOB NOT NULL, UNIQUE (ns, vector_id)
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                ns INTEGER NOT NULL, term TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL,
+                PRIMARY KEY (ns, term, doc)
+            ) WITHOUT ROWID;
+        """)
+
+    def _ns(self, namespace, create=False):
+        row = self._db.execute("SELECT id FROM namespaces WHERE name = ?", (namespace or "",)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        return self._db.execute("INSERT INTO namespaces (name) VALUES (?)", (namespace or "",)).lastrowid
+
+    def _remove(self, ns, doc, payload):
+        # the terms of a document come from its text, so no index on postings.doc is needed to delete it
+        terms = set(tokenize(_unpack(payload)[0]))
+        self._db.executemany("DELETE FROM postings WHERE ns = ? AND term = ? AND doc = ?", [(ns, term, doc) for term in terms])
+        length = self._db.execute("SELECT length FROM docs WHERE id = ?", (doc,)).fetchone()[0]
+        self._db.execute("DELETE FROM docs WHERE id = ?", (doc,))
+        self._db.execute("UPDATE namespaces SET docs = docs - 1, length = length - ? WHERE id = ?", (length, ns))
+
+    def add(self, ids, documents, namespace=None):
+        """adds (or replaces) the langchain documents under the given ids"""
+        with self._lock, self._db:
+            ns = self._ns(namespace, create=True)
+            for vector_id, document in zip(ids, documents):
+                existing = self._db.execute("SELECT id, payload FROM docs WHERE ns = ? AND vector_id = ?", (ns, vector_id)).fetchone()
+                if existing is not None:
+                    self._remove(ns, *existing)
+                counts = Counter(tokenize(document.page_content))
+                length = sum(counts.values())
+                doc = self._db.execute(
+                    "INSERT INTO docs (ns, vector_id, length, payload) VALUES (?, ?, ?, ?)",
+                    (ns, vector_id, length, _pack(document.page_content, document.metadata))
+                ).lastrowid
+                self._db.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", [(ns, term, doc, tf) for term, tf in counts.items()])
+                self._db.execute("UPDATE namespaces SET docs = docs + 1, length = length + ? WHERE id = ?", (length, ns))
+
+    def delete(self, ids=None, namespace=None, filter=None):
+        """deletes the given ids, or every document of the namespace matching the metadata filter"""
+        with self._lock, self._db:
+            ns = self._ns(namespace)
+            if ns is None:
+                return 0
+            if ids is not None:
+                rows = []
+                for vector_id in ids:
+                    row = self._db.execute("SELECT id, payload FROM docs WHERE ns = ? AND vector_id = ?", (ns, vector_id)).fetchone()
+                    if row is not None:
+                        rows.append(row)
+            else:
+                rows = [
+                    (doc, payload) for doc, payload in self._db.execute("SELECT id, payload FROM docs WHERE ns = ?", (ns,)).fetchall()
+                    if matches_filter(_unpack(payload)[1], filter)
+                ]
+            for doc, payload in rows:
+                self._remove(ns, doc, payload)
+            return len(rows)
+
+    def search(self, query, k=4, namespace=None, filter=None):
+        """
+        Returns up to k (vector id, text, metadata, score) of the namespace ranked by BM25,
+        only documents matching the Pinecone style metadata filter are kept.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            ns = self._ns(namespace)
+            if ns is None or not terms:
+                return []
+            total_docs, total_length = self._db.execute("SELECT docs, length FROM namespaces WHERE id = ?", (ns,)).fetchone()
+            if not total_docs:
+                return []
+            average_length = total_length / total_docs
+            docs, scores = [], []
+            for term in terms:
+                rows = self._db.execute(
+                    "SELECT p.doc, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc WHERE p.ns = ? AND p.term = ?",
+                    (ns, term)
+                ).fetchall()
+                if not rows:
+                    continue
+                postings = np.array(rows, dtype=np.float64)
+                idf = math.log(1 + (total_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                tf, length = postings[:, 1], postings[:, 2]
+                docs.append(postings[:, 0].astype(np.int64))
+                scores.append(idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length)))
+            if not docs:
+                return []
+            doc_ids, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(scores))
+            order = np.argsort(-totals, kind="stable")
+            results = []
+            # candidates are read in small batches, with a filter most of them may be skipped
+            for start in range(0, len(order), max(k, 32)):
+                batch = order[start:start + max(k, 32)]
+                placeholders = ",".join("?" * len(batch))
+                rows = {
+                    row[0]: row[1:] for row in self._db.execute(
+                        f"SELECT id, vector_id, payload FROM docs WHERE id IN ({placeholders})",
+                        [int(doc_ids[i]) for i in batch]
+                    )
+                }
+                for i in batch:
+                    vector_id, payload = rows[int(doc_ids[i])]
+                    text, metadata = _unpack(payload)
+                    if filter and not matches_filter(metadata, filter):
+                        continue
+                    results.append((vector_id, text, metadata, float(totals[i])))
+                    if len(results) >= k:
+                        return results
+            return results
+
+    def stats(self):
+        with self._lock:
+            namespaces = {
+                name: {"docs": docs, "average_length": length / docs if docs else 0.0}
+                for name, docs, length in self._db.execute("SELECT name, docs, length FROM namespaces")
+            }
+            terms = self._db.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+        return {"namespaces": namespaces, "terms": terms, "bytes": os.path.getsize(self.path)}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
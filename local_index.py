@@ -0,0 +1,420 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from manifest import CACHE_DIR
+
+# above this many vectors queries go through the approximate (IVF) index if it is enabled
+DEFAULT_ANN_THRESHOLD = 50_000
+# the memmap is flushed at most this often, the metadata is written to sqlite with every change
+SAVE_INTERVAL = 5.0
+# metadata fields kept as a numpy column of value codes, filters on them are vectorized
+FILTER_FIELDS = ("source_type", "source", "session_id")
+# code of a row without the field (or a free row), and of a filter value no row has
+MISSING, UNKNOWN = -1, -2
+
+
+def matches_filter(metadata, filter):
+    """
+    Pinecone style metadata filter: {"field": value}, {"field": {"$eq"/"$ne"/"$in"/"$nin": ...}},
+    {"$and": [...]} and {"$or": [...]}.
+    """
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$ne" and value == expected:
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op == "$nin" and value in expected:
+                return False
+    return True
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class NumpyIndex:
+    """
+    Local vector index with the same upsert/query/delete calls as a Pinecone Index, so the writer
+    and the vector store don't care which one they talk to. Vectors are normalized float32 rows of
+    one contiguous matrix memory mapped from `path`, exact top-k is a single matrix product.
+    With `ann=True` and more than `ann_threshold` vectors, queries only score the rows of the
+    `nprobe` closest k-means clusters (IVF), which is approximate but much cheaper on large corpora.
+    Ids and metadata of the rows are kept in a SQLite file next to the matrix and written as they
+    change, and the fields of `filter_fields` get a column of value codes so the filters of the
+    UI queries are numpy comparisons instead of a python check per row.
+    """
+
+    def __init__(self, path, dim=1024, ann=False, ann_threshold=DEFAULT_ANN_THRESHOLD, nprobe=8, filter_fields=FILTER_FIELDS):
+        self.path = path
+        self.dim = dim
+        self.ann = ann
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.db_path = os.path.join(path, "meta.sqlite")
+        # where the metadata was kept before it moved to sqlite, read once and removed
+        self.meta_path = os.path.join(path, "meta.json")
+
+        self._lock = threading.RLock()
+        self.capacity = 0
+        self._matrix = None
+        # row -> id / namespace / metadata, None for free rows
+        self._ids = []
+        self._namespaces = []
+        self._metadata = []
+        self._rows = {}
+        self._free = []
+        # namespace code of every row (-1 for free rows), so finding the live rows of a namespace is vectorized
+        self._row_ns = np.full(0, -1, dtype=np.int32)
+        self._ns_codes = {}
+        # field -> value code of every row, and field -> {value: code}
+        self._columns = {field: np.full(0, MISSING, dtype=np.int32) for field in filter_fields}
+        self._value_codes = {field: {} for field in filter_fields}
+        self._centroids = None
+        self._assignments = None
+        self._built_for = 0
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, ns TEXT NOT NULL, id TEXT NOT NULL, metadata TEXT NOT NULL);
+        """)
+        if os.path.exists(self.meta_path):
+            self._import_json()
+        info = dict(self._db.execute("SELECT key, value FROM info").fetchall())
+        if "dim" not in info or not os.path.exists(self.vectors_path):
+            return
+        self.dim = info["dim"]
+        self._grow_lists(os.path.getsize(self.vectors_path) // (self.dim * 4))
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        for row, ns, vector_id, metadata in self._db.execute("SELECT row, ns, id, metadata FROM rows"):
+            self._set_row(row, ns, vector_id, json.loads(metadata))
+        self._free = [row for row in range(self.capacity - 1, -1, -1) if self._ids[row] is None]
+
+    def _import_json(self):
+        """moves the metadata of an index saved as meta.json into sqlite"""
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO info VALUES ('dim', ?)", (data["dim"],))
+            self._db.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)", [
+                (row, ns, vector_id, json.dumps(metadata))
+                for row, (vector_id, ns, metadata) in enumerate(zip(data["ids"], data["namespaces"], data["metadata"]))
+                if vector_id is not None
+            ])
+        os.remove(self.meta_path)
+
+    def _ns_code(self, namespace):
+        return self._ns_codes.setdefault(namespace, len(self._ns_codes))
+
+    def _value_code(self, field, value):
+        try:
+            return self._value_codes[field].setdefault(value, len(self._value_codes[field]))
+        except TypeError:
+            # lists and dicts can't be coded, rows with them are checked one by one
+            return UNKNOWN
+
+    def _set_row(self, row, namespace, vector_id, metadata):
+        self._rows[(namespace, vector_id)] = row
+        self._ids[row] = vector_id
+        self._namespaces[row] = namespace
+        self._metadata[row] = metadata
+        self._row_ns[row] = self._ns_code(namespace)
+        for field, column in self._columns.items():
+            column[row] = self._value_code(field, metadata[field]) if field in metadata else MISSING
+
+    def _clear_row(self, row):
+        self._ids[row] = None
+        self._namespaces[row] = None
+        self._metadata[row] = None
+        self._row_ns[row] = -1
+        for column in self._columns.values():
+            column[row] = MISSING
+        self._free.append(row)
+
+    def _grow_lists(self, new_capacity):
+        extra = new_capacity - self.capacity
+        for rows in (self._ids, self._namespaces, self._metadata):
+            rows.extend([None] * extra)
+        self._row_ns = np.concatenate([self._row_ns, np.full(extra, -1, dtype=np.int32)])
+        for field, column in self._columns.items():
+            self._columns[field] = np.concatenate([column, np.full(extra, MISSING, dtype=np.int32)])
+        if self._assignments is not None:
+            self._assignments = np.concatenate([self._assignments, np.full(extra, -1, dtype=np.int32)])
+        self.capacity = new_capacity
+
+    def _grow(self, needed):
+        if len(self._free) >= needed:
+            return
+        new_capacity = max(1024, self.capacity * 2, self.capacity + needed)
+        if self._matrix is None:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO info VALUES ('dim', ?)", (self.dim,))
+        else:
+            self._matrix.flush()
+            del self._matrix
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim))
+        self._free.extend(range(new_capacity - 1, self.capacity - 1, -1))
+        self._grow_lists(new_capacity)
+
+    @property
+    def count(self):
+        return len(self._rows)
+
+    def upsert(self, vectors, namespace=None, **kwargs):
+        """vectors is a list of (id, values, metadata) tuples or dicts with id/values/metadata"""
+        namespace = namespace or ""
+        records = [(v["id"], v["values"], v.get("metadata") or {}) if isinstance(v, dict) else v for v in vectors]
+        if not records:
+            return {"upserted_count": 0}
+        values = np.asarray([values for _, values, _ in records], dtype=np.float32)
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values /= np.where(norms == 0, 1, norms)
+        with self._lock:
+            self._grow(len(records))
+            rows = []
+            for vector_id, _, metadata in records:
+                row = self._rows.get((namespace, vector_id))
+                if row is None:
+                    row = self._free.pop()
+                self._set_row(row, namespace, vector_id, dict(metadata))
+                rows.append(row)
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)",
+                    [(row, namespace, vector_id, json.dumps(self._metadata[row])) for row, (vector_id, _, _) in zip(rows, records)]
+                )
+            rows = np.asarray(rows)
+            self._matrix[rows] = values
+            if self._centroids is not None:
+                self._assignments[rows] = np.argmax(values @ self._centroids.T, axis=1)
+            self._dirty = True
+            self._maybe_save()
+        return {"upserted_count": len(records)}
+
+    def delete(self, ids=None, namespace=None, filter=None, delete_all=False, **kwargs):
+        namespace = namespace or ""
+        with self._lock:
+            if delete_all:
+                targets = [key for key in self._rows if key[0] == namespace]
+            elif filter:
+                code = self._ns_codes.get(namespace)
+                live = np.flatnonzero(self._row_ns == code) if code is not None else np.empty(0, dtype=np.int64)
+                targets = [(namespace, self._ids[row]) for row in self._filter_rows(live, filter).tolist()]
+            else:
+                targets = [(namespace, vector_id) for vector_id in ids or []]
+            deleted = []
+            for key in targets:
+                row = self._rows.pop(key, None)
+                if row is None:
+                    continue
+                self._clear_row(row)
+                deleted.append(row)
+            with self._db:
+                self._db.executemany("DELETE FROM rows WHERE row = ?", [(row,) for row in deleted])
+            self._dirty = True
+            self._maybe_save()
+        return {}
+
+    def _build_ann(self, live_rows):
+        """k-means over a sample of the live rows, sqrt(n) clusters"""
+        rng = np.random.default_rng(0)
+        n_clusters = max(1, int(np.sqrt(len(live_rows))))
+        sample = self._matrix[rng.choice(live_rows, size=min(len(live_rows), n_clusters * 40), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_clusters, replace=False)].copy()
+        for _ in range(10):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(n_clusters):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1)
+        assignments = np.full(self.capacity, -1, dtype=np.int32)
+        for start in range(0, len(live_rows), 65536):
+            block = live_rows[start:start + 65536]
+            assignments[block] = np.argmax(self._matrix[block] @ centroids.T, axis=1)
+        self._centroids = centroids
+        self._assignments = assignments
+        self._built_for = len(live_rows)
+
+    def _candidate_rows(self, vector, namespace, filter):
+        code = self._ns_codes.get(namespace)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        live = np.flatnonzero(self._row_ns == code)
+        if filter:
+            live = self._filter_rows(live, filter)
+        if not self.ann or len(live) < self.ann_threshold:
+            return live
+        if self._centroids is None or self.count > 2 * self._built_for:
+            self._build_ann(np.flatnonzero(self._row_ns >= 0))
+        probes = np.argsort(-(self._centroids @ vector))[:self.nprobe]
+        return live[np.isin(self._assignments[live], probes)]
+
+    def _filter_rows(self, rows, filter):
+        """
+        the rows matching the filter: conditions on the coded fields are compared as codes over all
+        the rows at once, only the rest of the filter ($and, $or, other fields) is checked row by row
+        """
+        rest = {}
+        for key, condition in filter.items():
+            column = self._columns.get(key)
+            if column is None:
+                rest[key] = condition
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, expected in condition.items():
+                values = expected if op in ("$in", "$nin") else [expected]
+                codes = [self._value_codes[key].get(value, UNKNOWN) if _hashable(value) else None for value in values]
+                if op not in ("$eq", "$ne", "$in", "$nin") or None in codes:
+                    rest.setdefault(key, {})[op] = expected
+                    continue
+                hit = np.isin(column[rows], codes)
+                rows = rows[hit if op in ("$eq", "$in") else ~hit]
+        # rows with a value that can't be coded have to be checked for the coded fields too
+        uncoded = [key for key, column in self._columns.items() if key in filter and len(rows) and (column[rows] == UNKNOWN).any()]
+        if uncoded:
+            rest = filter
+        if rest and len(rows):
+            rows = rows[np.fromiter((matches_filter(self._metadata[row], rest) for row in rows), dtype=bool, count=len(rows))]
+        return rows
+
+    def query(self, vector, top_k=4, namespace=None, filter=None, include_metadata=True, **kwargs):
+        """cosine top-k, in the same shape as a pinecone query response"""
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        with self._lock:
+            rows = self._candidate_rows(query, namespace or "", filter)
+            if len(rows) == 0:
+                return {"matches": []}
+            if len(rows) * 4 > self.capacity:
+                # scoring the whole matrix in place is cheaper than gathering most of its rows first
+                scores = (self._matrix @ query)[rows]
+            else:
+                scores = self._matrix[rows] @ query
+            k = min(top_k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return {"matches": [
+                {
+                    "id": self._ids[rows[i]],
+                    "score": float(scores[i]),
+                    "metadata": dict(self._metadata[rows[i]]) if include_metadata else {},
+                }
+                for i in best
+            ]}
+
+    def describe_index_stats(self):
+        with self._lock:
+            namespaces = {}
+            for ns, _ in self._rows:
+                namespaces[ns] = namespaces.get(ns, 0) + 1
+            return {
+                "dimension": self.dim,
+                "total_vector_count": self.count,
+                "namespaces": {ns: {"vector_count": n} for ns, n in namespaces.items()},
+            }
+
+    def _maybe_save(self):
+        if self._dirty and time.monotonic() - self._last_save > SAVE_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """writes the changed rows of the matrix to disk, the metadata is already in sqlite"""
+        with self._lock:
+            if not self._dirty or self._matrix is None:
+                return
+            self._matrix.flush()
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+
+class LocalVectorStore(VectorStore):
+    """langchain vector store over a NumpyIndex, works like PineconeVectorStore does over a pinecone index"""
+
+    def __init__(self, index, embedding, text_key="text", namespace=None):
+        self._index = index
+        self._embedding = embedding
+        self._text_key = text_key
+        self._namespace = namespace
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def add_texts(self, texts, metadatas=None, ids=None, namespace=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(self._index.count, self._index.count + len(texts))]
+        vectors = self._embedding.embed_documents(texts)
+        records = [(i, v, {**m, self._text_key: t}) for i, v, m, t in zip(ids, vectors, metadatas, texts)]
+        self._index.upsert(vectors=records, namespace=namespace or self._namespace)
+        return ids
+
+    def delete(self, ids=None, namespace=None, **kwargs):
+        self._index.delete(ids=ids, namespace=namespace or self._namespace, **kwargs)
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, namespace=None):
+        results = self._index.query(vector=embedding, top_k=k, namespace=namespace or self._namespace, filter=filter)
+        documents = []
+        for match in results["matches"]:
+            metadata = match["metadata"]
+            text = metadata.pop(self._text_key, None)
+            if text is not None:
+                documents.append((Document(id=match["id"], page_content=text, metadata=metadata), match["score"]))
+        return documents
+
+    def similarity_search_with_score(self, query, k=4, filter=None, namespace=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k=k, filter=filter, namespace=namespace)
+
+    def similarity_search(self, query, k=4, filter=None, namespace=None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k=k, filter=filter, namespace=namespace)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=None, **kwargs):
+        store = cls(NumpyIndex(path or os.path.join(CACHE_DIR, "local_index"), **kwargs), embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
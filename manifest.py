@@ -0,0 +1,166 @@
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # windows, the caches are not shared between processes there
+    fcntl = None
+
+# everything the app keeps on the local disk lives under this folder
+CACHE_DIR = os.getenv("VERI_CACHE_DIR", ".veri_cache")
+# the manifest is written at most this often (and at exit), a big folder sync records thousands of documents
+SAVE_INTERVAL = 5.0
+
+
+def content_hash(data):
+    """
+    sha256 of the given bytes or text, used as the key for documents, chunks and vector ids
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_json(path, data):
+    """
+    Writes the JSON to a temp file of its own and moves it over path, so a reader never sees half a
+    file and two processes (the app and service.py on the same cache dir) never share a temp file
+    """
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def owner_lock(path):
+    """
+    Takes the exclusive lock file at path for the life of the process and returns it, None when
+    another process holds it. Files that are changed in place (memmaps) have a single writer this way.
+    """
+    f = open(path, "a")
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def scoped(scope, key):
+    """key of a document, source or chunk inside a scope (a namespace of the index), "" is the shared one"""
+    return f"{scope}/{key}" if scope else key
+
+
+class IngestManifest:
+    """
+    Local record of what is already in the vector store, so ingestion can skip documents
+    and chunks it has seen before without asking the remote index. Everything is recorded
+    per scope, the same PDF uploaded in two sessions is indexed once in each namespace.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "manifest.json")
+        self._lock = threading.Lock()
+        self.documents = {}
+        self.chunks = set()
+        self.sources = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # a broken manifest only means we re-index, the ids are deterministic so nothing duplicates
+            return
+        self.documents = data.get("documents", {})
+        self.chunks = set(data.get("chunks", []))
+        self.sources = {doc["source"]: doc_hash for doc_hash, doc in self.documents.items() if doc.get("source")}
+
+    def flush(self):
+        """writes the manifest to disk if anything changed since the last write"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        self._dirty = False
+        self._last_save = time.monotonic()
+        write_json(self.path, {"documents": self.documents, "chunks": sorted(self.chunks)})
+
+    def has_document(self, doc_hash, scope=""):
+        with self._lock:
+            return scoped(scope, doc_hash) in self.documents
+
+    def has_source(self, source, scope=""):
+        """true if a document was already indexed from this url / file name"""
+        with self._lock:
+            return scoped(scope, source) in self.sources
+
+    def new_chunks(self, chunk_ids, scope=""):
+        """returns the positions of the chunk ids that are not indexed yet"""
+        with self._lock:
+            seen = set()
+            positions = []
+            for i, chunk_id in enumerate(chunk_ids):
+                if scoped(scope, chunk_id) in self.chunks or chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                positions.append(i)
+            return positions
+
+    def record(self, doc_hash, source, chunk_ids, scope=""):
+        """marks a document and its chunks as indexed and writes the manifest to disk"""
+        with self._lock:
+            self.documents[scoped(scope, doc_hash)] = {
+                "source": scoped(scope, source) if source else None,
+                "chunks": list(chunk_ids),
+                "indexed_at": time.time(),
+            }
+            self.chunks.update(scoped(scope, chunk_id) for chunk_id in chunk_ids)
+            if source:
+                self.sources[scoped(scope, source)] = scoped(scope, doc_hash)
+            self._dirty = True
+            # losing the last records in a crash only means re-indexing them, the ids are deterministic
+            if time.monotonic() - self._last_save > SAVE_INTERVAL:
+                self._save()
+
+    def forget(self, doc_hash, scope=""):
+        """
+        removes a document and returns the ids of its chunks that no other document of the scope has,
+        those are the vectors to delete
+        """
+        with self._lock:
+            document = self.documents.pop(scoped(scope, doc_hash), None)
+            if document is None:
+                return []
+            if document.get("source") and self.sources.get(document["source"]) == scoped(scope, doc_hash):
+                del self.sources[document["source"]]
+            prefix = scoped(scope, "")
+            shared = set()
+            for key, other in self.documents.items():
+                if key.startswith(prefix) and (scope or "/" not in key):
+                    shared.update(other["chunks"])
+            orphans = [chunk_id for chunk_id in document["chunks"] if chunk_id not in shared]
+            self.chunks.difference_update(scoped(scope, chunk_id) for chunk_id in orphans)
+            self._dirty = True
+            return orphans
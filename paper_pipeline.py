@@ -0,0 +1,80 @@
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from telemetry import record, record_error, run_timed
+from utils import download_pdf, get_session, parse_pdf_bytes
+
+# downloads in flight at once, bounded so one search can't take every pooled connection
+MAX_DOWNLOADS = 8
+# parser processes, fitz holds the GIL so parsing in threads would not run in parallel
+MAX_PARSERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """
+    process pool shared by every ingestion so the workers are started only once. The workers are
+    spawned, forking the app would copy its threads' locks (streamlit, aiohttp, sqlite) in whatever
+    state they are in at that moment
+    """
+    global _parse_pool
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                _parse_pool = ProcessPoolExecutor(max_workers=MAX_PARSERS, mp_context=multiprocessing.get_context("spawn"))
+    return _parse_pool
+
+
+def fetch_papers(papers, source, on_text, chunk_budget=None, max_downloads=MAX_DOWNLOADS, parse_pool=None, parse=parse_pdf_bytes):
+    """
+    Downloads the papers in parallel, parses them in the process pool with `parse` (a module level
+    function of the PDF's path in the PDF cache) and calls on_text(paper, parsed) as soon as each one is ready. on_text returns the number of chunks
+    it added, once chunk_budget is reached the downloads that have not started are cancelled.
+    Returns the papers that were handed to on_text.
+    """
+    if not papers:
+        return []
+    session = get_session()
+    parse_pool = parse_pool or get_parse_pool()
+    done_papers = []
+    chunks = 0
+    download_pool = ThreadPoolExecutor(max_workers=max_downloads)
+    try:
+        # the downloads run in the context of the caller so their spans are children of its span
+        pending = {
+            download_pool.submit(contextvars.copy_context().run, download_pdf, paper['link'], source, session): ('download', paper)
+            for paper in papers
+        }
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, paper = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # one broken link should not stop the other papers
+                    record_error(f"pdf_{stage}", e, source=paper['link'])
+                    continue
+                if result is None:
+                    continue
+                if stage == 'download':
+                    pending[parse_pool.submit(run_timed, parse, result)] = ('parse', paper)
+                    continue
+                # the parse time comes back from the worker process, the queue wait is left out
+                result, seconds = result
+                record("pdf_parse", seconds, source=paper['link'])
+                chunks += on_text(paper, result) or 0
+                done_papers.append(paper)
+                if chunk_budget is not None and chunks >= chunk_budget:
+                    for other in pending:
+                        other.cancel()
+                    return done_papers
+        return done_papers
+    finally:
+        # downloads still running when the budget is hit finish in the background and are dropped
+        download_pool.shutdown(wait=False, cancel_futures=True)
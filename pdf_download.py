@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from manifest import CACHE_DIR, write_json
+
+# largest PDF downloaded, bigger ones are rejected from their Content-Length or while streaming
+MAX_PDF_MB = float(os.getenv("VERI_MAX_PDF_MB", "50"))
+# a cached PDF checked less than this long ago is used without asking the server again, older ones
+# are revalidated with ETag / Last-Modified and only downloaded again when they changed
+PDF_FRESH_SECONDS = float(os.getenv("VERI_PDF_CACHE_FRESH", "86400"))
+# the least recently used PDFs are removed once the cache is larger than this
+PDF_CACHE_MB = float(os.getenv("VERI_PDF_CACHE_MB", "2048"))
+# read from the socket and written to disk at a time, the most of a download held in memory
+DOWNLOAD_CHUNK = 64 * 1024
+# PDF readers (mupdf too) accept some junk before the %PDF- header, it has to be in these first bytes
+HEADER_WINDOW = 1024
+
+
+class RejectedDownload(ValueError):
+    """the response is not a PDF or is too large, found from its headers or its first bytes"""
+
+
+class PDFCache:
+    """
+    Downloaded PDFs on disk, one file per URL next to a JSON file with its ETag and Last-Modified.
+    A download is streamed to a temp file in the cache folder and moved in place once complete, so
+    a PDF is never held in memory as a whole and the parser opens it by path. Two sessions asking
+    for the same URL download it once.
+    """
+
+    def __init__(self, path=None, max_bytes=None, fresh_seconds=PDF_FRESH_SECONDS, max_cache_bytes=None):
+        self.path = path or os.path.join(CACHE_DIR, "pdfs")
+        self.max_bytes = max_bytes or int(MAX_PDF_MB * 1024 * 1024)
+        self.fresh_seconds = fresh_seconds
+        self.max_cache_bytes = max_cache_bytes or int(PDF_CACHE_MB * 1024 * 1024)
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _files(self, url):
+        base = os.path.join(self.path, hashlib.sha256(url.encode("utf-8")).hexdigest())
+        return base + ".pdf", base + ".json"
+
+    def _read_meta(self, pdf_path, meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # the meta is written after the PDF, without the PDF it describes nothing
+        return meta if os.path.exists(pdf_path) else None
+
+    def get(self, url, session, timeout=None, require_pdf_type=False):
+        """
+        Returns (path of the PDF on disk, bytes downloaded). The bytes are 0 when the cached copy
+        was used, as it is or after the server answered 304. Raises RejectedDownload when the response
+        is not a PDF (or, with require_pdf_type, has another Content-Type) or is larger than max_bytes.
+        """
+        with self._lock:
+            lock = self._locks.setdefault(url, threading.Lock())
+        with lock:
+            pdf_path, meta_path = self._files(url)
+            meta = self._read_meta(pdf_path, meta_path)
+            headers = {}
+            if meta is not None:
+                if time.time() - meta.get("checked", 0) < self.fresh_seconds:
+                    self.hits += 1
+                    self._touch(pdf_path)
+                    return pdf_path, 0
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+            with session.get(url, timeout=timeout, headers=headers, stream=True) as response:
+                if response.status_code == 304 and meta is not None:
+                    self.revalidated += 1
+                    meta["checked"] = time.time()
+                    write_json(meta_path, meta)
+                    self._touch(pdf_path)
+                    return pdf_path, 0
+                response.raise_for_status()
+                self._check_headers(url, response, require_pdf_type)
+                os.makedirs(self.path, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        received = self._stream(url, response, f)
+                    os.replace(tmp_path, pdf_path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+                write_json(meta_path, {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "size": received,
+                    "checked": time.time(),
+                })
+            self.misses += 1
+        self._prune(keep=pdf_path)
+        return pdf_path, received
+
+    def _check_headers(self, url, response, require_pdf_type):
+        content_type = response.headers.get("Content-Type", "").lower()
+        if require_pdf_type and "application/pdf" not in content_type:
+            raise RejectedDownload(f"{url} is {content_type or 'of no type'}, not a PDF")
+        # an error or login page answered with 200
+        if content_type.startswith(("text/", "image/")):
+            raise RejectedDownload(f"{url} is {content_type}, not a PDF")
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > self.max_bytes:
+            raise RejectedDownload(f"{url} is {int(length) / (1024 * 1024):.1f}MB, more than the {self.max_bytes / (1024 * 1024):.0f}MB limit")
+
+    def _stream(self, url, response, f):
+        """writes the body to f a chunk at a time, checking the PDF header and the size as it goes"""
+        received = 0
+        head = b""
+        for block in response.iter_content(DOWNLOAD_CHUNK):
+            if head is not None:
+                head += block
+                if b"%PDF-" in head[:HEADER_WINDOW]:
+                    head = None
+                elif len(head) >= HEADER_WINDOW:
+                    raise RejectedDownload(f"{url} does not start like a PDF")
+            received += len(block)
+            if received > self.max_bytes:
+                raise RejectedDownload(f"{url} is more than the {self.max_bytes / (1024 * 1024):.0f}MB limit")
+            f.write(block)
+        if head is not None:
+            raise RejectedDownload(f"{url} does not start like a PDF")
+        return received
+
+    @staticmethod
+    def _touch(pdf_path):
+        # the modification time is the last use, the oldest ones are pruned first
+        try:
+            os.utime(pdf_path)
+        except OSError:
+            pass
+
+    def _prune(self, keep=None):
+        try:
+            entries = [entry for entry in os.scandir(self.path) if entry.name.endswith(".pdf")]
+        except OSError:
+            return
+        files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries))
+        total = sum(size for _, size, _ in files)
+        for _, size, pdf_path in files:
+            if total <= self.max_cache_bytes:
+                break
+            if pdf_path == keep:
+                continue
+            for path in (pdf_path, pdf_path[:-len(".pdf")] + ".json"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+_pdf_cache = None
+_pdf_cache_lock = threading.Lock()
+
+
+def get_pdf_cache():
+    """PDF cache shared by every download"""
+    global _pdf_cache
+    if _pdf_cache is None:
+        with _pdf_cache_lock:
+            if _pdf_cache is None:
+                _pdf_cache = PDFCache()
+    return _pdf_cache
@@ -0,0 +1,48 @@
+import os
+
+
+def open_pdf(source):
+    """
+    Opens a PDF with PyMuPDF from a path, raw bytes or a file like object (streamlit upload, BytesIO).
+    Paths are read by mupdf directly and bytes are handed over as they are, so nothing is copied
+    on the python side except for memoryviews and plain file objects which have to be read.
+    """
+    # imported here so starting the app does not pay for mupdf until a PDF is actually opened
+    import fitz
+
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(os.fspath(source))
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    if isinstance(source, (bytearray, memoryview)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    if hasattr(source, "getvalue"):
+        # BytesIO.getvalue() shares the buffer of an untouched upload instead of copying it
+        return fitz.open(stream=source.getvalue(), filetype="pdf")
+    if hasattr(source, "read"):
+        return fitz.open(stream=source.read(), filetype="pdf")
+    raise TypeError(f"can't open a PDF from {type(source).__name__}")
+
+
+def iter_pdf_pages(source):
+    """
+    Yields the text of the PDF one page at a time so callers can start working before the last
+    page is parsed and never hold more than one page of text they don't need.
+    """
+    doc = open_pdf(source)
+    try:
+        for page in doc:
+            yield page.get_text("text")
+    finally:
+        doc.close()
+
+
+def extract_pdf_text(source):
+    """Full text of the PDF, joined once at the end instead of growing a string page by page"""
+    return "".join(iter_pdf_pages(source))
+
+
+def extract_pdf_pages(source):
+    """Text of every page of the PDF as a list"""
+    return list(iter_pdf_pages(source))
+
@@ -0,0 +1,91 @@
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.documents.compressor import BaseDocumentCompressor
+
+from telemetry import count, span
+
+# candidates kept after the local scoring, at most this many are sent to the remote reranker
+DEFAULT_TOP_K = 12
+# two candidates at least this similar are the same passage (overlapping chunks, the same paper from two sources)
+DEFAULT_DUPLICATE_THRESHOLD = 0.95
+# rough total of document tokens sent to the reranker per query
+DEFAULT_TOKEN_BUDGET = 4000
+
+
+def estimate_tokens(text):
+    """cheap token count, about 4 characters per token for english text"""
+    return len(text) // 4 + 1
+
+
+def prerank(query_vector, documents, vectors, top_k=DEFAULT_TOP_K, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD,
+            token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Orders the documents by cosine similarity to the query, drops the ones that are near duplicates
+    of a better one and keeps the best until top_k documents or token_budget tokens.
+    Returns the kept documents and the candidate counts after every step.
+    """
+    counts = {"candidates": len(documents)}
+    if not documents:
+        return [], dict(counts, unique=0, kept=0, tokens=0)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    query = np.asarray(query_vector, dtype=np.float32)
+    query /= np.linalg.norm(query) + 1e-12
+    order = np.argsort(-(matrix @ query), kind="stable")
+    # similarity of every pair at once, a candidate is dropped when it is too close to one already kept
+    pairs = matrix[order] @ matrix[order].T
+    unique = []
+    for i in range(len(order)):
+        if not unique or pairs[i, unique].max() < duplicate_threshold:
+            unique.append(i)
+    counts["unique"] = len(unique)
+    kept, tokens = [], 0
+    for i in unique[:top_k]:
+        document = documents[order[i]]
+        size = estimate_tokens(document.page_content)
+        # the best candidate always goes through, even if it alone is over the budget
+        if kept and tokens + size > token_budget:
+            break
+        kept.append(document)
+        tokens += size
+    counts["kept"] = len(kept)
+    counts["tokens"] = tokens
+    return kept, counts
+
+
+class PreRankingReranker(BaseDocumentCompressor):
+    """
+    Local pre-ranking in front of a remote reranker: the candidates are scored against the query
+    with their embeddings (cache hits, every chunk was embedded at ingestion), near duplicates are
+    collapsed and only what fits top_k and the token budget is sent to the reranker, whose latency
+    and cost grow with the number and length of the documents. The counts and timings of the
+    stages go into `stats` when it is given.
+    """
+
+    embeddings: Any
+    reranker: Any
+    top_k: int = DEFAULT_TOP_K
+    duplicate_threshold: float = DEFAULT_DUPLICATE_THRESHOLD
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+    # filled in place, Any so pydantic keeps the caller's dict instead of a copy
+    stats: Any = None
+
+    def compress_documents(self, documents, query, callbacks=None):
+        documents = list(documents)
+        start = time.perf_counter()
+        with span("prerank") as prerank_span:
+            query_vector = self.embeddings.embed_query(query)
+            vectors = self.embeddings.embed_documents([document.page_content for document in documents]) if documents else []
+            kept, counts = prerank(query_vector, documents, vectors, self.top_k, self.duplicate_threshold, self.token_budget)
+            prerank_span.set(**counts)
+        prerank_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with span("rerank", documents=len(kept), tokens=counts["tokens"]):
+            reranked = self.reranker.compress_documents(kept, query, callbacks=callbacks) if kept else []
+        count("tokens", counts["tokens"], stage="rerank")
+        if self.stats is not None:
+            self.stats.update(counts, prerank=prerank_seconds, rerank=time.perf_counter() - start, reranked=len(reranked))
+        return reranked
+
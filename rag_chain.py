@@ -1,126 +1,681 @@
 import os
 from dotenv import load_dotenv
-from langchain_cohere import CohereEmbeddings,ChatCohere
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain.prompts import PromptTemplate
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain_cohere import CohereRerank
-from langchain_pinecone.vectorstores import PineconeVectorStore
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_core.documents import Document
-from pinecone import Pinecone
-from langchain_community.document_loaders import YoutubeLoader
-from langchain_community.document_loaders import TextLoader
-from utils import pdf_to_text,get_papers_from_query,get_pdf_to_text,get_template,check_index,extract_pdf_links
-from langchain.globals import set_verbose
+from manifest import CACHE_DIR,IngestManifest,content_hash
+from ingest_queue import IngestionQueue,PARSING,EMBEDDING
+from paper_pipeline import fetch_papers,get_parse_pool
+from pdf_extract import iter_pdf_pages
+from chunker import OffsetSplitter,parse_pdf_chunks,split_document
+from telemetry import count,record_error,span,start_span,timed_iter
+from utils import get_papers_from_query,get_template,extract_pdf_links
+import contextlib
+import functools
+import threading
 import time
-set_verbose(True) 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from youtube import TranscriptCache,fetch_transcript,split_transcript,video_id,video_url
+# langchain, cohere, pinecone and the document loaders are imported where they are first used,
+# importing this module (and starting the streamlit app) stays cheap until the engine is built
+
+# modes that get a prebuilt chain when the engine starts, other options are built on first use
+MODES = ["default", "PDF RAG", "Research Papers", "YouTube Videos"]
+# a research paper search stops downloading once this many new chunks are indexed
+MAX_PAPER_CHUNKS = 100
+# the source_type a mode retrieves from, the other options search everything of the session
+# the synced folder holds the user's own documents, they are searched with the uploaded PDFs
+MODE_SOURCE_TYPES = {"PDF RAG": ("pdf","folder"), "Research Papers": ("paper",), "YouTube Videos": ("youtube",)}
+
+def chunk_metadata(source_type,source,session_id,chunk_index,extra=None):
+    """metadata stored with every chunk, pinecone does not take null values so missing ones are left out"""
+    metadata = {"source_type": source_type, "source": source, "session_id": session_id, "chunk_index": chunk_index, **(extra or {})}
+    return {key: value for key, value in metadata.items() if value is not None}
+
+def with_pages(chunks):
+    """(chunk, page) pairs to the (chunk, metadata) pairs index_chunks takes"""
+    return ((chunk,{"page": page}) for chunk,page in chunks)
+
+def _no_progress(status=None,progress=None,message=None):
+    pass
+
+_no_limit = contextlib.nullcontext()
+
+class AnswerStream:
+    """
+    Iterator over the answer tokens of one query. Retrieval runs when the iteration starts, then the
+    tokens are yielded as the llm produces them. Once it is exhausted `answer`, `context` and
+    `timings` (retrieve, first_token and total, in seconds from the start) are filled in, and `stages`
+    has the timings and candidate counts of the retrieval stages when the retriever reports them.
+    With an answer cache a near duplicate query is answered from it in one piece, without retrieval.
+    `async for` works too, see __aiter__.
+    """
+    def __init__(self,retriever,answer_chain,query,on_done=None,answer_cache=None,cache_key=None,stages=None,limits=None):
+        self.retriever = retriever
+        self.answer_chain = answer_chain
+        self.query = query
+        self.on_done = on_done
+        self.answer_cache = answer_cache
+        self.cache_key = cache_key
+        self.answer = None
+        self.context = []
+        self.timings = {}
+        self.stages = stages if stages is not None else {}
+        self.limits = limits or {}
+        self.cached = False
+
+    def _finish(self,start):
+        self.timings["total"] = time.perf_counter() - start
+        if self.answer_cache is not None:
+            self.answer_cache.record_latency(self.cached,self.timings["total"])
+        if self.on_done:
+            self.on_done(dict(self.timings,cached=self.cached,stages=dict(self.stages)))
+
+    def _answered(self,tokens,vector,generate,start):
+        self.answer = "".join(tokens)
+        # estimates, the chat model does not report its usage through the stream
+        prompt_tokens = self.stages.get("prompt_tokens_after",0) + len(self.query)//4 + 1
+        completion_tokens = len(self.answer)//4 + 1
+        generate.set(prompt_tokens=prompt_tokens,completion_tokens=completion_tokens)
+        count("tokens",prompt_tokens,stage="prompt")
+        count("tokens",completion_tokens,stage="completion")
+        generate.end()
+        if self.answer_cache is not None:
+            self.answer_cache.store(vector,self.cache_key,self.answer)
+        self._finish(start)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        # the spans stay open across the yields, they are ended in finally when the reader stops early
+        query_span = start_span("query",mode=self.cache_key[0] if self.cache_key else None)
+        generate = None
+        try:
+            vector = None
+            if self.answer_cache is not None:
+                cached,vector = self.answer_cache.lookup(self.query,self.cache_key)
+                if cached is not None:
+                    self.cached = True
+                    query_span.set(cached=True)
+                    self.answer = cached
+                    self.timings["first_token"] = time.perf_counter() - start
+                    yield cached
+                    self._finish(start)
+                    return
+            with span("retrieve") as retrieve:
+                self.context = self.retriever.invoke(self.query)
+                retrieve.set(documents=len(self.context))
+            self.timings["retrieve"] = time.perf_counter() - start
+            generate = start_span("generate")
+            tokens = []
+            for token in self.answer_chain.stream({"input": self.query, "context": self.context}):
+                if not tokens:
+                    self.timings["first_token"] = time.perf_counter() - start
+                    generate.set(first_token=time.perf_counter() - generate._start)
+                tokens.append(token)
+                yield token
+            self._answered(tokens,vector,generate,start)
+        finally:
+            if generate is not None:
+                generate.end()
+            query_span.end()
+
+    async def __aiter__(self):
+        """
+        Same as iterating, for an event loop: the llm is streamed through its async client, the cache
+        lookup and the retrieval (sync clients) run in worker threads. `limits` maps "retrieve" and
+        "generate" to semaphores bounding how many queries are in that stage at once.
+        """
+        import asyncio
+        start = time.perf_counter()
+        query_span = start_span("query",mode=self.cache_key[0] if self.cache_key else None)
+        generate = None
+        try:
+            vector = None
+            if self.answer_cache is not None:
+                cached,vector = await asyncio.to_thread(self.answer_cache.lookup,self.query,self.cache_key)
+                if cached is not None:
+                    self.cached = True
+                    query_span.set(cached=True)
+                    self.answer = cached
+                    self.timings["first_token"] = time.perf_counter() - start
+                    yield cached
+                    self._finish(start)
+                    return
+            async with self.limits.get("retrieve",_no_limit):
+                with span("retrieve") as retrieve:
+                    self.context = await self.retriever.ainvoke(self.query)
+                    retrieve.set(documents=len(self.context))
+            self.timings["retrieve"] = time.perf_counter() - start
+            async with self.limits.get("generate",_no_limit):
+                generate = start_span("generate")
+                tokens = []
+                async for token in self.answer_chain.astream({"input": self.query, "context": self.context}):
+                    if not tokens:
+                        self.timings["first_token"] = time.perf_counter() - start
+                        generate.set(first_token=time.perf_counter() - generate._start)
+                    tokens.append(token)
+                    yield token
+            self._answered(tokens,vector,generate,start)
+        finally:
+            if generate is not None:
+                generate.end()
+            query_span.end()
 
 class RAG_Chain:
-    def __init__(self,option="default"):
+    def __init__(self,option="default",llm=None,transcript_loader=None,embeddings=None,reranker=None,index=None,index_id=None):
+        """
+        llm, embeddings, reranker (a document compressor) and index (anything with the calls of a
+        pinecone Index) replace the cohere and pinecone clients when they are given, so the whole
+        engine runs offline on local fakes (see benchmarks/fakes.py). index_id names a given index,
+        what was indexed into it is remembered under that name
+        """
+        from langchain.globals import set_verbose
+        from langchain_cohere import CohereEmbeddings,ChatCohere,CohereRerank
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        from langchain.retrievers import ContextualCompressionRetriever
+        from embedding_cache import CachedEmbeddings,embeddings_name
+        from vector_writer import BatchedVectorWriter
+        from vector_store import build_vector_store,index_identity,vector_count
+        from answer_cache import AnswerCache
+        from lexical_index import LexicalIndex
+        from context_packing import context_budgets
+        from folder_sync import FolderState
+        # langchain's own debug output, the stage timings are in telemetry (VERI_TELEMETRY_LOG / VERI_METRICS_PORT)
+        set_verbose(os.getenv("VERI_VERBOSE", "false").lower() == "true")
+
         # Load environment variables
         load_dotenv()
-        self.pinecone_api_key = os.getenv("PINECONE_API_KEY")
-        os.environ['COHERE_API_KEY']  = os.getenv("COHERE_API_KEY")
-        self.index_name = os.getenv("PINECONE_INDEX_NAME")
+        if os.getenv("COHERE_API_KEY"):
+            os.environ['COHERE_API_KEY']  = os.getenv("COHERE_API_KEY")
+        # pinecone by default, "local" keeps the vectors in a NumPy index on this machine
+        # a given index keeps its manifest and lexical index apart from the configured backend's
+        self.backend = "custom" if index is not None else os.getenv("VERI_VECTOR_BACKEND", "pinecone")
         
         # Initialize embeddings and vector store
-        self.embeddings = CohereEmbeddings(model="embed-english-v3.0")
-        pc = Pinecone(api_key=self.pinecone_api_key)
-        # checking if the index exists or not
-        Indexs=check_index(pc)
-        if self.index_name not in Indexs:
-            pc.create_index(name=self.index_name,dimension=1024)
+        # every text is embedded remotely only once, documents and queries are served from the disk cache after that
+        embeddings = embeddings or CohereEmbeddings(model="embed-english-v3.0")
+        self.embeddings = CachedEmbeddings(
+            embeddings,
+            # vectors of another model, or of the same one at another size, never come out of the cache
+            model_name=embeddings_name(embeddings),
+            max_entries=int(os.getenv("VERI_EMBED_CACHE_SIZE", "100000"))
+        )
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        self.index = pc.Index(self.index_name)
-        self.vectorstore = PineconeVectorStore(index = self.index, pinecone_api_key = self.pinecone_api_key,embedding = self.embeddings)
+        # same chunks as the text splitter, as offsets, documents are split with it
+        self.chunker = OffsetSplitter.like(self.text_splitter)
+        if index is not None:
+            from local_index import LocalVectorStore
+            self.index,self.vectorstore = index,LocalVectorStore(index,self.embeddings)
+        else:
+            self.index,self.vectorstore = build_vector_store(self.embeddings,self.backend,dim=1024)
+        # ingestion writes go through the batched writer, the vector store is used for retrieval
+        self.writer = BatchedVectorWriter(
+            self.embeddings,
+            self.index,
+            text_key=self.vectorstore._text_key,
+            batch_size=int(os.getenv("VERI_UPSERT_BATCH_SIZE", "96")),
+            max_in_flight=int(os.getenv("VERI_UPSERT_IN_FLIGHT", "4")),
+            # batches started per second at most, for a pinecone plan's write limit (0 is no limit)
+            max_batches_per_second=float(os.getenv("VERI_UPSERT_RATE", "0")) or None
+        )
 
-        self.update_vectorstore_with_files()
+        # namespace -> version, bumped on every write, cached answers are only reused for the same version
+        self.index_versions = {}
+        self._version_lock = threading.Lock()
+        self.answer_cache = AnswerCache(
+            self.embeddings,
+            threshold=float(os.getenv("VERI_ANSWER_CACHE_THRESHOLD", "0.95")),
+            ttl=float(os.getenv("VERI_ANSWER_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("VERI_ANSWER_CACHE_SIZE", "2000"))
+        )
+
+        # what is recorded about the indexed documents is kept per index (pinecone index name, local index
+        # folder or index_id), switching to another index does not skip documents that are not in it
+        self.index_id = index_id or (self.backend if index is not None else index_identity(self.backend))
+        state = f"{self.backend}-{content_hash(self.index_id)[:12]}"
+        manifest_path = os.path.join(CACHE_DIR,f"manifest-{state}.json")
+        lexical_path = os.path.join(CACHE_DIR,f"lexical-{state}.sqlite")
+        folder_state_path = os.path.join(CACHE_DIR,f"folder-{state}.json")
+        try:
+            empty = vector_count(self.index) == 0
+        except Exception as e:
+            # the state files are kept when the index can't be asked, the first query will show the error
+            record_error("index_stats",e)
+            empty = False
+        if empty:
+            # the index was emptied or created again, everything recorded about it is stale
+            for path in (manifest_path,lexical_path,lexical_path+"-wal",lexical_path+"-shm",folder_state_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        # local record of the documents and chunks already upserted, ingestion skips anything in it
+        self.manifest = IngestManifest(manifest_path)
+        # BM25 index kept next to the vector store, exact terms the embeddings miss are found through it
+        self.lexical = LexicalIndex(lexical_path)
+        self.retrieve_k = int(os.getenv("VERI_RETRIEVE_K", "20"))
+        self.fused_k = int(os.getenv("VERI_FUSED_K", "10"))
+        # local pre-ranking before the remote rerank, VERI_PRERANK=false sends every fused candidate to cohere
+        self.prerank = os.getenv("VERI_PRERANK", "true").lower() == "true"
+        self.prerank_top_k = int(os.getenv("VERI_PRERANK_TOP_K", "8"))
+        self.duplicate_threshold = float(os.getenv("VERI_PRERANK_DUPLICATE_THRESHOLD", "0.95"))
+        self.rerank_token_budget = int(os.getenv("VERI_RERANK_TOKEN_BUDGET", "3000"))
+        # tokens of context that go into the prompt per mode, e.g. VERI_CONTEXT_BUDGETS="PDF RAG=4000,2000"
+        self.context_budgets = context_budgets(os.getenv("VERI_CONTEXT_BUDGETS"))
+        # a local folder synced into the shared namespace, only new, changed and removed files are touched
+        self.folder_path = os.getenv("VERI_FOLDER_PATH") or None
+        self.folder_extensions = tuple(os.getenv("VERI_FOLDER_EXTENSIONS", ".pdf,.txt,.md").lower().split(","))
+        self.folder_state = FolderState(folder_state_path)
+        self._folder_job = None
+        self._folder_lock = threading.Lock()
+        # transcripts on disk, transcript_loader replaces the youtube download (e.g. with a local fake)
+        self.transcripts = TranscriptCache(os.path.join(CACHE_DIR,"transcripts"),loader=transcript_loader or fetch_transcript)
+        self._transcript_pool = ThreadPoolExecutor(max_workers=int(os.getenv("VERI_TRANSCRIPT_WORKERS", "4")),thread_name_prefix="transcript")
         # Initialize LLM and components for RAG chain 
-        # model is chosen cause of high context 
-        self.llm = ChatCohere(model='command-r')
-        self.reranker = CohereRerank(model='rerank-english-v3.0')
+        # model is chosen cause of high context, any langchain chat model can be passed in instead (e.g. a fake one in tests)
+        self.llm = llm or ChatCohere(model='command-r')
+        # the packing keeps the prompt inside the mode's budget however many documents the rerank returns
+        self.reranker = reranker or CohereRerank(model='rerank-english-v3.0',top_n=int(os.getenv("VERI_RERANK_TOP_N", "3")))
+        # one retriever is shared by every mode, only the prompt changes between them
+        self.compression_retriever = ContextualCompressionRetriever(
+            base_retriever=self.hybrid_retriever(),
+            base_compressor = self.rerank_compressor()
+        )
+        self._chains_lock = threading.RLock()
+        self.answer_chains = {}
+        self.chains = {mode: self.build_chain(mode) for mode in MODES}
+        # timings of the last streamed answers, the deque is safe to append to from every session
+        self.query_timings = deque(maxlen=1000)
+        # uploads, paper searches and videos are ingested in the background, queries keep using what is already indexed
+        self.ingestion = IngestionQueue(
+            max_workers=int(os.getenv("VERI_INGEST_WORKERS", "2")),
+            max_pending=int(os.getenv("VERI_INGEST_MAX_PENDING", "16"))
+        )
+        if self.folder_path:
+            self.submit_folder_sync()
         self.change_template(option)
         
         
-    def update_vectorstore_with_files(self,file=None):
+    def index_chunks(self,chunks,doc_hash,source=None,progress=None,source_type=None,session_id=None):
+        """
+        Upsert the (chunk, extra metadata) pairs (any iterable, e.g. a generator still parsing the PDF)
+        that are not indexed yet, the vector id of a chunk is the hash of its content so the same chunk is never
+        stored twice. Chunks go to the namespace of the session with their source as metadata.
+        Returns the number of new chunks.
+        """
+        from langchain_core.documents import Document
+        scope = session_id or ""
+        # for an upload the chunks come from a generator still parsing the PDF, the pdf_parse span is nested in this one
+        with span("split",source_type=source_type) as split:
+            pairs = list(chunks)
+            split.set(chunks=len(pairs))
+        count("chunks",len(pairs),stage="split")
+        chunk_ids = [content_hash(chunk) for chunk,_ in pairs]
+        positions = self.manifest.new_chunks(chunk_ids,scope=scope)
+        if positions:
+            documents = [
+                Document(page_content=pairs[i][0],metadata=chunk_metadata(source_type,source,session_id,i,pairs[i][1]))
+                for i in positions
+            ]
+            self.write_documents(documents,[chunk_ids[i] for i in positions],progress,session_id)
+        self.manifest.record(doc_hash,source,chunk_ids,scope=scope)
+        return len(positions)
+
+    def write_documents(self,documents,ids,progress=None,session_id=None):
+        """embed and upsert the documents (a list) in batches and add them to the lexical index, reporting the progress after every batch"""
+        progress = progress or _no_progress
+        progress(EMBEDDING,0.0,f"embedding {len(ids)} chunks")
+        namespace = session_id or ""
+        try:
+            # the lexical index is local and cheap, it is updated first so a retried write finds it already there
+            self.lexical.add(ids,documents,namespace)
+            return self.writer.write(
+                documents,
+                ids,
+                namespace=namespace,
+                on_batch=lambda written: progress(EMBEDDING,written/len(ids),f"indexed {written}/{len(ids)} chunks")
+            )
+        finally:
+            # answers given before these documents existed may be missing something, even after a partial write
+            self._index_changed(namespace)
+
+    def update_vectorstore_with_files(self,file=None,progress=None,session_id=None):
         """Update the vector store with the PDFs uploaded by the user"""
+        progress = progress or _no_progress
         if file:
-            text = pdf_to_text(file=file)
-            text_chunks = self.text_splitter.split_text(text)
-            documents = [Document(page_content=chunk) for chunk in text_chunks]
-            if not documents:
+            # streamlit keeps the file in the uploader between reruns, hashing it is much cheaper than parsing it again
+            data = file.getvalue() if hasattr(file,'getvalue') else file.read()
+            doc_hash = content_hash(data)
+            if self.manifest.has_document(doc_hash,scope=session_id or ""):
                 return
-            self.vectorstore.add_documents(documents=documents)
+            count("bytes",len(data),stage="upload")
+            # the PDF is parsed when index_chunks takes the chunks, so the pdf_parse span is in its split span
+            progress(PARSING,message="parsing the PDF")
+            pages = timed_iter(iter_pdf_pages(data),"pdf_parse",bytes=len(data))
+            self.index_chunks(
+                with_pages(split_document(pages,self.chunker)),
+                doc_hash,
+                source=getattr(file,'name',None),
+                progress=progress,
+                source_type="pdf",
+                session_id=session_id
+            )
         else:
             # added this part as it is scalable to be able to connect to your device it will get all the files
             # and upload them in the vectorstore so they can be retrieved when a query related to them is asked!
-            if self.folder_path==None:
-                return
-            text_loader_kwargs = {"autodetect_encoding": True}
-            loader = DirectoryLoader(path = self.folder_path,loader_cls=TextLoader,loader_kwargs=text_loader_kwargs)
-            directory = loader.load()
-            documents = []
-            for file in directory:
-                file_path = file.metadata.get('source')
-                text=pdf_to_text(file_path=file_path)
-                splits = self.text_splitter.split_text(text)  # Splits text into chunks
-                text_chunks = [Document(page_content=chunk) for chunk in splits]
-                documents.extend(text_chunks)
-                
-            self.vectorstore.add_documents(documents=documents)
-
-    def update_vector_store_with_research_papers(self,query):
+            return self.sync_folder(progress)
+
+    def sync_folder(self,progress=None,folder_path=None):
+        """
+        Sync the folder (VERI_FOLDER_PATH) into the shared namespace: new and changed files are parsed
+        in the process pool and indexed, the vectors of removed files are deleted, unchanged files are
+        only stat-ed. Returns the counts of what was done.
+        """
+        from folder_sync import sync_folder
+        progress = progress or _no_progress
+        folder_path = folder_path or self.folder_path
+        if folder_path is None:
+            return None
+        self.folder_path = folder_path
+        progress(PARSING,message=f"scanning {folder_path}")
+
+        def index_file(path,doc_hash,batch):
+            # the files are parsed and chunked in the process pool, only the chunk offsets come back with the text
+            self.index_chunks(with_pages(batch.document(0)),doc_hash,source=path,source_type="folder")
+
+        stats = sync_folder(
+            folder_path,
+            self.folder_state,
+            index_file,
+            self.remove_document,
+            get_parse_pool(),
+            extensions=self.folder_extensions,
+            progress=lambda fraction,message: progress(EMBEDDING,fraction,message),
+            splitter=self.chunker
+        )
+        self.manifest.flush()
+        return stats
+
+    def submit_folder_sync(self,folder_path=None):
+        """queue a folder sync, while one is queued or running the same job is returned"""
+        with self._folder_lock:
+            if self._folder_job is None or self._folder_job.done:
+                self._folder_job = self.ingestion.submit(
+                    "folder",self.sync_folder,description=folder_path or self.folder_path,folder_path=folder_path
+                )
+            return self._folder_job
+
+    def remove_document(self,doc_hash,session_id=None):
+        """delete the vectors of a document that are not shared with another one, from both indexes"""
+        namespace = session_id or ""
+        chunk_ids = self.manifest.forget(doc_hash,scope=namespace)
+        try:
+            # pinecone deletes at most 1000 ids per request
+            for start in range(0,len(chunk_ids),1000):
+                self.index.delete(ids=chunk_ids[start:start+1000],namespace=namespace)
+            self.lexical.delete(ids=chunk_ids,namespace=namespace)
+        finally:
+            self._index_changed(namespace)
+        return len(chunk_ids)
+
+    def _index_changed(self,namespace):
+        # answers given before the documents of the namespace changed may be wrong now, every session searches the shared one
+        with self._version_lock:
+            self.index_versions[namespace] = self.index_versions.get(namespace,0) + 1
+        self.answer_cache.invalidate(lambda key: key[1] == namespace or not namespace)
+
+    def update_vector_store_with_research_papers(self,query,progress=None,session_id=None):
         """updating the vectorstore with the research papers we get"""
+        progress = progress or _no_progress
+        scope = session_id or ""
+        progress(PARSING,message="searching for papers")
         source,papers = get_papers_from_query(query)
         papers_with_pdf = extract_pdf_links(papers)
-        documents = []
-        for paper in papers_with_pdf:
-            if len(documents) >100:
-                continue
-            link = paper['link']
-            text=get_pdf_to_text(pdf_url=link,source=source)
-            if text is not None:
-                splits = self.text_splitter.split_text(text)
-                text_chunks = [Document(page_content=chunk) for chunk in splits]
-                documents.extend(text_chunks)
-        self.vectorstore.add_documents(documents=documents)
+        # papers we already have are not downloaded again
+        new_papers = [paper for paper in papers_with_pdf if not self.manifest.has_source(paper['link'],scope=scope)]
+
+        done = []
+
+        def on_chunks(paper,batch):
+            done.append(paper)
+            progress(EMBEDDING,len(done)/len(new_papers),f"indexing {paper['title']}")
+            doc_hash = content_hash(batch.texts[0])
+            if self.manifest.has_document(doc_hash,scope=scope):
+                return 0
+            chunks = with_pages(batch.document(0))
+            return self.index_chunks(chunks,doc_hash,source=paper['link'],source_type="paper",session_id=session_id)
+
+        progress(PARSING,message=f"downloading {len(new_papers)} papers")
+        # downloads run in parallel and every paper is indexed as soon as it is parsed
+        # and chunked in the same worker process, the pages never travel back as separate strings
+        parse = functools.partial(parse_pdf_chunks,chunk_size=self.chunker.chunk_size,chunk_overlap=self.chunker.chunk_overlap)
+        fetch_papers(new_papers,source,on_chunks,chunk_budget=MAX_PAPER_CHUNKS,parse=parse)
         return papers_with_pdf
     
-    def update_vector_store_with_youtube(self,link):
-        """updating the vectorstore with the youtube video link we get"""
-        loader = YoutubeLoader.from_youtube_url(
-                youtube_url=link, 
-                add_video_info=False,
-                language=["en", "en-US"],
-                translation="en"
-            )
-        
-        documents=loader.load()
-        self.vectorstore.add_documents(documents=documents)
-        
-    def get_rag_chain(self):
-        """Return the RAG chain."""
-        return self.chain
-    
-    def change_template(self,option):
-        
-        self.template = get_template(option)
-        self.prompt = PromptTemplate.from_template(self.template)
-        self.compression_retriever = ContextualCompressionRetriever(
-            base_retriever=self.vectorstore.as_retriever(),
-            base_compressor = self.reranker
+    def update_vector_store_with_youtube(self,link,progress=None,session_id=None):
+        """
+        updating the vectorstore with the youtube video link we get, the transcript comes from the disk
+        cache when the video was seen before and is split into chunks that know where they are in the video
+        """
+        progress = progress or _no_progress
+        scope = session_id or ""
+        video = video_id(link)
+        if video is None:
+            raise ValueError(f"{link} is not a youtube video link")
+        # every form of the link (youtu.be, shorts, with a timestamp...) is the same source
+        source = video_url(video)
+        if self.manifest.has_source(source,scope=scope):
+            return 0
+        progress(PARSING,message="loading the transcript")
+        with span("transcript_fetch",video=video):
+            segments = self.transcripts.get(video)
+        doc_hash = content_hash(" ".join(segment["text"] for segment in segments))
+        if self.manifest.has_document(doc_hash,scope=scope):
+            return 0
+        chunks = (
+            (chunk,{"start": round(start,1), "end": round(end,1), "url": video_url(video,start)})
+            for chunk,start,end in split_transcript(segments,self.chunker)
         )
-        
-        question_answer_chain = create_stuff_documents_chain(
+        return self.index_chunks(chunks,doc_hash,source=source,progress=progress,source_type="youtube",session_id=session_id)
+
+    def submit_pdf(self,file,session_id=None):
+        """queue an uploaded PDF for background ingestion, the same file always maps to the same job"""
+        data = file.getvalue() if hasattr(file,'getvalue') else file.read()
+        name = getattr(file,'name','PDF')
+        key = ("pdf",session_id,content_hash(data))
+        return self.ingestion.submit("pdf",self.update_vectorstore_with_files,file,key=key,description=name,session_id=session_id)
+
+    def submit_research_papers(self,query,session_id=None):
+        """queue a research paper search, the papers are in the job result once it is indexed"""
+        key = ("papers",session_id," ".join(query.lower().split()))
+        return self.ingestion.submit("papers",self.update_vector_store_with_research_papers,query,key=key,description=query,session_id=session_id)
+
+    def submit_youtube(self,link,session_id=None):
+        """
+        queue a youtube video for background ingestion, the transcript starts downloading right away
+        so several videos are fetched at the same time however many ingestion workers there are
+        """
+        video = video_id(link)
+        if video is None:
+            raise ValueError(f"{link} is not a youtube video link")
+        key = ("youtube",session_id,video)
+        # the UI submits every link again on each rerun, only a new job prefetches its transcript
+        if self.ingestion.find(key) is None:
+            self._transcript_pool.submit(self.transcripts.get,video)
+        return self.ingestion.submit("youtube",self.update_vector_store_with_youtube,link,key=key,description=link,session_id=session_id)
+
+    def submit_youtube_links(self,links,session_id=None):
+        """queue every link, returns (link, job or the error of a link that is not a video) pairs"""
+        jobs = []
+        for link in links:
+            try:
+                jobs.append((link,self.submit_youtube(link,session_id)))
+            except ValueError as e:
+                jobs.append((link,e))
+        return jobs
+
+    def hybrid_retriever(self,namespace="",filter=None,stats=None):
+        """
+        vector + BM25 search of the namespace fused with reciprocal rank fusion, before the rerank. A
+        session's namespace is searched together with the shared one, where the synced folder is
+        """
+        from hybrid_retriever import HybridRetriever
+        return HybridRetriever(
+            vectorstore=self.vectorstore,
+            lexical=self.lexical,
+            k=self.fused_k,
+            fetch_k=self.retrieve_k,
+            namespace=namespace,
+            shared=True,
+            filter=filter,
+            stats=stats
+        )
+
+    def rerank_compressor(self,stats=None):
+        """the cohere reranker, behind the local pre-ranking unless it is turned off"""
+        if not self.prerank:
+            return self.reranker
+        from prerank import PreRankingReranker
+        return PreRankingReranker(
+            embeddings=self.embeddings,
+            reranker=self.reranker,
+            top_k=self.prerank_top_k,
+            duplicate_threshold=self.duplicate_threshold,
+            token_budget=self.rerank_token_budget,
+            stats=stats
+        )
+
+    def get_retriever(self,option="default",session_id=None,stats=None):
+        """
+        Retriever (hybrid search + pre-ranking + rerank + context packing) limited to what the session ingested for this
+        mode plus the shared namespace (the synced folder), so the candidates and the rerank cost grow with the user's
+        own documents and not the whole index. Without a session only the shared namespace is searched. The timings and
+        candidate counts of every stage go into stats when it is given.
+        """
+        from langchain.retrievers import ContextualCompressionRetriever
+        source_types = MODE_SOURCE_TYPES.get(option)
+        retriever = ContextualCompressionRetriever(
+            base_retriever=self.hybrid_retriever(session_id or "",{"source_type": {"$in": list(source_types)}} if source_types else None,stats),
+            base_compressor=self.rerank_compressor(stats)
+        )
+        return retriever | self.context_packer(option,stats)
+
+    def context_packer(self,option,stats=None):
+        """packs the reranked chunks into the context budget of the mode"""
+        from langchain_core.runnables import RunnableLambda
+        from context_packing import ContextPacker
+        budget = self.context_budgets.get(option,self.context_budgets["default"])
+        return RunnableLambda(ContextPacker(budget,get_template(option),stats))
+
+    def _lookup_chain(self,chains,option,build):
+        chain = chains.get(option)
+        if chain is None:
+            with self._chains_lock:
+                chain = chains.get(option)
+                if chain is None:
+                    chain = build(option)
+                    chains[option] = chain
+        return chain
+
+    def get_rag_chain(self,option=None):
+        """Return the RAG chain, either the current one or the prebuilt one for the given option."""
+        if option is None:
+            return self.chain
+        return self._lookup_chain(self.chains,option,self.build_chain)
+
+    def get_answer_chain(self,option):
+        """Return the prompt | llm part of the chain for the given option, it takes the retrieved documents as context."""
+        return self._lookup_chain(self.answer_chains,option,self.build_answer_chain)
+    
+    def build_answer_chain(self,option):
+        """Build the stuff documents chain for one option."""
+        from langchain.chains.combine_documents import create_stuff_documents_chain
+        from langchain.prompts import PromptTemplate
+        prompt = PromptTemplate.from_template(get_template(option))
+        return create_stuff_documents_chain(
             llm=self.llm,
-            prompt=self.prompt
+            prompt=prompt
         )
-        
-        self.chain = create_retrieval_chain(
-            retriever=self.compression_retriever,
-            combine_docs_chain= question_answer_chain
+
+    def build_chain(self,option):
+        """Build the retrieval chain for one option, the clients and the retriever are shared."""
+        from langchain.chains.retrieval import create_retrieval_chain
+        return create_retrieval_chain(
+            retriever=self.compression_retriever | self.context_packer(option),
+            combine_docs_chain= self.get_answer_chain(option)
+        )
+
+    def stream_answer(self,query,option="default",session_id=None,limits=None):
+        """
+        Retrieve and rerank the context, then stream the answer tokens from the llm as they arrive.
+        Iterate (or async for) over the returned AnswerStream to get the tokens, the full answer and the timings
+        are on it afterwards. limits are the per stage semaphores of the async service.
+        """
+        namespace = session_id or ""
+        stages = {}
+        return AnswerStream(
+            self.get_retriever(option,session_id,stages),
+            self.get_answer_chain(option),
+            query,
+            on_done=self.query_timings.append,
+            answer_cache=self.answer_cache,
+            cache_key=(option,namespace,self.index_versions.get(namespace,0),self.index_versions.get("",0)),
+            stages=stages,
+            limits=limits
         )
+    
+    def change_template(self,option):
+        """Switch the current chain, kept for callers that still hold on to a single chain."""
+        from langchain.prompts import PromptTemplate
+        self.template = get_template(option)
+        self.prompt = PromptTemplate.from_template(self.template)
+        self.chain = self.get_rag_chain(option)
+
+    def warm_up(self):
+        """
+        Open the connections to Cohere and the vector store before the first user query so the first
+        answer does not pay for the TLS handshakes, returns the time it took. A failure is counted
+        in the errors telemetry, the real query will surface it to the user.
+        """
+        start = time.perf_counter()
+        try:
+            self.embeddings.embed_query("warm up")
+            self.index.describe_index_stats()
+        except Exception as e:
+            record_error("warm_up",e)
+        return time.perf_counter() - start
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine(warm_up=True):
+    """
+    Return the process wide RAG_Chain, it is created (and warmed up) only once so streamlit
+    reruns and concurrent sessions all share the same clients, vector store and chains.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = RAG_Chain()
+                # prometheus style text of the spans and counters on http://127.0.0.1:<port>/metrics
+                if os.getenv("VERI_METRICS_PORT"):
+                    from telemetry import start_metrics_server
+                    start_metrics_server(int(os.getenv("VERI_METRICS_PORT")))
+                if warm_up:
+                    engine.warm_up()
+                _engine = engine
+    return _engine
+
+def measure_time_to_first_answer(query,option="default",shared=True):
+    """
+    Time how long it takes to get the first answer, with the shared engine or by building
+    a new RAG_Chain like every rerun used to do. Returns the timings in seconds.
+    """
+    start = time.perf_counter()
+    if shared:
+        chain = get_engine().get_rag_chain(option)
+    else:
+        chain = RAG_Chain(option=option).get_rag_chain()
+    setup = time.perf_counter() - start
+    chain.invoke({"input": query})
+    total = time.perf_counter() - start
+    return {"setup": setup, "answer": total - setup, "total": total}
 
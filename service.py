@@ -0,0 +1,196 @@
+"""
+Headless HTTP service over the shared RAG_Chain, for other systems and for more concurrent users
+than the streamlit sessions can take. One engine serves every request; answers are streamed with
+the llm's async client while the retrieval (sync clients) runs in worker threads, and every
+upstream gets a semaphore so a burst of requests queues here instead of at cohere or pinecone.
+
+    python service.py --port 8080
+
+    POST /query      {"query", "mode", "session_id", "stream"}   NDJSON tokens, then {"done": true, ...}
+    POST /upload     multipart "file" (+ "session_id")           202 with the ingestion job
+    POST /papers     {"query", "session_id"}                     202 with the ingestion job
+    POST /youtube    {"links": [...], "session_id"}              202 with a job (or an error) per link
+    GET  /jobs/{id}  the job's status and progress
+    POST /jobs/{id}/retry  runs a failed job again, 202 with the new job (submitting the same input returns the failed one)
+    GET  /metrics    prometheus style text of the telemetry
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from ingest_queue import QueueFull
+from telemetry import telemetry
+
+# queries in each stage at once, VERI_SERVICE_<STAGE>_CONCURRENCY overrides them
+DEFAULT_LIMITS = {"retrieve": 16, "generate": 32, "ingest": 8}
+# threads running the sync clients (retrieval, cache lookups, submits), asyncio's default is cpu count + 4
+# which would cap the retrieval concurrency far below its semaphore on a small machine
+DEFAULT_THREADS = 64
+# largest upload accepted, in megabytes
+MAX_UPLOAD_MB = 50
+
+ENGINE = web.AppKey("engine", object)
+LIMITS = web.AppKey("limits", dict)
+
+
+def limits_from_env():
+    return {
+        stage: asyncio.Semaphore(int(os.getenv(f"VERI_SERVICE_{stage.upper()}_CONCURRENCY", str(default))))
+        for stage, default in DEFAULT_LIMITS.items()
+    }
+
+
+def job_response(job, status=202):
+    return web.json_response(job.snapshot(), status=status)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="expected a JSON body")
+
+
+async def query(request):
+    body = await read_json(request)
+    question = (body.get("query") or "").strip()
+    if not question:
+        raise web.HTTPBadRequest(text="query is empty")
+    engine = request.app[ENGINE]
+    stream = engine.stream_answer(question, body.get("mode", "default"), body.get("session_id"), limits=request.app[LIMITS])
+
+    def summary():
+        return {
+            "done": True,
+            "answer": stream.answer,
+            "cached": stream.cached,
+            "timings": stream.timings,
+            "sources": [document.metadata for document in stream.context],
+        }
+
+    if not body.get("stream", True):
+        async for _ in stream:
+            pass
+        return web.json_response(summary())
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    async for token in stream:
+        await response.write((json.dumps({"token": token}) + "\n").encode("utf-8"))
+    await response.write((json.dumps(summary(), default=str) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def submit(request, fn, *args, **kwargs):
+    # submitting hashes the upload and touches the queue's lock, kept off the event loop
+    async with request.app[LIMITS]["ingest"]:
+        try:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        except QueueFull as e:
+            raise web.HTTPTooManyRequests(text=str(e))
+
+
+async def upload(request):
+    reader = await request.multipart()
+    file, session_id = None, None
+    async for part in reader:
+        if part.name == "file":
+            data = await part.read()
+            file = io.BytesIO(data)
+            file.name = part.filename or "upload.pdf"
+        elif part.name == "session_id":
+            session_id = (await part.text()) or None
+    if file is None:
+        raise web.HTTPBadRequest(text="no file in the upload")
+    return job_response(await submit(request, request.app[ENGINE].submit_pdf, file, session_id))
+
+
+async def papers(request):
+    body = await read_json(request)
+    if not (body.get("query") or "").strip():
+        raise web.HTTPBadRequest(text="query is empty")
+    return job_response(await submit(request, request.app[ENGINE].submit_research_papers, body["query"], body.get("session_id")))
+
+
+async def youtube(request):
+    body = await read_json(request)
+    links = body.get("links") or ([body["link"]] if body.get("link") else [])
+    if not links:
+        raise web.HTTPBadRequest(text="no links")
+    jobs = await submit(request, request.app[ENGINE].submit_youtube_links, links, body.get("session_id"))
+    return web.json_response(
+        [{"link": link, "error": str(job)} if isinstance(job, Exception) else dict(job.snapshot(), link=link) for link, job in jobs],
+        status=202,
+    )
+
+
+async def job_status(request):
+    job = request.app[ENGINE].ingestion.get(int(request.match_info["job_id"]))
+    if job is None:
+        raise web.HTTPNotFound(text="no such job")
+    return web.json_response(job.snapshot())
+
+
+async def retry_job(request):
+    job = await submit(request, request.app[ENGINE].ingestion.retry, int(request.match_info["job_id"]))
+    if job is None:
+        raise web.HTTPNotFound(text="no such job")
+    return job_response(job)
+
+
+async def metrics(request):
+    return web.Response(text=telemetry.render_prometheus(), content_type="text/plain")
+
+
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+
+def create_app(engine=None):
+    """
+    The aiohttp application. Without an engine the process wide one (rag_chain.get_engine) is built
+    and warmed up when the app starts, a given one (e.g. the offline fakes) is used as it is.
+    """
+    app = web.Application(client_max_size=MAX_UPLOAD_MB * 1024 * 1024)
+
+    async def start(app):
+        # the semaphores belong to the event loop the app runs on
+        app[LIMITS] = limits_from_env()
+        # langchain's async fallbacks and asyncio.to_thread both run on the loop's default executor
+        threads = int(os.getenv("VERI_SERVICE_THREADS", str(DEFAULT_THREADS)))
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads, thread_name_prefix="service"))
+        if engine is None:
+            from rag_chain import get_engine
+            app[ENGINE] = await asyncio.to_thread(get_engine)
+        else:
+            app[ENGINE] = engine
+
+    app.on_startup.append(start)
+    app.add_routes([
+        web.post("/query", query),
+        web.post("/upload", upload),
+        web.post("/papers", papers),
+        web.post("/youtube", youtube),
+        web.get(r"/jobs/{job_id:\d+}", job_status),
+        web.post(r"/jobs/{job_id:\d+}/retry", retry_job),
+        web.get("/metrics", metrics),
+        web.get("/health", health),
+    ])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("VERI_SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("VERI_SERVICE_PORT", "8080")))
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import bisect
+import contextvars
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from manifest import CACHE_DIR
+
+# upper bounds (seconds) of the latency histogram buckets, prometheus style
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# recent durations kept per span name for the percentiles in summary()
+RECENT_SAMPLES = 1000
+# seconds between two stack samples of the profiler
+PROFILE_INTERVAL = 0.005
+
+_current = contextvars.ContextVar("veri_span", default=None)
+_ids = itertools.count(1)
+
+
+class Telemetry:
+    """
+    Spans and counters of the whole process. Every finished span goes into a latency histogram per
+    name and, when a log path is set, one JSON line per span. Counters add up bytes, chunks and
+    tokens. render_prometheus() is the text format a prometheus scrape expects.
+    Spans whose name is in profile_spans are sampled by the stack profiler, the profile is only
+    written when the span took longer than profile_threshold seconds.
+    """
+
+    def __init__(self, log_path=None, profile_threshold=None, profile_spans=("query", "ingest"), profile_dir=None):
+        self.log_path = log_path
+        self.profile_threshold = profile_threshold
+        self.profile_spans = set(profile_spans)
+        self.profile_dir = profile_dir or os.path.join(CACHE_DIR, "profiles")
+        self._lock = threading.Lock()
+        # name -> [count, sum, count per bucket (not cumulative, one more for +Inf)]
+        self._histograms = {}
+        self._recent = {}
+        # (name, labels) -> value
+        self._counters = {}
+        self._log = None
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+                self._recent[name] = deque(maxlen=RECENT_SAMPLES)
+            histogram[0] += 1
+            histogram[1] += seconds
+            histogram[2][bisect.bisect_left(BUCKETS, seconds)] += 1
+            self._recent[name].append(seconds)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _write(self, record):
+        if not self.log_path:
+            return
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._log is None:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                # line buffered, a crash loses at most the span being written
+                self._log = open(self.log_path, "a", encoding="utf-8", buffering=1)
+            self._log.write(line)
+
+    def record(self, name, seconds, **attributes):
+        """
+        a stage timed somewhere else (a process pool worker, a generator), logged as a finished span
+        under the current one
+        """
+        parent = _current.get()
+        self.observe(name, seconds)
+        self._write({
+            "span": name,
+            "id": next(_ids),
+            "parent": parent.id if parent else None,
+            "trace": parent.trace if parent else None,
+            "start": time.time() - seconds,
+            "seconds": seconds,
+            **attributes,
+        })
+
+    def record_error(self, stage, error, **attributes):
+        """
+        an error that was handled and did not stop the work (a file or paper skipped), counted per stage
+        in the errors counter and logged with its message under the current span
+        """
+        parent = _current.get()
+        self.count("errors", stage=stage)
+        self._write({
+            "error": type(error).__name__,
+            "message": str(error),
+            "stage": stage,
+            "parent": parent.id if parent else None,
+            "trace": parent.trace if parent else None,
+            "time": time.time(),
+            **attributes,
+        })
+
+    def timed_iter(self, iterable, name, **attributes):
+        """
+        yields from the iterable and records the time spent inside it as one `name` span once it is
+        exhausted, for generators (page parsing) whose work is interleaved with the consumer's
+        """
+        iterator = iter(iterable)
+        seconds = 0.0
+        items = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += time.perf_counter() - start
+                    break
+                seconds += time.perf_counter() - start
+                items += 1
+                yield item
+        finally:
+            self.record(name, seconds, items=items, **attributes)
+
+    def start_span(self, name, **attributes):
+        """starts a span, end() it when the stage is done (or use span() as a context manager)"""
+        return Span(self, name, attributes)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            span.end()
+
+    def summary(self):
+        """count, mean and percentiles of every span and the counters, as plain data"""
+        with self._lock:
+            spans = {}
+            for name, (count, total, _) in self._histograms.items():
+                recent = sorted(self._recent[name])
+                spans[name] = {
+                    "count": count,
+                    "mean": total / count,
+                    "p50": recent[len(recent) // 2],
+                    "p99": recent[min(len(recent) - 1, int(len(recent) * 0.99))],
+                }
+            counters = {
+                name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+                for (name, labels), value in self._counters.items()
+            }
+        return {"spans": spans, "counters": counters}
+
+    def render_prometheus(self):
+        """metrics in the prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            if self._histograms:
+                lines.append("# TYPE veri_span_seconds histogram")
+            for name, (count, total, buckets) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, buckets):
+                    cumulative += bucket
+                    lines.append(f'veri_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'veri_span_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+                lines.append(f'veri_span_seconds_sum{{span="{name}"}} {total}')
+                lines.append(f'veri_span_seconds_count{{span="{name}"}} {count}')
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                lines.append(f"# TYPE veri_{name}_total counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                        lines.append(f"veri_{name}_total{{{label_text}}} {value}" if label_text else f"veri_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+class Span:
+    def __init__(self, telemetry, name, attributes):
+        self.telemetry = telemetry
+        self.name = name
+        self.attributes = attributes
+        self.id = next(_ids)
+        parent = _current.get()
+        self.parent = parent.id if parent else None
+        self.trace = parent.trace if parent else self.id
+        self._start = time.perf_counter()
+        self._token = _current.set(self)
+        self._ended = False
+        self.profiler = None
+        if telemetry.profile_threshold is not None and name in telemetry.profile_spans:
+            self.profiler = SamplingProfiler(threading.get_ident())
+            self.profiler.start()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        if self._ended:
+            return
+        self._ended = True
+        seconds = time.perf_counter() - self._start
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # ended from another context (a generator finished elsewhere), the parent is left as it is
+            pass
+        self.telemetry.observe(self.name, seconds)
+        if not self.telemetry.log_path and self.profiler is None:
+            return seconds
+        record = {
+            "span": self.name,
+            "id": self.id,
+            "parent": self.parent,
+            "trace": self.trace,
+            "start": time.time() - seconds,
+            "seconds": seconds,
+            **self.attributes,
+        }
+        if self.profiler is not None:
+            stacks = self.profiler.stop()
+            if seconds > self.telemetry.profile_threshold:
+                record["profile"] = write_profile(self.telemetry.profile_dir, self.name, self.id, stacks)
+        self.telemetry._write(record)
+        return seconds
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every PROFILE_INTERVAL seconds from a background thread, the
+    samples are counted per stack in the folded format flamegraph tools read.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="veri-profiler")
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def write_profile(directory, name, span_id, stacks):
+    """writes the folded stacks of a slow span and returns the path"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{int(time.time())}-{span_id}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, samples in stacks.most_common():
+            f.write(f"{stack} {samples}\n")
+    return path
+
+
+def run_timed(fn, *args):
+    """(fn(*args), seconds it took), module level so the time spent in a process pool worker comes back"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """serves render_prometheus() on http://host:port/metrics from a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="veri-metrics").start()
+    return server
+
+
+def _profile_threshold():
+    value = os.getenv("VERI_PROFILE_SLOW_MS")
+    return float(value) / 1000 if value else None
+
+
+# the process wide instance every module records into
+telemetry = Telemetry(log_path=os.getenv("VERI_TELEMETRY_LOG") or None, profile_threshold=_profile_threshold())
+span = telemetry.span
+start_span = telemetry.start_span
+count = telemetry.count
+record = telemetry.record
+record_error = telemetry.record_error
+timed_iter = telemetry.timed_iter
@@ -1,8 +1,9 @@
 
 import streamlit as st
 from streamlit_option_menu import option_menu
-from rag_chain import RAG_Chain
-import requests
+from rag_chain import get_engine
+from ingest_queue import QueueFull
+import uuid
 # Streamlit page configuration
 st.set_page_config(page_title='VERI', layout='wide', initial_sidebar_state='expanded')
 
@@ -91,6 +92,10 @@ if "messages" not in st.session_state:
     
 if 'option' not in st.session_state:
     st.session_state['option'] = 'none'
+
+# every browser session ingests into and retrieves from its own namespace
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 with st.sidebar:
     selected = option_menu(
         "VERI-Bot",
@@ -104,57 +109,88 @@ with st.sidebar:
         }
     )
     
+@st.experimental_fragment(run_every=2)
+def show_job(job_id):
+    """polls the ingestion job and shows its status, the rest of the page is not rerun"""
+    ingestion = get_engine().ingestion
+    job = ingestion.get(job_id)
+    if job is None:
+        return
+    # once it is retried the job of the key is the new one
+    job = ingestion.find(job.key) or job
+    status = job.snapshot()
+    if status["status"] == "failed":
+        st.error(f"{status['description']}: {status['error']}")
+        # reruns submit the same input again and get this failed job back, it only runs again from here
+        if st.button("Retry", key=f"retry-{job.id}"):
+            try:
+                ingestion.retry(job.id)
+            except QueueFull as e:
+                st.warning(str(e))
+    elif status["status"] == "indexed":
+        st.success(f"{status['description']}: indexed")
+    else:
+        st.progress(status["progress"], text=f"{status['description']}: {status['message'] or status['status']}")
+    # the papers found by a search are listed once the job is done
+    if job.kind == "papers" and job.result:
+        for paper in job.result:
+            st.markdown(f"[{paper['title']}]({paper['link']})")
+
 def main():
-    rag_chain = RAG_Chain(option=selected)
-    chain = rag_chain.get_rag_chain()
+    # the engine is built once per process, reruns only pick the chain for the selected option when answering
+    rag_chain = get_engine()
     
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
             
-    if selected == "PDF RAG":
-        uploaded_file = st.sidebar.file_uploader("Upload a PDF resume", type="pdf")
-        if st.session_state.option:
-            if uploaded_file :
-                rag_chain.update_vectorstore_with_files(uploaded_file)
-                rag_chain.change_template(selected)
-                chain = rag_chain.get_rag_chain()
-                
-    elif selected == "Research Papers":
-        category = st.sidebar.text_input("Enter the subject")
-        if st.session_state.option:
-            if category:
-                papers=rag_chain.update_vector_store_with_research_papers(category)
-                rag_chain.change_template(selected)
-                chain = rag_chain.get_rag_chain()
-                for paper in papers:
-                    st.sidebar.markdown(f"[{paper['title']}]({paper['link']})")
-    elif selected == "YouTube Videos":
-        video_link = st.sidebar.text_input("Enter video link")
-        if st.session_state.option:
-            if video_link:
-                try:
-                    response = requests.head(video_link, timeout=5)
-                    if response.status_code == 200:
-                        rag_chain.update_vector_store_with_youtube(video_link)
-                        rag_chain.change_template(selected)
-                        chain = rag_chain.get_rag_chain()
-
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
-                    
+    # ingestion runs in the background, the sidebar only shows where the jobs are at
+    job = None
+    jobs = []
+    try:
+        if selected == "PDF RAG":
+            uploaded_file = st.sidebar.file_uploader("Upload a PDF resume", type="pdf")
+            if st.session_state.option:
+                if uploaded_file :
+                    job = rag_chain.submit_pdf(uploaded_file, session_id=st.session_state.session_id)
                     
+        elif selected == "Research Papers":
+            category = st.sidebar.text_input("Enter the subject")
+            if st.session_state.option:
+                if category:
+                    job = rag_chain.submit_research_papers(category, session_id=st.session_state.session_id)
+        elif selected == "YouTube Videos":
+            video_links = st.sidebar.text_area("Enter video links, one per line")
+            if st.session_state.option:
+                links = [link.strip() for link in video_links.splitlines() if link.strip()]
+                # the links are checked by parsing them, no request is made before the jobs are queued
+                for link, result in rag_chain.submit_youtube_links(links, session_id=st.session_state.session_id):
+                    if isinstance(result, Exception):
+                        st.sidebar.warning(str(result))
+                    else:
+                        jobs.append(result)
+    except QueueFull as e:
+        st.sidebar.warning(str(e))
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+
+    if job is not None:
+        jobs.append(job)
+    with st.sidebar:
+        for job in jobs:
+            show_job(job.id)
                     
     if query:= st.chat_input("Please ask your Query?"):
         st.session_state.messages.append({"role": "user", "content": query})  # Add user query to session state(messages)
         with st.chat_message("user"):
             st.markdown(query)  # Display user query
             
-        with st.chat_message("assistant") and st.spinner('Processing...'):
+        with st.chat_message("assistant"):
             try:
-                response = chain.invoke({"input": query})
-                answer = response["answer"]  # only getting the answer from the response as it is a dictionary  
-                response = st.write(answer) 
+                # tokens are written into the message as the llm produces them instead of after the whole answer
+                stream = rag_chain.stream_answer(query, selected, session_id=st.session_state.session_id)
+                st.write_stream(stream)
+                answer = stream.answer
                 st.session_state.messages.append({"role": "assistant", "content": answer}) # Add assistant's answer to session state(messages)
             except Exception as e:
                 st.error(f"An error occurred: {e}")
@@ -1,10 +1,14 @@
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
 import requests
-from PyPDF2 import PdfReader
-from io import BytesIO
-import spacy
-import fitz 
+from requests.adapters import HTTPAdapter
 from rapidfuzz import process
-from bs4 import BeautifulSoup
+from pdf_download import RejectedDownload,get_pdf_cache
+from pdf_extract import extract_pdf_text
+from ttl_cache import TTLCache
+from telemetry import count,span
 
 similarity_threshold = 80
 # All the available categories
@@ -62,59 +66,108 @@ categories = {
     'applied mathematics': 'math.AP',
     'rings algebras':'math.RA'
 }
-# Loading english tokenizer 
-nlp = spacy.load('en_core_web_sm')
+# english stopwords for the query preprocessing, enough to find the category without loading a spaCy pipeline
+STOP_WORDS = frozenset("""
+a about above across after afterwards again against all almost alone along already also although always am
+among amongst an and another any anyhow anyone anything anyway anywhere are around as at be became because
+become becomes becoming been before beforehand behind being below beside besides between beyond both but by
+can cannot could did do does doing done down due during each either else elsewhere enough even ever every
+everyone everything everywhere except few find first for former formerly from further get give go had has
+have having he hence her here hereafter hereby herein hereupon hers herself him himself his how however i if
+in indeed into is it its itself just keep last latter latterly least less made make many may me meanwhile
+might mine more moreover most mostly much must my myself name namely neither never nevertheless next no
+nobody none noone nor not nothing now nowhere of off often on once one only onto or other others otherwise
+our ours ourselves out over own part per perhaps please put quite rather re really regarding same say see
+seem seemed seeming seems several she should show side since so some somehow someone something sometime
+sometimes somewhere still such take than that the their them themselves then thence there thereafter thereby
+therefore therein thereupon these they this those though through throughout thru thus to together too
+top toward towards under unless until up upon us used using various very via was we well were what whatever
+when whence whenever where whereafter whereas whereby wherein whereupon wherever whether which while whither
+who whoever whole whom whose why will with within without would yet you your yours yourself yourselves
+""".split())
+# words, keeping the inner hyphens of names like human-computer
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_nlp = None
 BASE_URL = "http://export.arxiv.org/api/query?"
+# connect / read timeouts for every outgoing request
+REQUEST_TIMEOUT = (5, 10)
+# size of the connection pool per host, enough for the parallel paper downloads
+HTTP_POOL_SIZE = 16
+# the category names are matched against on every search, built once instead of per query
+CATEGORY_NAMES = list(categories.keys())
+ATOM_NS = {"atom": "http://www.w3.org/2005/Atom"}
+# normalized query -> arxiv category, the categories never change so this can live long
+_category_cache = TTLCache(ttl=float(os.getenv("VERI_CATEGORY_CACHE_TTL", "86400")), max_entries=10000)
+# ("arxiv", category) or ("google", normalized query) -> papers, many users search the same subjects
+_search_cache = TTLCache(ttl=float(os.getenv("VERI_SEARCH_CACHE_TTL", "3600")), max_entries=2000)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    shared requests session so downloads reuse pooled connections instead of opening a new one every time
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
 
 def pdf_to_text(file=None,file_path=None):
     """
     Convert the PDF file to text.
     """
     if file is not None:    
-        pdf_reader = PdfReader(file) 
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()  # Extracts text from each page
-        return text
+        return extract_pdf_text(file)
     elif file_path is not None:
-        with open(file_path, 'rb') as file:  
-            pdf_reader = PdfReader(file) 
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() 
-        return text
+        return extract_pdf_text(file_path)
     else:
         raise ValueError("Either 'file' or 'file_path' must be provided.")  # Handle the case where neither is provided
     
+def download_pdf(pdf_url,source="google",session=None,cache=None):
+    """
+    Downloads a PDF into the PDF cache (streamed to disk, never whole in memory) and returns its path,
+    papers downloaded before are only revalidated. None when the response is not a PDF or is too large,
+    which is found from the headers or the first bytes.
+    """
+    session = session or get_session()
+    cache = cache or get_pdf_cache()
+    with span("pdf_download",source=source,url=pdf_url) as download:
+        if source == 'google' and not pdf_url.endswith('pdf'):
+            return None
+        try:
+            # google results are often pages about the paper, only an application/pdf answer is taken
+            path,received = cache.get(pdf_url,session,timeout=REQUEST_TIMEOUT,require_pdf_type=source == 'google')
+        except RejectedDownload as e:
+            # too large or not a PDF, not an error, the reason goes on the span
+            download.set(rejected=str(e))
+            count("rejected",stage="download")
+            return None
+        download.set(bytes=received,cached=received == 0)
+        count("bytes",received,stage="download")
+        return path
+
+def parse_pdf_bytes(data):
+    """
+    Extracts the text of a PDF given as bytes or a path, kept at module level so it can run in a process pool
+    """
+    return extract_pdf_text(data)
+
 def get_pdf_to_text(pdf_url,source="google"):
     """
     Downloads a PDF from the given URL and returns its content as a documents
 
     """
-    if source == 'google':
-        if pdf_url.endswith('pdf'):
-            response = requests.get(pdf_url, timeout=10)
-            # Check if the URL contains a valid PDF file
-            if "application/pdf" in response.headers.get('Content-Type', ''):
-                pdf_file = BytesIO(response.content)
-
-                doc = fitz.open(stream=pdf_file, filetype="pdf")
-                
-                text = ""
-                for page in doc:
-                    text += page.get_text("text")
-                
-                return text
-            else :
-                return None
-    else:
-        response = requests.get(pdf_url, timeout=10)
-        pdf_file = BytesIO(response.content)
-        doc = fitz.open(stream=pdf_file, filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text("text") 
-    return text
+    data = download_pdf(pdf_url,source=source)
+    if data is None:
+        return None
+    return parse_pdf_bytes(data)
     
 def pdf_link(abs_url):
     """
@@ -132,13 +185,11 @@ def find_closest_category(user_input):
     """
     # Extract and preprocess the user input
     cleaned_input = preprocess_input(user_input)
-    
-    # Extract category names for comparison
-    category_names = list(categories.keys())
+    return _category_cache.get_or_compute(cleaned_input, lambda: _closest_category(cleaned_input))
 
-    
+def _closest_category(cleaned_input):
     # Find the closest match using rapidfuzz could have used fuzzywuzzy as well? but it is slower...
-    result = process.extractOne(cleaned_input, category_names)
+    result = process.extractOne(cleaned_input, CATEGORY_NAMES)
     if result:
         closest_match, score ,index = result
         if score > similarity_threshold: # lets only take the values we are sure about 
@@ -154,8 +205,13 @@ def search_research_papers_google(query):
     """
     # making the search URL using the query
     search_url = f"https://scholar.google.com/scholar?&hl=en&as_sdt=0,5&q={query}+filetype:pdf"
-    response = requests.get(search_url)
+    with span("scholar_fetch"):
+        response = get_session().get(search_url, timeout=REQUEST_TIMEOUT)
+    count("bytes",len(response.content),stage="scholar")
+    # scholar answers a rate limited client with 429 or a captcha page, that is an error not "no papers"
+    response.raise_for_status()
     # Parsing the response content with BeautifulSoup so it can be used 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(response.content, 'html.parser')
     
     # Extract paper titles and their corresponding links so that they can be displayed and the user can choose 
@@ -165,35 +221,46 @@ def search_research_papers_google(query):
               for item in soup.select('.gs_ri') if item.select_one('.gs_rt a')]
     return papers  
 
-def preprocess_input(text):
+def get_nlp():
+    """
+    the spaCy pipeline, only loaded the first time someone asks for it as it takes about a second
+    """
+    global _nlp
+    if _nlp is None:
+        import spacy
+        _nlp = spacy.load('en_core_web_sm')
+    return _nlp
+
+def preprocess_input(text,use_spacy=False):
     """
     preprocessing the query by removing all the punctuations and getting the text in lower
     """
-    # Process the text with spaCy
-    doc = nlp(text)
-    
+    if use_spacy:
+        # Process the text with spaCy
+        doc = get_nlp()(text)
+        tokens = [token.text.lower() for token in doc if not token.is_stop and not token.is_punct]
+        return ' '.join(tokens)
+
     # Extract the words which are useful is getting the category could have done this with help of llm too 
-    # but this is a better method
-    tokens = [token.text.lower() for token in doc if not token.is_stop and not token.is_punct]
+    # but this is a better method, a regex and a stopword set do the same job as the spaCy pipeline here
+    tokens = [token for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
     return ' '.join(tokens)
 
 
 def parse_xml(xml_data):
     """
-    parse the data we got and getting the relevant info from it
+    parse the arxiv atom feed we got and getting the relevant info from it, ElementTree is a lot
+    faster than BeautifulSoup for a feed this regular
     """
-    soup = BeautifulSoup(xml_data, 'xml')
-    entries = soup.find_all('entry')
-    
+    root = ET.fromstring(xml_data)
     papers = []
     # getting all the entries of papers from it mainly text or 
-    for entry in entries:
-        paper = {
-                'title': entry.title.text.strip() if entry.title else None,
-                'link': entry.find('link', {'type': 'text/html'})['href'] if entry.find('link', {'type': 'text/html'}) else None
-            }
-        papers.append(paper)
+    for entry in root.iterfind('atom:entry', ATOM_NS):
+        title = entry.findtext('atom:title', None, ATOM_NS)
+        link = next((link.get('href') for link in entry.iterfind('atom:link', ATOM_NS) if link.get('type') == 'text/html'), None)
+        papers.append({'title': title.strip() if title is not None else None, 'link': link})
     return papers
+
 def extract_pdf_links(papers):
     """
     Extracts all PDF links from the provided HTML content.
@@ -210,29 +277,39 @@ def extract_pdf_links(papers):
 
 def get_papers_from_query(query):
     """
-    fetching the papers using queries 
+    fetching the papers using queries, the results are cached so a repeated search does not hit arxiv or scholar again
     """
     category = find_closest_category(query)
     if category:
-        arxiv_url = f"{BASE_URL}search_query={category}&start=0&max_results=10"
-        try:
-            response = requests.get(arxiv_url)
-            if response.status_code == 200:
-                xml_data = response.content
-                papers = parse_xml(xml_data)
-                papers_with_pdf_links=[]
-                for paper in papers:
-                    paper["link"] = pdf_link(paper["link"])
-                    if(paper["link"]):
-                        papers_with_pdf_links.append(paper)
-                return "arxiv",papers_with_pdf_links
-            else :
-                None
-        except Exception :
+        return _search_cache.get_or_compute(("arxiv", category), lambda: search_arxiv(category), cache_if=lambda result: result is not None)
+    cleaned_query = ' '.join(query.lower().split())
+    papers = _search_cache.get_or_compute(("google", cleaned_query), lambda: search_research_papers_google(query), cache_if=lambda papers: bool(papers))
+    return "google",extract_pdf_links(papers)
+
+def search_arxiv(category):
+    """
+    the latest papers of an arxiv category, None when arxiv can't be reached
+    """
+    arxiv_url = f"{BASE_URL}search_query={category}&start=0&max_results=10"
+    try:
+        with span("arxiv_fetch",category=category):
+            response = get_session().get(arxiv_url, timeout=REQUEST_TIMEOUT)
+        count("bytes",len(response.content),stage="arxiv")
+        if response.status_code != 200:
             return None
-    else:
-        paper = search_research_papers_google(query)
-        return "google",extract_pdf_links(paper)
+        papers = parse_xml(response.content)
+        papers_with_pdf_links=[]
+        for paper in papers:
+            paper["link"] = pdf_link(paper["link"]) if paper["link"] else None
+            if(paper["link"]):
+                papers_with_pdf_links.append(paper)
+        return "arxiv",papers_with_pdf_links
+    except Exception :
+        return None
+
+def search_cache_stats():
+    """hit rates of the category and search caches"""
+    return {"categories": _category_cache.stats(), "searches": _search_cache.stats()}
     
     
 def get_template(option):
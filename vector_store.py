@@ -0,0 +1,62 @@
+import os
+
+from manifest import CACHE_DIR
+from utils import check_index
+
+# "pinecone" (default) or "local" for the NumPy index on this machine
+BACKENDS = ("pinecone", "local")
+
+
+def local_index_dir():
+    return os.getenv("VERI_LOCAL_INDEX_DIR", os.path.join(CACHE_DIR, "local_index"))
+
+
+def index_identity(backend=None):
+    """
+    Which index the configured backend writes to, what is recorded about the indexed documents
+    (manifest, BM25 index, folder state) is kept per index so another index starts from nothing
+    """
+    backend = backend or os.getenv("VERI_VECTOR_BACKEND", "pinecone")
+    if backend == "pinecone":
+        return f"pinecone:{os.getenv('PINECONE_INDEX_NAME')}"
+    if backend == "local":
+        return f"local:{os.path.abspath(local_index_dir())}"
+    return backend
+
+
+def vector_count(index):
+    """number of vectors in the index, None when the stats don't have it. Errors of the request are raised"""
+    stats = index.describe_index_stats()
+    if isinstance(stats, dict):
+        return stats.get("total_vector_count")
+    return getattr(stats, "total_vector_count", None)
+
+
+def build_vector_store(embeddings, backend=None, dim=1024):
+    """
+    Creates the index and the langchain vector store for the configured backend and returns both,
+    the index takes the batched upserts and the vector store serves retrieval.
+    The backend comes from VERI_VECTOR_BACKEND unless it is given.
+    """
+    backend = backend or os.getenv("VERI_VECTOR_BACKEND", "pinecone")
+    if backend == "pinecone":
+        from langchain_pinecone.vectorstores import PineconeVectorStore
+        from pinecone import Pinecone
+        pinecone_api_key = os.getenv("PINECONE_API_KEY")
+        index_name = os.getenv("PINECONE_INDEX_NAME")
+        pc = Pinecone(api_key=pinecone_api_key)
+        # checking if the index exists or not
+        if index_name not in check_index(pc):
+            pc.create_index(name=index_name,dimension=dim)
+        index = pc.Index(index_name)
+        return index, PineconeVectorStore(index=index, pinecone_api_key=pinecone_api_key, embedding=embeddings)
+    if backend == "local":
+        from local_index import LocalVectorStore, NumpyIndex
+        index = NumpyIndex(
+            local_index_dir(),
+            dim=dim,
+            ann=os.getenv("VERI_LOCAL_INDEX_ANN", "false").lower() == "true",
+            ann_threshold=int(os.getenv("VERI_LOCAL_INDEX_ANN_THRESHOLD", "50000")),
+        )
+        return index, LocalVectorStore(index, embeddings)
+    raise ValueError(f"unknown vector store backend {backend!r}, expected one of {BACKENDS}")
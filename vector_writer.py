@@ -0,0 +1,124 @@
+import contextvars
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import count, span
+
+# cohere embeds up to 96 texts per request
+DEFAULT_BATCH_SIZE = 96
+# batches being embedded or upserted at the same time, also bounds the chunks held in memory
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class BatchedVectorWriter:
+    """
+    Embeds and upserts documents in batches straight into a Pinecone style index
+    (`index.upsert(vectors=[(id, values, metadata)])`), with several batches in flight.
+    Producers block once max_in_flight batches are pending, so a huge ingestion never holds more
+    than max_in_flight * batch_size chunks, and max_batches_per_second keeps us under rate limits.
+    A batch whose upsert fails is retried with the vectors it already has instead of embedding again.
+    The text goes into the metadata under text_key, the same place PineconeVectorStore reads it from.
+    """
+
+    def __init__(self, embeddings, index, text_key="text", batch_size=DEFAULT_BATCH_SIZE,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_retries=3, retry_delay=0.5, max_batches_per_second=None):
+        self.embeddings = embeddings
+        self.index = index
+        self.text_key = text_key
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.min_interval = 1.0 / max_batches_per_second if max_batches_per_second else 0.0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="upsert")
+        self._rate_lock = threading.Lock()
+        self._next_start = 0.0
+
+    def _wait_for_rate_limit(self):
+        if not self.min_interval:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+        time.sleep(max(0.0, start - now))
+
+    def _retry(self, fn, on_retry):
+        for attempt in itertools.count():
+            try:
+                return fn()
+            except Exception:
+                if attempt >= self.max_retries:
+                    raise
+                on_retry()
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def _write_batch(self, batch, namespace, on_retry):
+        texts = [document.page_content for _, document in batch]
+        # about 4 characters per token, the same estimate the prompt budgets use
+        tokens = sum(len(text) // 4 + 1 for text in texts)
+        with span("embed", chunks=len(texts), tokens=tokens):
+            vectors = self._retry(lambda: self.embeddings.embed_documents(texts), on_retry)
+        count("tokens", tokens, stage="embed")
+        records = [
+            (doc_id, vector, {**document.metadata, self.text_key: document.page_content})
+            for (doc_id, document), vector in zip(batch, vectors)
+        ]
+        # the vectors are kept, a failed upsert is sent again without another embedding call
+        with span("upsert", chunks=len(records)):
+            self._retry(lambda: self.index.upsert(vectors=records, namespace=namespace), on_retry)
+        count("chunks", len(records), stage="upsert")
+        return len(records)
+
+    def write(self, documents, ids, namespace=None, on_batch=None):
+        """
+        Writes the documents (any iterable, consumed lazily) under the given ids.
+        on_batch(chunks_written) is called after each batch. Returns the stats of the write
+        and raises the first error once every batch has finished if a batch still failed.
+        """
+        lock = threading.Lock()
+        progress = {"chunks": 0, "retries": 0}
+        futures = []
+        start = time.perf_counter()
+
+        def count_retry():
+            with lock:
+                progress["retries"] += 1
+
+        def done(future):
+            self._slots.release()
+            if future.exception() is not None or on_batch is None:
+                return
+            with lock:
+                progress["chunks"] += future.result()
+                written = progress["chunks"]
+            on_batch(written)
+
+        pairs = zip(ids, documents)
+        while True:
+            batch = list(itertools.islice(pairs, self.batch_size))
+            if not batch:
+                break
+            # backpressure, wait here until one of the in flight batches is done
+            self._slots.acquire()
+            self._wait_for_rate_limit()
+            # the batch runs in a copy of the caller's context so its spans are children of the ingestion span
+            future = self._executor.submit(contextvars.copy_context().run, self._write_batch, batch, namespace, count_retry)
+            future.add_done_callback(done)
+            futures.append(future)
+
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise errors[0]
+        seconds = time.perf_counter() - start
+        chunks = sum(future.result() for future in futures)
+        return {
+            "chunks": chunks,
+            "batches": len(futures),
+            "retries": progress["retries"],
+            "seconds": seconds,
+            "chunks_per_second": chunks / seconds if seconds else 0.0,
+        }
@@ -0,0 +1,126 @@
+import json
+import os
+import re
+import threading
+from urllib.parse import parse_qs, urlparse
+
+from manifest import CACHE_DIR, write_json
+
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com", "www.youtube-nocookie.com")
+
+
+def video_id(link):
+    """
+    The 11 character id of a youtube link (watch, youtu.be, shorts, embed and live links, or the bare
+    id), None when it is not a youtube video. Used instead of a request to check the link.
+    """
+    link = (link or "").strip()
+    if VIDEO_ID_RE.match(link):
+        return link
+    if "://" not in link:
+        link = "https://" + link
+    url = urlparse(link)
+    host = url.netloc.lower().split(":")[0]
+    candidate = None
+    if host in ("youtu.be", "www.youtu.be"):
+        candidate = url.path.strip("/").split("/")[0]
+    elif host in YOUTUBE_HOSTS:
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "watch":
+            candidate = parse_qs(url.query).get("v", [None])[0]
+        elif len(parts) > 1 and parts[0] in ("shorts", "embed", "live", "v"):
+            candidate = parts[1]
+    return candidate if candidate and VIDEO_ID_RE.match(candidate) else None
+
+
+def video_url(video, start=None):
+    """canonical link of the video, at the given second if there is one"""
+    url = f"https://www.youtube.com/watch?v={video}"
+    return f"{url}&t={int(start)}s" if start is not None else url
+
+
+def fetch_transcript(video, languages=("en", "en-US")):
+    """
+    The transcript of the video as a list of {"text", "start", "duration"} segments, in english or
+    translated to it. This is the only part that talks to youtube, RAG_Chain takes any function
+    with the same signature instead (a local fake in the benchmarks).
+    """
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    transcripts = YouTubeTranscriptApi.list_transcripts(video)
+    try:
+        transcript = transcripts.find_transcript(list(languages))
+    except Exception:
+        # no english transcript, take the first one and let youtube translate it
+        transcript = next(iter(transcripts)).translate("en")
+    return [{"text": s["text"], "start": float(s["start"]), "duration": float(s.get("duration", 0.0))} for s in transcript.fetch()]
+
+
+class TranscriptCache:
+    """
+    Transcripts on disk, one JSON file per video id, so entering the same link again (in any
+    session) does not go back to youtube. Transcripts don't change, there is no expiry.
+    """
+
+    def __init__(self, path=None, loader=fetch_transcript):
+        self.path = path or os.path.join(CACHE_DIR, "transcripts")
+        self.loader = loader
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, video):
+        return os.path.join(self.path, f"{video}.json")
+
+    def get(self, video):
+        # one lock per video, two sessions entering the same link load it once
+        with self._lock:
+            lock = self._locks.setdefault(video, threading.Lock())
+        with lock:
+            try:
+                with open(self._file(video), "r", encoding="utf-8") as f:
+                    segments = json.load(f)
+                self.hits += 1
+                return segments
+            except (OSError, ValueError):
+                pass
+            segments = self.loader(video)
+            self.misses += 1
+            write_json(self._file(video), segments)
+            return segments
+
+
+def split_transcript(segments, splitter):
+    """
+    Yields (chunk, start, end) for the transcript split with the offset splitter (chunker.py), start
+    and end are the times in seconds of the first and last segment the chunk covers.
+    """
+    texts, offsets = [], []
+    length = 0
+    for segment in segments:
+        text = " ".join(segment["text"].split())
+        if not text:
+            continue
+        offsets.append((length, segment["start"], segment["start"] + segment.get("duration", 0.0)))
+        texts.append(text)
+        length += len(text) + 1
+    transcript = " ".join(texts)
+    if not transcript:
+        return
+    for start, end in splitter.split_offsets(transcript):
+        first = _segment_at(offsets, start)
+        last = _segment_at(offsets, end - 1)
+        yield transcript[start:end], offsets[first][1], offsets[last][2]
+
+
+def _segment_at(offsets, position):
+    low, high = 0, len(offsets) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if offsets[middle][0] <= position:
+            low = middle
+        else:
+            high = middle - 1
+    return low